@@ -0,0 +1,132 @@
+import re
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# How the development_stage labels of a dataset are turned into ages: parse maps one
+# label to a numeric age or a stage label, and order lists the stage labels from youngest
+# to oldest (None for numeric ages).
+AgeScheme = namedtuple("AgeScheme", ["parse", "order"])
+
+YEARS = re.compile(r"^(\d+(?:\.\d+)?)(?:$|[- ]year)")
+DECADE = re.compile(r"(\d+)-year-old stage")
+ORDINALS = ["first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth"]
+
+def parse_years(label):
+    """'69-year-old human stage' or '69' -> 69.0; labels without a leading age in years -> NaN."""
+    if pd.isnull(label):
+        return np.nan
+    match = YEARS.match(str(label).strip())
+    return float(match.group(1)) if match else np.nan
+
+def map_yoshida_age(dev_stage):
+    if pd.isnull(dev_stage):
+        return np.nan
+    val = str(dev_stage).lower().strip()
+    if "newborn" in val:
+        return "newborn human stage"
+    if "infant" in val:
+        return "infant stage"
+    if "child" in val and ("2-5" in val or "1-4" in val):
+        return "2-5 year-old child stage"
+    if "child" in val and ("6-12" in val or "5-14" in val or "juvenile" in val):
+        return "6-12 year-old child stage"
+    if "child" in val or "pediatric" in val:
+        return "6-12 year-old child stage"
+    if "adolescent" in val:
+        return "adolescent stage"
+    if "adult" in val:
+        return "human adult stage"
+    if "late adult" in val or "aged" in val or "elderly" in val:
+        return "human aged stage"
+    try:
+        num = float(val.split("-")[0])
+        if num < 65:
+            return "human adult stage"
+        else:
+            return "human aged stage"
+    except Exception:
+        return val
+
+def map_stephenson_age(stage):
+    if pd.isnull(stage):
+        return np.nan
+    s = str(stage).lower().strip()
+
+    if "decade stage" in s:
+        return s
+
+    m = DECADE.match(s)
+    if m:
+        decade = min(int(m.group(1)) // 10 + 1, 10)
+        return f"{ORDINALS[decade - 1]} decade stage"
+
+    return stage
+
+NUMERIC = AgeScheme(parse_years, None)
+AGE_SCHEMES = {
+    "AIDA": NUMERIC,
+    "Liu": NUMERIC,
+    "eQTL": NUMERIC,
+    "Yoshida": AgeScheme(map_yoshida_age, ["newborn human stage", "infant stage", "2-5 year-old child stage",
+                                           "6-12 year-old child stage", "adolescent stage", "human adult stage",
+                                           "human aged stage"]),
+    "Stephenson": AgeScheme(map_stephenson_age, [f"{ordinal} decade stage" for ordinal in ORDINALS]),
+}
+
+def age_scheme(dataset_name):
+    """Scheme of a dataset, matched on the start of its name (e.g. 'Yoshida_2022'); numeric ages by default."""
+    for name, scheme in AGE_SCHEMES.items():
+        if dataset_name.lower().startswith(name.lower()):
+            return scheme
+    return NUMERIC
+
+def broadcast(values, func):
+    """
+    Apply func once per distinct value and spread the results to all cells through the
+    category codes, so millions of cells cost as much as their few hundred labels.
+    """
+    categorical = pd.Categorical(values)
+    parsed = pd.Series([func(label) for label in categorical.categories], dtype=object)
+    parsed = pd.concat([parsed, pd.Series([np.nan], dtype=object)], ignore_index=True)
+    return parsed.values[np.where(categorical.codes >= 0, categorical.codes, len(parsed) - 1)]
+
+def stage_codes(labels, order):
+    """
+    Ordinal codes of stage labels: position in order, with labels outside of it
+    following in sorted order. Missing labels get NaN.
+    """
+    categorical = pd.Categorical(labels)
+    known = [label for label in order if label in set(categorical.categories)]
+    extra = sorted(label for label in categorical.categories if label not in set(order))
+    codes = pd.Categorical(labels, categories=known + extra).codes.astype(np.float64)
+    codes[codes < 0] = np.nan
+    return codes
+
+def parse_ages(dataset_name, development_stage):
+    """
+    Parse the development_stage column of a dataset.
+
+    Parameters:
+        dataset_name (str): Dataset name, selects the AGE_SCHEMES entry.
+        development_stage (array-like): Label of every cell, preferably categorical.
+
+    Returns:
+        pd.DataFrame: 'age' (numeric age in years, or the stage label of ordinal datasets)
+            and 'age_code' (the numeric age, or the ordinal stage code), one row per cell.
+    """
+    scheme = age_scheme(dataset_name)
+    ages = broadcast(development_stage, scheme.parse)
+    if scheme.order is None:
+        ages = ages.astype(np.float64)
+        return pd.DataFrame({"age": ages, "age_code": ages})
+    return pd.DataFrame({"age": ages, "age_code": stage_codes(ages, scheme.order)})
+
+def attach_ages(obs, dataset_name):
+    """Add the parsed 'age' and 'age_code' columns to an obs frame in place, unless it already has them."""
+    if "age" in obs.columns and "age_code" in obs.columns:
+        return obs
+    parsed = parse_ages(dataset_name, obs["development_stage"])
+    obs["age"] = parsed["age"].values
+    obs["age_code"] = parsed["age_code"].values
+    return obs
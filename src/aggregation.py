@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+UNKNOWN_DONOR = "unknown"
+
+def factorize_donors(donor_ids):
+    """
+    pd.factorize of donor ids, with missing ids (NaN, None) grouped under UNKNOWN_DONOR
+    instead of the code -1, which would index the last donor.
+
+    Returns:
+        tuple: (np.ndarray of codes, np.ndarray of donors)
+    """
+    codes, uniques = pd.factorize(np.asarray(donor_ids))
+    missing = codes < 0
+    if missing.any():
+        uniques = np.asarray(uniques, dtype=object)
+        known = np.flatnonzero(uniques == UNKNOWN_DONOR)
+        if len(known):
+            code = known[0]
+        else:
+            code, uniques = len(uniques), np.append(uniques, UNKNOWN_DONOR)
+        codes = np.where(missing, code, codes)
+    return codes, uniques
+
+class DonorAggregator:
+    """
+    Streaming per-donor reduction of cell-level predictions.
+
+    Predictions are reduced with np.bincount into per-donor counts, sums and sums
+    of squares, so chunks can be added one at a time without keeping the cells.
+    When expression is passed to update, the mean normalized expression per donor
+    (pseudobulk) is accumulated with a sparse donor x cell indicator product.
+    Cells without a donor id are summarized as the donor UNKNOWN_DONOR.
+    """
+
+    def __init__(self, n_genes=0):
+        self.index = {}
+        self.ages = []
+        self.n_cells = np.zeros(0)
+        self.sums = np.zeros(0)
+        self.squares = np.zeros(0)
+        self.expression = np.zeros((0, n_genes))
+
+    def donor_codes(self, donor_ids, ages=None):
+        inverse, uniques = factorize_donors(donor_ids)
+        _, first = np.unique(inverse, return_index=True)
+
+        codes = np.empty(len(uniques), dtype=np.int64)
+        for i, donor in enumerate(uniques):
+            if donor not in self.index:
+                self.index[donor] = len(self.index)
+                self.ages.append(None if ages is None else np.asarray(ages)[first[i]])
+            codes[i] = self.index[donor]
+
+        grow = len(self.index) - len(self.n_cells)
+        if grow > 0:
+            self.n_cells = np.concatenate([self.n_cells, np.zeros(grow)])
+            self.sums = np.concatenate([self.sums, np.zeros(grow)])
+            self.squares = np.concatenate([self.squares, np.zeros(grow)])
+            self.expression = np.vstack([self.expression, np.zeros((grow, self.expression.shape[1]))])
+
+        return codes[inverse]
+
+    def update(self, donor_ids, predictions, ages=None, X=None):
+        """
+        Add one chunk of cells.
+
+        Parameters:
+            donor_ids (array-like): Donor of every cell.
+            predictions (array-like): Predicted age of every cell.
+            ages (array-like): Age label of every cell; the first label seen per donor is kept.
+            X (scipy.sparse matrix or np.ndarray): Log-normalized expression of the pseudobulk genes.
+        """
+        codes = self.donor_codes(donor_ids, ages)
+        predictions = np.asarray(predictions, dtype=np.float64)
+        n_donors = len(self.index)
+
+        self.n_cells += np.bincount(codes, minlength=n_donors)
+        self.sums += np.bincount(codes, weights=predictions, minlength=n_donors)
+        self.squares += np.bincount(codes, weights=predictions ** 2, minlength=n_donors)
+
+        if X is not None:
+            indicator = sp.csr_matrix(
+                (np.ones(len(codes)), (codes, np.arange(len(codes)))),
+                shape=(n_donors, len(codes))
+            )
+            summed = indicator @ (X.expm1() if sp.issparse(X) else np.expm1(X))
+            self.expression += summed.toarray() if sp.issparse(summed) else summed
+
+    def summary(self):
+        """
+        Returns:
+            pd.DataFrame: One row per donor with 'donor_id', 'age', 'n_cells',
+                'predicted_age' (mean over cells) and 'predicted_age_sd'.
+        """
+        n = np.maximum(self.n_cells, 1)
+        mean = self.sums / n
+        variance = np.maximum(self.squares / n - mean ** 2, 0) * n / np.maximum(n - 1, 1)
+
+        return pd.DataFrame({
+            "donor_id": list(self.index),
+            "age": self.ages,
+            "n_cells": self.n_cells.astype(int),
+            "predicted_age": mean,
+            "predicted_age_sd": np.sqrt(variance),
+        })
+
+    def pseudobulk(self):
+        """
+        Returns:
+            np.ndarray: Log of the mean normalized expression per donor (donors x pseudobulk genes),
+                in the same donor order as summary().
+        """
+        return np.log1p(self.expression / np.maximum(self.n_cells, 1)[:, None])
+
+def donor_summary(predictions):
+    """
+    Reduce a cell-level prediction table to one row per donor.
+
+    Parameters:
+        predictions (pd.DataFrame): 'donor_id', 'predicted_age' and an age column
+            ('true_age' or 'age') per cell.
+
+    Returns:
+        pd.DataFrame: Output of DonorAggregator.summary().
+    """
+    age_column = "true_age" if "true_age" in predictions.columns else "age"
+    aggregator = DonorAggregator()
+    aggregator.update(predictions["donor_id"].values, predictions["predicted_age"].values,
+                      predictions[age_column].values)
+    return aggregator.summary()
@@ -0,0 +1,114 @@
+import os
+import argparse
+from functools import partial
+from config import load_config
+from profiling import enable, print_summary
+from scheduler import WorkUnit, run_units, check_failures, celltype_memory_mb
+import pipeline
+
+def command_shard(config, args):
+    from sharding import shard_h5ad
+    data_path = args.data_path or config["paths"]["aida_path"]
+    dataset_name = os.path.splitext(os.path.basename(data_path))[0]
+    output_folder = args.output_folder or os.path.join(config["paths"]["shard_folder"], dataset_name)
+    shard_h5ad(data_path, output_folder, dataset_name, args.healthy_only, args.chunk_size)
+
+def command_train(config, args):
+    pipeline.train_stage(pipeline.RunManifest(config["paths"]["manifest_path"]), config, force=True)
+
+def command_apply(config, args):
+    from apply_model import apply_unit
+    paths = config["paths"]
+    cell_types = [f.replace("Impute_avg_", "").replace(".csv", "")
+                  for f in os.listdir(paths["imputation_folder"]) if f.endswith(".csv")]
+    sizes = celltype_memory_mb(paths["aida_path"]) if os.path.exists(paths["aida_path"]) else {}
+    units = [WorkUnit("AIDA", cell_type, (cell_type,), sizes.get(cell_type, 0.0)) for cell_type in cell_types]
+
+    task = partial(apply_unit, model_folder=paths["model_folder"], imputation_folder=paths["imputation_folder"],
+                   data_path=paths["aida_path"], output_folder=args.output_folder or paths["predictions_folder"],
+                   shard_dir=paths["shard_dir"], keep_folds=args.keep_folds, compiled_folder=paths["compiled_folder"],
+                   alignment_folder=paths["alignment_folder"], cache_folder=paths["cache_folder"],
+                   cache_budget_mb=config["cache_budget_mb"], donor_level=config["external"]["donor_summary"],
+                   output_format=config["external"]["output_format"], store_folder=paths["store_folder"],
+                   precision=config["external"]["precision"])
+    check_failures(run_units(task, units, config["workers"], config["pool_memory_mb"], config["retries"]))
+
+def run_stages(config, stages, force=False):
+    failures = pipeline.run(config, stages, force)
+    if failures:
+        raise SystemExit(f"Failed stages: {', '.join(failures)}")
+
+def command_apply_external(config, args):
+    run_stages(config, ["apply_external"], force=True)
+
+def command_evaluate(config, args):
+    stages = {"aida": ["evaluate"], "external": ["evaluate_external"]}.get(args.target, ["evaluate", "evaluate_external"])
+    run_stages(config, stages, force=True)
+
+def command_plot(config, args):
+    stages = {"aida": ["plot"], "external": ["plot_external"]}.get(args.target, ["plot", "plot_external"])
+    run_stages(config, stages, force=True)
+
+def command_run(config, args):
+    run_stages(config, args.stages, args.force)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="aging-clock", description="Train, apply and evaluate cell-type-specific aging clocks")
+    parser.add_argument("--config", type=str, default=None, help="JSON config file with paths and worker counts")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--stage_workers", type=int, default=None, help="Number of pipeline stages run at once")
+    parser.add_argument("--pool_memory_mb", type=float, default=None, help="Memory budget shared by all worker processes")
+    parser.add_argument("--datasets", nargs="+", default=None, help="External datasets to process")
+    parser.add_argument("--profile", action="store_true", help="Write per-stage timings to paths.metrics_path")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    shard = subparsers.add_parser("shard", help="Split a .h5ad file into per-cell-type shards")
+    shard.add_argument("--data_path", type=str, default=None, help="Path to the input .h5ad file (default: AIDA)")
+    shard.add_argument("--output_folder", type=str, default=None, help="Folder to save shards (default: <shard_folder>/<dataset>/)")
+    shard.add_argument("--chunk_size", type=int, default=50000, help="Number of rows read from disk at once")
+    shard.add_argument("--healthy_only", action="store_true", help="Keep only cells with disease 'normal'")
+    shard.set_defaults(func=command_shard)
+
+    train = subparsers.add_parser("train", help="Train the clocks of every cell type with an imputation file")
+    train.set_defaults(func=command_train)
+
+    apply = subparsers.add_parser("apply", help="Apply the clocks to AIDA")
+    apply.add_argument("--output_folder", type=str, default=None, help="Folder to save predictions")
+    apply.add_argument("--keep_folds", action="store_true", help="Also save the per-fold predictions")
+    apply.set_defaults(func=command_apply)
+
+    apply_external = subparsers.add_parser("apply-external", help="Apply the clocks to the external datasets")
+    apply_external.set_defaults(func=command_apply_external)
+
+    for name, func, help_text in [("evaluate", command_evaluate, "Summarize prediction performance"),
+                                  ("plot", command_plot, "Draw the figures")]:
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("--target", choices=["aida", "external", "all"], default="all", help="Which predictions to use")
+        sub.set_defaults(func=func)
+
+    run = subparsers.add_parser("run", help="Rebuild the stale stages of the whole pipeline")
+    run.add_argument("--stages", nargs="+", choices=pipeline.STAGES, default=pipeline.STAGES, help="Stages to run")
+    run.add_argument("--force", action="store_true", help="Rebuild everything")
+    run.set_defaults(func=command_run)
+
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    config = load_config(args.config, {
+        "workers": args.workers,
+        "stage_workers": args.stage_workers,
+        "pool_memory_mb": args.pool_memory_mb,
+        "datasets": args.datasets,
+        "profile": {"enabled": True} if args.profile else None,
+    })
+
+    options = config["profile"]
+    metrics_path = config["paths"]["metrics_path"] or os.path.join(config["paths"]["external_predictions_folder"], "metrics.jsonl")
+    if options["enabled"]:
+        enable(metrics_path, options["trace_memory"], options["cprofile_dir"])
+    try:
+        args.func(config, args)
+    finally:
+        if options["enabled"]:
+            print_summary(metrics_path, by=("stage", "dataset"))
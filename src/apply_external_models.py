@@ -1,168 +1,439 @@
 import os
+import argparse
+from functools import partial
 import pandas as pd
 import numpy as np
 import anndata as ad
+import h5py
+try:
+    from anndata.io import read_elem
+except ImportError:  # anndata < 0.11
+    from anndata.experimental import read_elem
 from celltype_mappings import CELLTYPE_MAPPINGS
+from age_parsing import attach_ages
+from preprocessing import PRECISIONS, normalize_counts, read_rows, load_gene_subset, row_nnz, stored_row_bytes, iter_row_chunks, BYTES_PER_NNZ
+from scoring import score_matrix, stack_clocks, score_clocks
+from clock_artifacts import get_clock
+from gene_alignment import GeneAlignment, get_alignment, subset_alignment
+from aggregation import DonorAggregator
+from norm_cache import cache_key, read_cache, write_cache
+from scheduler import WorkUnit, run_units, check_failures, celltype_memory_mb
+from prediction_store import STORE_FOLDER, clear_partition, append_predictions
+from profiling import profile, enable, print_summary
+from precision import TOLERANCE, validate_precision, check_precision, dataset_targets
+from imputation import (STRATEGIES, REFERENCE_STRATEGIES, sample_reference, reference_expression, knn_offsets,
+                        donor_sums, impute_offsets, coverage)
 
 DATA_FOLDER = "../data/"
 MODEL_FOLDER = "../models/"
 IMPUTE_FOLDER = "../data_for_imputation/"
+COMPILED_FOLDER = "../compiled_clocks/"
+ALIGNMENT_FOLDER = "../alignment_cache/"
 OUTPUT_FOLDER = "../predictions_external/"
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+PRECISION = "float32"
+IMPUTATION = "scalar"
+REFERENCE_PATH = "../data/AIDA.h5ad"
+REFERENCE_SHARD_DIR = None
+
+def configure(data_folder=None, model_folder=None, imputation_folder=None, compiled_folder=None,
+              alignment_folder=None, output_folder=None, store_folder=None, precision=None,
+              imputation=None, reference_path=None, reference_shard_dir=None):
+    """
+    Override the module folders, the expression precision ('float32' or 'float64'), the
+    imputation strategy and the training data it draws on, as used by process_celltype;
+    None keeps the current value. Worker processes are spawned and do not inherit the
+    settings: pass configure and settings() as the initializer of their pool.
+    """
+    global DATA_FOLDER, MODEL_FOLDER, IMPUTE_FOLDER, COMPILED_FOLDER, ALIGNMENT_FOLDER, OUTPUT_FOLDER, STORE_FOLDER, PRECISION
+    global IMPUTATION, REFERENCE_PATH, REFERENCE_SHARD_DIR
+    DATA_FOLDER = data_folder or DATA_FOLDER
+    MODEL_FOLDER = model_folder or MODEL_FOLDER
+    IMPUTE_FOLDER = imputation_folder or IMPUTE_FOLDER
+    COMPILED_FOLDER = compiled_folder or COMPILED_FOLDER
+    ALIGNMENT_FOLDER = alignment_folder or ALIGNMENT_FOLDER
+    OUTPUT_FOLDER = output_folder or OUTPUT_FOLDER
+    STORE_FOLDER = store_folder or STORE_FOLDER
+    PRECISION = precision or PRECISION
+    IMPUTATION = imputation or IMPUTATION
+    REFERENCE_PATH = reference_path or REFERENCE_PATH
+    REFERENCE_SHARD_DIR = reference_shard_dir or REFERENCE_SHARD_DIR
+
+def settings():
+    """The current configure() arguments, in order, for configure(*settings()) in a worker process."""
+    return (DATA_FOLDER, MODEL_FOLDER, IMPUTE_FOLDER, COMPILED_FOLDER, ALIGNMENT_FOLDER, OUTPUT_FOLDER, STORE_FOLDER,
+            PRECISION, IMPUTATION, REFERENCE_PATH, REFERENCE_SHARD_DIR)
 
 def log_norm(X):
-    row_sums = np.array(X.sum(axis=1)).flatten()
-    row_sums[row_sums == 0] = 1e-12
-    X = X.multiply(1 / row_sums[:, None]) * 10000
-    return X.log1p()
-
-def map_yoshida_age(dev_stage):
-    if pd.isnull(dev_stage):
-        return np.nan
-    val = str(dev_stage).lower().strip()
-    if "newborn" in val:
-        return "newborn human stage"
-    if "infant" in val:
-        return "infant stage"
-    if "child" in val and ("2-5" in val or "1-4" in val):
-        return "2-5 year-old child stage"
-    if "child" in val and ("6-12" in val or "5-14" in val or "juvenile" in val):
-        return "6-12 year-old child stage"
-    if "child" in val or "pediatric" in val:
-        return "6-12 year-old child stage"
-    if "adolescent" in val:
-        return "adolescent stage"
-    if "adult" in val:
-        return "human adult stage"
-    if "late adult" in val or "aged" in val or "elderly" in val:
-        return "human aged stage"
-    try:
-        num = float(val.split("-")[0])
-        if num < 65:
-            return "human adult stage"
-        else:
-            return "human aged stage"
-    except Exception:
-        return val
-
-
-def map_stephenson_age(stage):
-    if pd.isnull(stage):
-        return np.nan
-    s = str(stage).lower().strip()
-
-    if "decade stage" in s:
-        return s
-
-    import re
-    m = re.match(r"(\d+)-year-old stage", s)
-    if m:
-        age = int(m.group(1))
-        decade = (age // 10) + 1
-        if decade > 10:
-            decade = 10
-        ordinals = {3: "third", 4: "fourth", 5: "fifth", 6: "sixth", 7: "seventh",
-                    8: "eighth", 9: "ninth", 10: "tenth"}
-        decade_str = ordinals.get(decade, f"{decade}th")
-        return f"{decade_str} decade stage"
-
-    return stage
-
-
-def transform_age_column(df, dataset_name):
-    if dataset_name.lower().startswith("yoshida"):
-        df["age"] = df["age"].map(map_yoshida_age)
-    elif dataset_name.lower().startswith("stephenson"):
-        df["age"] = df["age"].map(map_stephenson_age)
-    return df
-
-def get_expression_df(adata, cell_type, healthy_only, dataset_name):
+    return normalize_counts(X, copy=False, dtype=PRECISIONS[PRECISION])
+
+def celltype_indices(adata, cell_type, healthy_only):
     mask = adata.obs["cell_type"] == cell_type
     if healthy_only and "disease" in adata.obs.columns:
         mask &= adata.obs["disease"] == "normal"
-    if not np.any(mask):
-        return None
-
-    subset = adata[mask]
-    X = log_norm(subset.X.tocsr())
-    df = pd.DataFrame(X.toarray(), index=subset.obs_names, columns=subset.var_names)
-
-    df["age"] = subset.obs["development_stage"].values
-    df["donor_id"] = subset.obs["donor_id"].values
-    return df
-
-def apply_clock(df, model_df, impute_df):
-    preds = []
-    for i in range(len(model_df)):
-        print(f"  Applying model {i + 1}/{len(model_df)}...")
-        model = model_df.iloc[i].dropna()
-        intercept = model["intercept"]
-        weights = model.drop("intercept")
-        weights = weights[weights != 0]
-
-        genes_to_use = weights.index
-        present_genes = genes_to_use.intersection(df.columns)
-        missing_genes = genes_to_use.difference(df.columns)
-
-        expr = df[present_genes].copy()
-        print(f"    Using {len(present_genes)} present genes, imputing {len(missing_genes)}")
-
-        if not missing_genes.empty:
-            impute_vals = {
-                gene: impute_df[gene].values[0] if gene in impute_df.columns else 0.0
-                for gene in missing_genes
-            }
-            impute_df_full = pd.DataFrame(
-                np.tile(list(impute_vals.values()), (expr.shape[0], 1)),
-                index=expr.index,
-                columns=missing_genes
-            )
-            expr = pd.concat([expr, impute_df_full], axis=1)
-
-        expr = expr[genes_to_use]
-        pred = expr @ weights.values + intercept
-        preds.append(pred)
-
-    avg_pred = np.mean(preds, axis=0)
-    result = df[["donor_id", "age"]].copy()
+    return np.where(mask)[0]
+
+def obs_metadata(obs):
+    meta = pd.DataFrame(index=obs.index)
+    meta["age"] = obs["age"].values
+    meta["donor_id"] = obs["donor_id"].values
+    return meta
+
+def get_expression_matrix(adata, rows, columns=None):
+    """
+    Log-normalized expression of the given rows, in PRECISION. With columns, only those
+    genes are kept, as a dense array normalized by the library size over all genes.
+    """
+    if columns is None:
+        return log_norm(read_rows(adata.X, rows)), adata.var_names
+    return load_gene_subset(adata.X, rows, columns, dtype=PRECISIONS[PRECISION]), adata.var_names[columns]
+
+def clock_predictions(meta, avg_pred):
+    result = meta[["donor_id", "age"]].copy()
     result["predicted_age"] = avg_pred
-    result["cell_name"] = df.index
+    result["cell_name"] = meta.index
     return result
 
-def process_dataset(dataset_name):
-    print(f"\nProcessing {dataset_name}")
-    file_path = os.path.join(DATA_FOLDER, f"{dataset_name}.h5ad")
-    adata = ad.read_h5ad(file_path, backed="r")
+def apply_clock(X, var_names, meta, clock, alignment=None, offsets=None):
+    print(f"  Applying {len(clock.intercepts)} models...")
+    _, avg_pred = score_matrix(X, var_names, clock, alignment, offsets)
+    return clock_predictions(meta, avg_pred)
+
+_clocks = {}
+
+def load_clock(clock):
+    """
+    The stacked clock from COMPILED_FOLDER or the model CSVs, read once per process and
+    shared by every cell type mapped to it. None if the clock has no model.
+    """
+    key = (clock, MODEL_FOLDER, IMPUTE_FOLDER, COMPILED_FOLDER)
+    if key not in _clocks:
+        _clocks[key] = get_clock(clock, MODEL_FOLDER, IMPUTE_FOLDER, COMPILED_FOLDER)
+    return _clocks[key]
+
+_references = {}
+
+def clock_reference(clock, clock_weights):
+    """
+    Reference expression of the clock genes in a sample of the clock's own cell type of
+    the training data, read once per process. None when the training data lacks the cell type.
+    """
+    if clock not in _references:
+        try:
+            reference = sample_reference(REFERENCE_PATH, clock, REFERENCE_SHARD_DIR)
+            _references[clock] = reference_expression(reference, clock_weights.genes)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"  No reference cells for {clock} ({e}), imputing from the imputation file")
+            _references[clock] = None
+    return _references[clock]
+
+def prediction_file(cell_type, clock, clock_targets):
+    if len(clock_targets) > 1:
+        return f"{cell_type.replace(' ', '_')}_{clock.replace(' ', '_')}.csv"
+    return f"{cell_type.replace(' ', '_')}.csv"
+
+def process_celltype(adata, dataset_name, cell_type, chunk_size=None, memory_budget_mb=None,
+                     alignments=None, gene_subset=False, cache_folder=None, cache_budget_mb=None,
+                     donor_summary=False, pseudobulk=False, output_format="csv", clocks=None):
+    """
+    Apply the matching clocks to one cell type of an external dataset, or only the
+    given clocks of them.
+
+    Without chunk_size and memory_budget_mb the cell type is loaded at once. With either
+    of them, its cells are streamed from the backed file in row chunks whose estimated
+    memory stays within the budget, and predictions are appended to the output per chunk.
+    With gene_subset, only the union of the genes used by the clocks is kept in memory.
+    Otherwise, with cache_folder, the normalized cell type is read from or written to
+    the normalization cache. With donor_summary, per-donor predictions are reduced while
+    the chunks stream and written to donors/; pseudobulk adds the clock applied to the
+    mean normalized expression of each donor. output_format selects CSV files, the
+    partitioned Parquet store (STORE_FOLDER) or both. Missing clock genes are imputed
+    with the IMPUTATION strategy.
+    """
+    print(f"Processing cell type: {cell_type}")
     healthy_only = dataset_name.lower() != "eqtl"
-    mapping = CELLTYPE_MAPPINGS.get(dataset_name, {})
+    stream = chunk_size is not None or memory_budget_mb is not None
+
+    # A normalization cache hit needs neither the counts nor the obs of the dataset, so a
+    # dataset that is not open yet (adata None) is only opened on a miss.
+    key, cached = None, None
+    if cache_folder is not None and not stream and not gene_subset and PRECISION == "float32":
+        key = cache_key(dataset_path(dataset_name) if adata is None else adata.filename, cell_type, healthy_only)
+        cached = read_cache(cache_folder, key)
+    if cached is None and adata is None:
+        adata = open_dataset(dataset_name)
+    if adata is not None:
+        attach_ages(adata.obs, dataset_name)
+        var_names, var = adata.var_names, adata.var
+    else:
+        var_names, var = cached[1], read_var(dataset_name)
+
     output_dir = os.path.join(OUTPUT_FOLDER, dataset_name)
     os.makedirs(output_dir, exist_ok=True)
+    if alignments is None:
+        alignments = {}
 
-    for cell_type in adata.obs["cell_type"].unique():
-        print(f"Processing cell type: {cell_type}")
-        clock_targets = mapping.get(cell_type, cell_type)
-        if isinstance(clock_targets, str):
-            clock_targets = [clock_targets]
+    clock_targets = CELLTYPE_MAPPINGS.get(dataset_name, {}).get(cell_type, cell_type)
+    if isinstance(clock_targets, str):
+        clock_targets = [clock_targets]
 
-        df = get_expression_df(adata, cell_type, healthy_only, dataset_name)
-        if df is None or df.empty:
+    selected = clock_targets if clocks is None else [clock for clock in clock_targets if clock in clocks]
+    clocks = {}
+    for clock in selected:
+        clock_weights = load_clock(clock)
+        if clock_weights is None:
+            print(f"Skipping {cell_type} → {clock}: missing model or impute")
             continue
 
-        for clock in clock_targets:
-            model_path = os.path.join(MODEL_FOLDER, f"{clock}_models5.csv")
-            impute_path = os.path.join(IMPUTE_FOLDER, f"Impute_avg_{clock}.csv")
-            if not (os.path.exists(model_path) and os.path.exists(impute_path)):
-                print(f"Skipping {cell_type} → {clock}: missing model or impute")
+        if clock not in alignments:
+            aliases = var["feature_name"] if "feature_name" in var.columns else None
+            alignments[clock] = get_alignment(var_names, clock_weights.genes, ALIGNMENT_FOLDER, aliases)
+        clocks[clock] = clock_weights
+
+    if not clocks:
+        return
+
+    references = {}
+    if IMPUTATION in REFERENCE_STRATEGIES:
+        references = {clock: clock_reference(clock, clocks[clock]) for clock in clocks if len(alignments[clock].missing)}
+
+    if cached is not None:
+        chunks = [None]
+    else:
+        indices = celltype_indices(adata, cell_type, healthy_only)
+        if len(indices) == 0:
+            return
+        if stream:
+            chunks = iter_row_chunks(indices, row_nnz(adata)[indices] * BYTES_PER_NNZ, chunk_size, memory_budget_mb)
+        else:
+            chunks = [indices]
+
+    columns = None
+    clock_alignments = {clock: alignments[clock] for clock in clocks}
+    if gene_subset:
+        columns = np.unique(np.concatenate([alignments[clock].columns for clock in clocks]))
+        clock_alignments = {clock: subset_alignment(alignments[clock], columns) for clock in clocks}
+        print(f"  Loading {len(columns)} of {adata.n_vars} genes")
+    block = stack_clocks(clocks, clock_alignments)
+
+    donor_totals = {}
+    if stream and IMPUTATION == "donor_mean":
+        # A donor's cells can span several chunks, so a first pass sums the knn offsets of every donor.
+        chunks = list(chunks)
+        donor_totals = {clock: {} for clock in references if references[clock] is not None}
+        for rows in chunks if donor_totals else []:
+            X, _ = get_expression_matrix(adata, rows, columns)
+            donor_ids = adata.obs["donor_id"].values[rows]
+            for clock, totals in donor_totals.items():
+                donor_sums(knn_offsets(X, clocks[clock], clock_alignments[clock], references[clock]), donor_ids, totals)
+
+    aggregators = {}
+    if donor_summary or pseudobulk:
+        aggregators = {clock: DonorAggregator(len(clock_alignments[clock].columns) if pseudobulk else 0)
+                       for clock in clocks}
+
+    disk_bytes = None if adata is None else stored_row_bytes(adata)
+    labels = {"dataset": dataset_name, "cell_type": cell_type}
+
+    for i, rows in enumerate(chunks):
+        if stream:
+            print(f"  Chunk {i + 1}: {len(rows)} cells")
+
+        with profile("load", **labels) as counters:
+            if cached is not None:
+                print("  Loaded from normalization cache")
+                X, _, meta = cached
+                counters["bytes_read"] = int(X.data.nbytes + X.indices.nbytes)
+            else:
+                X, _ = get_expression_matrix(adata, rows, columns)
+                meta = obs_metadata(adata.obs.iloc[rows])
+                counters["bytes_read"] = int(disk_bytes[rows].sum())
+                if key is not None:
+                    write_cache(cache_folder, key, X, var_names, meta, cache_budget_mb)
+            counters["cells"] = len(meta)
+            counters["cache_hit"] = cached is not None
+
+        with profile("score", clocks=len(clocks), **labels) as counters:
+            print(f"  Applying {len(block.intercepts)} models of {len(clocks)} clocks...")
+            offsets = {clock: impute_offsets(IMPUTATION, X, clocks[clock], clock_alignments[clock], references[clock],
+                                             meta["donor_id"].values, donor_totals=donor_totals.get(clock))
+                       for clock in references if references[clock] is not None}
+            scores = score_clocks(X, block, offsets)
+            counters["cells"] = len(meta)
+
+        for clock in clocks:
+            predictions = clock_predictions(meta, scores[clock][1])
+
+            with profile("write", clock=clock, **labels) as counters:
+                if output_format in ("csv", "both"):
+                    out_path = os.path.join(output_dir, prediction_file(cell_type, clock, clock_targets))
+                    predictions.to_csv(out_path, index=False, mode="w" if i == 0 else "a", header=i == 0)
+                if output_format in ("parquet", "both"):
+                    if i == 0:
+                        clear_partition(STORE_FOLDER, dataset_name, cell_type, clock)
+                    append_predictions(STORE_FOLDER, dataset_name, cell_type, clock, predictions)
+                counters["cells"] = len(predictions)
+
+            if clock in aggregators:
+                with profile("aggregate", clock=clock, **labels) as counters:
+                    aggregators[clock].update(predictions["donor_id"].values, predictions["predicted_age"].values,
+                                              predictions["age"].values,
+                                              X[:, clock_alignments[clock].columns] if pseudobulk else None)
+                    counters["cells"] = len(predictions)
+
+    for clock, aggregator in aggregators.items():
+        with profile("donor_summary", clock=clock, **labels):
+            summary = aggregator.summary()
+            if pseudobulk:
+                alignment = clock_alignments[clock]
+                bulk_alignment = GeneAlignment(alignment.present, np.arange(len(alignment.present)), alignment.missing)
+                _, summary["pseudobulk_predicted_age"] = score_matrix(aggregator.pseudobulk(), None, clocks[clock], bulk_alignment)
+
+            os.makedirs(os.path.join(output_dir, "donors"), exist_ok=True)
+            summary.to_csv(os.path.join(output_dir, "donors", prediction_file(cell_type, clock, clock_targets)), index=False)
+
+_open_datasets = {}
+
+def dataset_path(dataset_name):
+    return os.path.join(DATA_FOLDER, f"{dataset_name}.h5ad")
+
+def read_var(dataset_name):
+    """The var frame of a dataset, read without loading its obs."""
+    with h5py.File(dataset_path(dataset_name), "r") as f:
+        return read_elem(f["var"])
+
+def open_dataset(dataset_name):
+    if dataset_name not in _open_datasets:
+        _open_datasets[dataset_name] = ad.read_h5ad(dataset_path(dataset_name), backed="r")
+        attach_ages(_open_datasets[dataset_name].obs, dataset_name)
+    return _open_datasets[dataset_name]
+
+def process_dataset(dataset_name, chunk_size=None, memory_budget_mb=None, gene_subset=False,
+                    cache_folder=None, cache_budget_mb=None, donor_summary=False, pseudobulk=False,
+                    output_format="csv"):
+    print(f"\nProcessing {dataset_name}")
+    adata = open_dataset(dataset_name)
+    alignments = {}
+
+    for cell_type in adata.obs["cell_type"].unique():
+        with profile("celltype", cprofile=True, dataset=dataset_name, cell_type=cell_type):
+            process_celltype(adata, dataset_name, cell_type, chunk_size, memory_budget_mb, alignments, gene_subset,
+                             cache_folder, cache_budget_mb, donor_summary, pseudobulk, output_format)
+
+def process_unit(unit, chunk_size=None, memory_budget_mb=None, gene_subset=False,
+                 cache_folder=None, cache_budget_mb=None, donor_summary=False, pseudobulk=False,
+                 output_format="csv"):
+    with profile("celltype", cprofile=True, dataset=unit.dataset, cell_type=unit.cell_type):
+        process_celltype(_open_datasets.get(unit.dataset), unit.dataset, unit.cell_type, chunk_size, memory_budget_mb,
+                         gene_subset=gene_subset, cache_folder=cache_folder, cache_budget_mb=cache_budget_mb,
+                         donor_summary=donor_summary, pseudobulk=pseudobulk, output_format=output_format,
+                         clocks=unit.clocks)
+
+def validate_dataset_precision(dataset_name, sample_size=1000, tolerance=TOLERANCE):
+    """
+    Score a sample of every cell type of a dataset in float32 and float64 and raise
+    ValueError when any clock differs by more than tolerance years.
+    """
+    adata = open_dataset(dataset_name)
+    report = validate_precision(adata, dataset_targets(dataset_name, adata), MODEL_FOLDER, IMPUTE_FOLDER,
+                                COMPILED_FOLDER, sample_size, tolerance, dataset_name.lower() != "eqtl")
+    if len(report):
+        print(f"{dataset_name}: float32 max abs error {report['max_abs_error'].max():.2g} years over {len(report)} clocks")
+    check_precision(report, tolerance)
+    return report
+
+def imputation_coverage(dataset_name):
+    """
+    Write {dataset}/reports/imputation_coverage.csv with, for every (cell type, clock), the
+    clock genes present in and missing from the dataset, the share of the clock weight
+    on missing genes and the imputation strategy.
+
+    Returns:
+        pd.DataFrame: The report.
+    """
+    adata = open_dataset(dataset_name)
+    aliases = adata.var["feature_name"] if "feature_name" in adata.var.columns else None
+    rows = []
+    for unit in dataset_units(dataset_name):
+        for clock in unit.clocks:
+            clock_weights = load_clock(clock)
+            if clock_weights is None:
                 continue
+            alignment = get_alignment(adata.var_names, clock_weights.genes, ALIGNMENT_FOLDER, aliases)
+            rows.append({"dataset": dataset_name, "cell_type": unit.cell_type, "clock": clock, **coverage(clock_weights, alignment),
+                         "strategy": IMPUTATION})
+
+    report = pd.DataFrame(rows)
+    report_dir = os.path.join(OUTPUT_FOLDER, dataset_name, "reports")
+    os.makedirs(report_dir, exist_ok=True)
+    report.to_csv(os.path.join(report_dir, "imputation_coverage.csv"), index=False)
+    if len(report):
+        print(f"{dataset_name}: {report['n_missing'].sum()} of {report['n_genes'].sum()} clock genes imputed "
+              f"({report['missing_weight_share'].mean():.1%} of the weight on average)")
+    return report
 
-            model_df = pd.read_csv(model_path)
-            impute_df = pd.read_csv(impute_path)
-            predictions = apply_clock(df.copy(), model_df, impute_df)
-            predictions = transform_age_column(predictions, dataset_name)
+def dataset_units(dataset_name):
+    file_path = os.path.join(DATA_FOLDER, f"{dataset_name}.h5ad")
+    healthy_only = dataset_name.lower() != "eqtl"
+    mapping = CELLTYPE_MAPPINGS.get(dataset_name, {})
 
-            out_file = f"{cell_type.replace(' ', '_')}.csv"
-            predictions.to_csv(os.path.join(output_dir, out_file), index=False)
+    units = []
+    for cell_type, memory_mb in celltype_memory_mb(file_path, healthy_only).items():
+        clocks = mapping.get(cell_type, cell_type)
+        clocks = (clocks,) if isinstance(clocks, str) else tuple(clocks)
+        units.append(WorkUnit(dataset_name, cell_type, clocks, memory_mb))
+    return units
 
 if __name__ == "__main__":
-    for dataset in ["Yoshida", "Liu", "eQTL", "Stephenson"]:
-        process_dataset(dataset)
+    parser = argparse.ArgumentParser(description="Apply AIDA clocks to external datasets")
+    parser.add_argument("--datasets", nargs="+", default=["Yoshida", "Liu", "eQTL", "Stephenson"], help="Datasets to process")
+    parser.add_argument("--chunk_size", type=int, default=None, help="Stream cells in chunks of at most this many rows")
+    parser.add_argument("--memory_budget_mb", type=float, default=None, help="Stream cells in chunks that fit this memory budget")
+    parser.add_argument("--gene_subset", action="store_true", help="Load only the genes used by the clocks")
+    parser.add_argument("--cache_folder", type=str, default=None, help="Folder to cache normalized expression")
+    parser.add_argument("--cache_budget_mb", type=float, default=None, help="Disk budget of the normalization cache")
+    parser.add_argument("--donor_summary", action="store_true", help="Also save per-donor predictions")
+    parser.add_argument("--pseudobulk", action="store_true", help="Also score the mean expression of each donor")
+    parser.add_argument("--output_format", choices=["csv", "parquet", "both"], default="csv", help="Save predictions as CSV, to the Parquet store or both")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="float32", help="Floating point precision of normalization and scoring")
+    parser.add_argument("--precision_sample", type=int, default=1000, help="Cells per cell type checked against float64 before a float32 run (0 to skip)")
+    parser.add_argument("--precision_tolerance", type=float, default=TOLERANCE, help="Largest accepted float32 age error in years")
+    parser.add_argument("--imputation", choices=STRATEGIES, default="scalar", help="How clock genes missing from a dataset are imputed")
+    parser.add_argument("--reference_path", type=str, default=REFERENCE_PATH, help="Training .h5ad file used by the reference imputation strategies")
+    parser.add_argument("--reference_shard_dir", type=str, default=None, help="Shards of the training data, used instead of --reference_path")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--pool_memory_mb", type=float, default=None, help="Memory budget shared by all worker processes")
+    parser.add_argument("--retries", type=int, default=1, help="Number of retries for a failed cell type")
+    parser.add_argument("--profile", action="store_true", help="Write per-stage timings to metrics.jsonl next to the predictions")
+    parser.add_argument("--trace_memory", action="store_true", help="Also track peak Python allocations per stage")
+    parser.add_argument("--cprofile_dir", type=str, default=None, help="Folder for cProfile dumps of every cell type")
+
+    args = parser.parse_args()
+
+    metrics_path = os.path.join(OUTPUT_FOLDER, "metrics.jsonl")
+    if args.profile:
+        enable(metrics_path, args.trace_memory, args.cprofile_dir)
+
+    configure(precision=args.precision, imputation=args.imputation, reference_path=args.reference_path,
+              reference_shard_dir=args.reference_shard_dir)
+    for dataset in args.datasets:
+        imputation_coverage(dataset)
+        if args.precision == "float32" and args.precision_sample > 0:
+            validate_dataset_precision(dataset, args.precision_sample, args.precision_tolerance)
+
+    failures = {}
+    if args.workers > 1:
+        units = [unit for dataset in args.datasets for unit in dataset_units(dataset)]
+        task = partial(process_unit, chunk_size=args.chunk_size, memory_budget_mb=args.memory_budget_mb,
+                       gene_subset=args.gene_subset, cache_folder=args.cache_folder,
+                       cache_budget_mb=args.cache_budget_mb, donor_summary=args.donor_summary,
+                       pseudobulk=args.pseudobulk, output_format=args.output_format)
+        failures = run_units(task, units, args.workers, args.pool_memory_mb, args.retries, configure, settings())
+    else:
+        for dataset in args.datasets:
+            process_dataset(dataset, args.chunk_size, args.memory_budget_mb, args.gene_subset,
+                            args.cache_folder, args.cache_budget_mb, args.donor_summary, args.pseudobulk,
+                            args.output_format)
+
+    if args.profile:
+        print_summary(metrics_path)
+    check_failures(failures)
@@ -1,9 +1,19 @@
 import pandas as pd
 import argparse
 import os
-from preprocessing import load_celltype_data
-
-def apply_model(cell_type, model_folder, imputation_folder, data_path, output_folder="./predictions/"):
+from functools import partial
+from preprocessing import PRECISIONS, load_celltype
+from scoring import score_matrix
+from clock_artifacts import get_clock
+from gene_alignment import get_alignment
+from aggregation import donor_summary
+from scheduler import WorkUnit, run_units, check_failures, celltype_memory_mb
+from prediction_store import STORE_FOLDER, write_predictions
+from profiling import profile, enable, print_summary
+
+def apply_model(cell_type, model_folder, imputation_folder, data_path, output_folder="./predictions/", shard_dir=None, keep_folds=False, compiled_folder=None, alignment_folder=None,
+                cache_folder=None, cache_budget_mb=None, donor_level=False, output_format="csv", store_folder=STORE_FOLDER,
+                precision="float32"):
     """
     Apply the pretrained ElasticNet models to predict age for a given cell type.
 
@@ -13,96 +23,103 @@ def apply_model(cell_type, model_folder, imputation_folder, data_path, output_fo
         imputation_folder (str): Path to folder containing imputation CSVs.
         data_path (str): Path to the .h5ad data file.
         output_folder (str): Folder to save prediction results.
+        shard_dir (str): Optional folder with per-cell-type shards written by sharding.py.
+        keep_folds (bool): Also save the prediction of every fold model next to the ensemble mean.
+        compiled_folder (str): Optional folder with compiled clocks, used instead of the CSVs when available.
+        alignment_folder (str): Optional folder to cache gene alignments between the data and the clock.
+        cache_folder (str): Optional folder to cache normalized expression per cell type.
+        cache_budget_mb (float): Disk budget of the normalization cache.
+        donor_level (bool): Also save one row per donor with the mean and spread of its predictions.
+        output_format (str): 'csv', 'parquet' (partitioned store under store_folder, dataset named
+            after the data file) or 'both'.
+        store_folder (str): Root of the Parquet prediction store.
+        precision (str): 'float32' or 'float64' expression for normalization and scoring.
     """
-    df = load_celltype_data(data_path, cell_type)
-
-    impute_file = os.path.join(imputation_folder, f"Impute_avg_{cell_type}.csv")
-    if not os.path.exists(impute_file):
-        print(f"Imputation file for {cell_type} not found, skipping.")
-        return
-
-    model_file = os.path.join(model_folder, f"{cell_type}_models5.csv")
-    if not os.path.exists(model_file):
-        print(f"Model file for {cell_type} not found, skipping.")
+    clock = get_clock(cell_type, model_folder, imputation_folder, compiled_folder)
+    if clock is None:
+        print(f"Model or imputation file for {cell_type} not found, skipping.")
         return
 
-    impute = pd.read_csv(impute_file, index_col=0)
-    models = pd.read_csv(model_file, index_col=0)
-
-    results = []
-
-    for i in range(len(models)):
-        model = models.iloc[i].dropna()
-        model_coeff = model.drop('intercept')
-        model_intercept = model['intercept']
-
-        model_genes = model_coeff.index
-        available_genes = df.columns.intersection(model_genes)
-        missing_genes = model_genes.difference(df.columns)
-
-        input_data = df[available_genes].copy()
-
-        if not missing_genes.empty:
-            imputed_values = {}
-            for gene in missing_genes:
-                if gene in impute.columns:
-                    imputed_values[gene] = impute[gene].values[0]
-                else:
-                    imputed_values[gene] = 0.0
-
-            imputed_df = pd.DataFrame(
-                {gene: [value] * len(input_data) for gene, value in imputed_values.items()},
-                index=input_data.index
-            )
-
-            input_data = pd.concat([input_data, imputed_df], axis=1)
-
-            print(f"Imputed {len(missing_genes)} missing genes for model {i + 1} for {cell_type}.")
-
-        input_data = input_data[model_genes]
-
-        preds = input_data.dot(model_coeff.values) + model_intercept
-
-        temp_df = pd.DataFrame({
-            "cell_id": df["cell_id"],
-            "predicted_age": preds,
-            "true_age": df["age"],
-            "donor_id": df["donor_id"]
-        })
-        results.append(temp_df)
-
-    # final_results = pd.concat(results).reset_index(drop=True)
-    #
-    # os.makedirs(output_folder, exist_ok=True)
-    # output_file = os.path.join(output_folder, f"predictions_{cell_type}.csv")
-    # final_results.to_csv(output_file, index=False)
-
-    final_results = pd.concat(results)
-    aggregated = final_results.groupby("cell_id").agg({
-        "predicted_age": "mean",
-        "true_age": "first",
-        "donor_id": "first"
-    }).reset_index()
+    dataset = os.path.splitext(os.path.basename(data_path))[0]
+    labels = {"dataset": dataset, "cell_type": cell_type, "clock": cell_type}
+    with profile("load", **labels) as counters:
+        data = load_celltype(data_path, cell_type, shard_dir, cache_folder, cache_budget_mb, PRECISIONS[precision])
+        counters["cells"] = data.X.shape[0]
+        counters["nnz"] = data.X.nnz
+
+    with profile("score", cprofile=True, **labels) as counters:
+        alignment = get_alignment(data.var_names, clock.genes, alignment_folder)
+        fold_preds, preds = score_matrix(data.X, data.var_names, clock, alignment)
+        counters["cells"] = data.X.shape[0]
+
+    results = pd.DataFrame({
+        "cell_id": data.obs["cell_id"].values,
+        "predicted_age": preds,
+        "true_age": data.obs["age"].values,
+        "donor_id": data.obs["donor_id"].values
+    })
+
+    if keep_folds:
+        for i in range(fold_preds.shape[1]):
+            results[f"predicted_age_model{i + 1}"] = fold_preds[:, i]
 
     os.makedirs(output_folder, exist_ok=True)
     output_file = os.path.join(output_folder, f"predictions_{cell_type}.csv")
-    aggregated.to_csv(output_file, index=False)
+    with profile("write", **labels) as counters:
+        write_predictions(results, output_file, store_folder, dataset, cell_type, cell_type, output_format)
+        counters["rows"] = len(results)
+
+    if donor_level:
+        os.makedirs(os.path.join(output_folder, "donors"), exist_ok=True)
+        donor_summary(results).to_csv(os.path.join(output_folder, "donors", f"predictions_{cell_type}.csv"), index=False)
+
+def apply_unit(unit, **kwargs):
+    apply_model(unit.cell_type, **kwargs)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Apply pre-trained ElasticNet model to new data")
     parser.add_argument("--model_folder", type=str, default="../models/", help="Folder containing trained models")
     parser.add_argument("--imputation_folder", type=str, default="../data_for_imputation/", help="Folder containing imputation files")
+    parser.add_argument("--compiled_folder", type=str, default="../compiled_clocks/", help="Folder containing compiled clocks")
+    parser.add_argument("--alignment_folder", type=str, default="../alignment_cache/", help="Folder to cache gene alignments")
+    parser.add_argument("--cache_folder", type=str, default=None, help="Folder to cache normalized expression")
+    parser.add_argument("--cache_budget_mb", type=float, default=None, help="Disk budget of the normalization cache")
     parser.add_argument("--data_path", type=str, default="../data/AIDA.h5ad", help="Path to the input .h5ad file")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Folder with per-cell-type shards written by sharding.py")
     parser.add_argument("--output_folder", type=str, default="../predictions/", help="Folder to save predictions")
+    parser.add_argument("--keep_folds", action="store_true", help="Also save the per-fold predictions")
+    parser.add_argument("--donor_summary", action="store_true", help="Also save per-donor predictions")
+    parser.add_argument("--output_format", choices=["csv", "parquet", "both"], default="csv", help="Save predictions as CSV, to the Parquet store or both")
+    parser.add_argument("--store_folder", type=str, default=STORE_FOLDER, help="Root of the Parquet prediction store")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="float32", help="Floating point precision of normalization and scoring")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--pool_memory_mb", type=float, default=None, help="Memory budget shared by all worker processes")
+    parser.add_argument("--retries", type=int, default=1, help="Number of retries for a failed cell type")
+    parser.add_argument("--profile", action="store_true", help="Write per-stage timings to metrics.jsonl next to the predictions")
+    parser.add_argument("--trace_memory", action="store_true", help="Also track peak Python allocations per stage")
+    parser.add_argument("--cprofile_dir", type=str, default=None, help="Folder for cProfile dumps of every scoring step")
 
     args = parser.parse_args()
 
+    metrics_path = os.path.join(args.output_folder, "metrics.jsonl")
+    if args.profile:
+        enable(metrics_path, args.trace_memory, args.cprofile_dir)
+
     cell_types = [f.replace("Impute_avg_", "").replace(".csv", "") for f in os.listdir(args.imputation_folder) if f.endswith(".csv")]
 
-    for cell_type in cell_types:
-        try:
-            apply_model(cell_type, args.model_folder, args.imputation_folder, args.data_path, args.output_folder)
-        except Exception as e:
-            print(f"Failed for {cell_type}: {e}")
+    sizes = celltype_memory_mb(args.data_path) if os.path.exists(args.data_path) else {}
+    units = [WorkUnit("AIDA", cell_type, (cell_type,), sizes.get(cell_type, 0.0)) for cell_type in cell_types]
+
+    task = partial(apply_unit, model_folder=args.model_folder, imputation_folder=args.imputation_folder,
+                   data_path=args.data_path, output_folder=args.output_folder, shard_dir=args.shard_dir,
+                   keep_folds=args.keep_folds, compiled_folder=args.compiled_folder,
+                   alignment_folder=args.alignment_folder, cache_folder=args.cache_folder,
+                   cache_budget_mb=args.cache_budget_mb, donor_level=args.donor_summary,
+                   output_format=args.output_format, store_folder=args.store_folder, precision=args.precision)
+    failures = run_units(task, units, args.workers, args.pool_memory_mb, args.retries)
+
+    if args.profile:
+        print_summary(metrics_path)
 
+    check_failures(failures)
     print("Done applying models for all available cell types!")
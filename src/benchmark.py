@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+import anndata as ad
+from synthetic_data import make_dataset, make_clocks
+from preprocessing import load_celltype, load_celltype_data, read_rows, normalize_counts
+from train_model import train_matrix_by_fold
+from clock_artifacts import get_clock
+from apply_external_models import apply_clock
+from apply_model import apply_model
+from metrics import evaluate_groups
+from profiling import peak_rss_mb
+from age_parsing import parse_ages
+
+BENCHMARK_FOLDER = "../benchmarks/"
+BASELINE_PATH = "../benchmarks/baseline.json"
+
+# Synthetic dataset parameters per scale: cells, genes, density, cell types, donors.
+SCALES = {
+    "small": {"n_cells": 5000, "n_genes": 2000, "density": 0.05, "n_cell_types": 3, "n_donors": 20},
+    "medium": {"n_cells": 50000, "n_genes": 5000, "density": 0.05, "n_cell_types": 4, "n_donors": 60},
+    "large": {"n_cells": 250000, "n_genes": 15000, "density": 0.04, "n_cell_types": 6, "n_donors": 200},
+}
+STEPS = ["load", "load_frame", "normalize", "train", "score", "apply", "evaluate"]
+
+def measure(func, repeats=1):
+    """
+    Run func repeats times and keep the fastest run.
+
+    Returns:
+        tuple: (result of the last run, seconds, peak traced allocation in MB).
+    """
+    best_seconds, best_peak = np.inf, 0.0
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+        if seconds < best_seconds:
+            best_seconds, best_peak = seconds, peak
+    return result, best_seconds, best_peak
+
+def prepare_scale(scale, benchmark_folder=BENCHMARK_FOLDER, seed=0):
+    """
+    Generate the synthetic dataset and clocks of a scale once; later runs reuse them
+    as long as params.json matches.
+
+    Returns:
+        str: Folder with data/AIDA.h5ad, models/ and data_for_imputation/.
+    """
+    params = {**SCALES[scale], "seed": seed}
+    folder = os.path.join(benchmark_folder, "data", scale)
+    params_path = os.path.join(folder, "params.json")
+    if os.path.exists(params_path):
+        with open(params_path) as f:
+            if json.load(f) == params:
+                return folder
+        shutil.rmtree(folder)
+
+    var_names = make_dataset(os.path.join(folder, "data", "AIDA.h5ad"), seed=seed, **SCALES[scale])
+    cell_types = ad.read_h5ad(os.path.join(folder, "data", "AIDA.h5ad"), backed="r").obs["cell_type"].cat.categories
+    make_clocks(var_names, cell_types, os.path.join(folder, "models"), os.path.join(folder, "data_for_imputation"), seed=seed)
+    with open(params_path, "w") as f:
+        json.dump(params, f)
+    return folder
+
+def run_scale(scale, benchmark_folder=BENCHMARK_FOLDER, steps=STEPS, repeats=1, n_boot=200):
+    """
+    Time the pipeline steps on the largest cell type of a synthetic dataset.
+
+    Steps: load (load_celltype), load_frame (legacy load_celltype_data), normalize
+    (normalize_counts on raw rows), train (train_matrix_by_fold), score (apply_clock
+    with a stacked clock), apply (apply_model, including reading and writing) and
+    evaluate (evaluate_groups with a donor bootstrap over all cell types).
+
+    Returns:
+        pd.DataFrame: One row per step with seconds, cells, cells_per_sec and peak_mb.
+    """
+    folder = prepare_scale(scale, benchmark_folder)
+    data_path = os.path.join(folder, "data", "AIDA.h5ad")
+    model_folder, imputation_folder = os.path.join(folder, "models"), os.path.join(folder, "data_for_imputation")
+
+    adata = ad.read_h5ad(data_path, backed="r")
+    sizes = adata.obs["cell_type"].value_counts()
+    cell_type = sizes.index[0]
+    indices = np.where(adata.obs["cell_type"] == cell_type)[0]
+    n_cells = len(indices)
+
+    timings = []
+    def record(step, seconds, peak_mb, cells=n_cells):
+        timings.append({"scale": scale, "step": step, "seconds": seconds, "cells": cells,
+                        "cells_per_sec": cells / seconds if seconds > 0 else np.nan, "peak_mb": peak_mb})
+        print(f"  {scale:>6} {step:<10} {seconds:8.3f} s {peak_mb:9.1f} MB")
+
+    data, seconds, peak = measure(lambda: load_celltype(data_path, cell_type), repeats)
+    if "load" in steps:
+        record("load", seconds, peak)
+
+    if "load_frame" in steps:
+        _, seconds, peak = measure(lambda: load_celltype_data(data_path, cell_type), repeats)
+        record("load_frame", seconds, peak)
+
+    if "normalize" in steps:
+        raw = read_rows(adata.X, indices)
+        _, seconds, peak = measure(lambda: normalize_counts(raw), repeats)
+        record("normalize", seconds, peak)
+
+    if "train" in steps:
+        _, seconds, peak = measure(lambda: train_matrix_by_fold(data), repeats)
+        record("train", seconds, peak)
+
+    clock = get_clock(cell_type, model_folder, imputation_folder)
+    if "score" in steps:
+        _, seconds, peak = measure(lambda: apply_clock(data.X, data.var_names, data.obs, clock), repeats)
+        record("score", seconds, peak)
+
+    if "apply" in steps:
+        output_folder = os.path.join(benchmark_folder, "predictions", scale)
+        _, seconds, peak = measure(lambda: apply_model(cell_type, model_folder, imputation_folder, data_path, output_folder), repeats)
+        record("apply", seconds, peak)
+
+    if "evaluate" in steps:
+        cells = len(adata.obs)
+        rng = np.random.default_rng(0)
+        ages = parse_ages("AIDA", adata.obs["development_stage"])["age"].values
+        predictions = pd.DataFrame({"cell_type": adata.obs["cell_type"].values, "donor_id": adata.obs["donor_id"].values,
+                                    "true_age": ages, "predicted_age": ages + rng.normal(0, 10, cells)})
+        _, seconds, peak = measure(lambda: evaluate_groups(predictions, "cell_type", n_boot=n_boot), repeats)
+        record("evaluate", seconds, peak, cells)
+
+    return pd.DataFrame(timings)
+
+def compare(results, baseline, threshold=0.2, min_seconds=0.1, min_mb=1.0):
+    """
+    Join results with baseline timings and flag steps more than threshold slower or
+    larger in peak memory than the baseline. Differences below min_seconds and min_mb
+    are timer and allocator noise and are never flagged.
+
+    Parameters:
+        results (pd.DataFrame): Output of run_scale for one or more scales.
+        baseline (dict): {scale: {step: {"seconds": ..., "peak_mb": ...}}}.
+        threshold (float): Allowed relative increase.
+        min_seconds (float): Smallest absolute slowdown reported.
+        min_mb (float): Smallest absolute memory growth reported.
+
+    Returns:
+        pd.DataFrame: results with baseline columns, time and memory ratios and a 'regression' flag.
+    """
+    report = results.copy()
+    report["baseline_seconds"] = [baseline.get(scale, {}).get(step, {}).get("seconds", np.nan)
+                                  for scale, step in zip(report["scale"], report["step"])]
+    report["baseline_peak_mb"] = [baseline.get(scale, {}).get(step, {}).get("peak_mb", np.nan)
+                                  for scale, step in zip(report["scale"], report["step"])]
+    report["time_ratio"] = report["seconds"] / report["baseline_seconds"]
+    report["memory_ratio"] = report["peak_mb"] / report["baseline_peak_mb"]
+    slower = (report["time_ratio"] > 1 + threshold) & (report["seconds"] - report["baseline_seconds"] > min_seconds)
+    larger = (report["memory_ratio"] > 1 + threshold) & (report["peak_mb"] - report["baseline_peak_mb"] > min_mb)
+    report["regression"] = slower | larger
+    return report
+
+def to_baseline(results):
+    baseline = {}
+    for row in results.itertuples():
+        baseline.setdefault(row.scale, {})[row.step] = {"seconds": row.seconds, "peak_mb": row.peak_mb}
+    return baseline
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loading, training, scoring and evaluation on synthetic data")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["small", "medium"], help="Dataset sizes to run")
+    parser.add_argument("--steps", nargs="+", choices=STEPS, default=STEPS, help="Steps to time")
+    parser.add_argument("--benchmark_folder", type=str, default=BENCHMARK_FOLDER, help="Folder for the synthetic data and results")
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH, help="JSON file with baseline timings")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown or memory growth reported as a regression")
+    parser.add_argument("--min_seconds", type=float, default=0.1, help="Smallest absolute slowdown reported as a regression")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per step; the fastest is kept")
+    parser.add_argument("--save_baseline", action="store_true", help="Store these results as the new baseline")
+
+    args = parser.parse_args()
+
+    results = pd.concat([run_scale(scale, args.benchmark_folder, args.steps, args.repeats) for scale in args.scales],
+                        ignore_index=True)
+    results.to_csv(os.path.join(args.benchmark_folder, "results.csv"), index=False)
+    print(f"Peak RSS: {peak_rss_mb():.0f} MB")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for scale, steps in to_baseline(results).items():
+            baseline.setdefault(scale, {}).update(steps)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1)
+        print(f"Saved baseline to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(results.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        print(f"No baseline at {args.baseline}; run with --save_baseline to create one")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        report = compare(results, json.load(f), args.threshold, args.min_seconds)
+    columns = ["scale", "step", "seconds", "baseline_seconds", "time_ratio", "cells_per_sec", "peak_mb", "memory_ratio", "regression"]
+    print(report[columns].to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+    regressions = report[report["regression"]]
+    if len(regressions):
+        print(f"{len(regressions)} regressions above {args.threshold:.0%}")
+        sys.exit(1)
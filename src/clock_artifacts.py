@@ -0,0 +1,167 @@
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from scoring import ClockWeights, stack_models
+from gene_alignment import vocabulary_hash
+from manifest import file_digest
+
+ARTIFACT_VERSION = 1
+ARTIFACT_SUFFIX = ".clock"
+ARTIFACT_FILES = ["genes.npy", "weights.npy", "intercepts.npy", "impute.npy", "meta.json"]
+
+def artifact_path(compiled_folder, clock):
+    return os.path.join(compiled_folder, f"{clock}{ARTIFACT_SUFFIX}")
+
+def artifact_complete(compiled_folder, clock):
+    """Whether a compiled clock exists with all of its files."""
+    path = artifact_path(compiled_folder, clock)
+    return all(os.path.exists(os.path.join(path, name)) for name in ARTIFACT_FILES)
+
+def source_paths(clock, model_folder, imputation_folder):
+    return (os.path.join(model_folder, f"{clock}_models5.csv"),
+            os.path.join(imputation_folder, f"Impute_avg_{clock}.csv"))
+
+def source_digests(clock, model_folder, imputation_folder):
+    """Digests of the model and imputation CSVs of a clock (None for a missing file)."""
+    model_path, impute_path = source_paths(clock, model_folder, imputation_folder)
+    return {"models": file_digest(model_path), "impute": file_digest(impute_path)}
+
+def save_clock(clock_weights, compiled_folder, clock, vocab_hash, sources=None):
+    """
+    Write a stacked clock as a compiled artifact folder of .npy arrays. The folder is
+    written under a temporary name and renamed, so an interrupted compile never leaves a
+    partial artifact in place of the previous one.
+
+    Parameters:
+        clock_weights (ClockWeights): Stacked clock from stack_models.
+        compiled_folder (str): Folder that holds the compiled clocks.
+        clock (str): Name of the clock (cell type it was trained on).
+        vocab_hash (str): Hash of the full gene vocabulary the clock was trained on.
+        sources (dict): source_digests of the CSVs the clock was compiled from.
+
+    Returns:
+        str: Path of the written artifact.
+    """
+    path = artifact_path(compiled_folder, clock)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    np.save(os.path.join(tmp_path, "genes.npy"), np.asarray(clock_weights.genes, dtype=str))
+    np.save(os.path.join(tmp_path, "weights.npy"), np.ascontiguousarray(clock_weights.weights, dtype=np.float32))
+    np.save(os.path.join(tmp_path, "intercepts.npy"), np.asarray(clock_weights.intercepts, dtype=np.float64))
+    np.save(os.path.join(tmp_path, "impute.npy"), np.asarray(clock_weights.impute, dtype=np.float32))
+
+    meta = {
+        "version": ARTIFACT_VERSION,
+        "clock": clock,
+        "n_genes": int(len(clock_weights.genes)),
+        "n_folds": int(len(clock_weights.intercepts)),
+        "vocab_hash": vocab_hash,
+        "sources": sources,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    # A directory cannot be renamed onto a non-empty one: the previous artifact is moved
+    # aside first and removed once the new one is in place.
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another process compiled the same clock at the same time; its artifact is kept.
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+def read_meta(compiled_folder, clock):
+    with open(os.path.join(artifact_path(compiled_folder, clock), "meta.json")) as f:
+        return json.load(f)
+
+def load_clock(compiled_folder, clock, vocab_hash=None):
+    """
+    Load a compiled clock. The arrays are memory-mapped, nothing is parsed.
+
+    Parameters:
+        compiled_folder (str): Folder that holds the compiled clocks.
+        clock (str): Name of the clock.
+        vocab_hash (str): Optional hash of the gene vocabulary the clock must have been trained on.
+
+    Returns:
+        ClockWeights: The stacked clock.
+    """
+    path = artifact_path(compiled_folder, clock)
+    meta = read_meta(compiled_folder, clock)
+    if meta["version"] != ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported clock artifact version {meta['version']} for {clock}")
+    if vocab_hash is not None and meta["vocab_hash"] != vocab_hash:
+        raise ValueError(f"Clock artifact {clock} was compiled for another gene vocabulary")
+
+    return ClockWeights(
+        pd.Index(np.load(os.path.join(path, "genes.npy"), mmap_mode="r")),
+        np.load(os.path.join(path, "weights.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "intercepts.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "impute.npy"), mmap_mode="r"),
+    )
+
+def compile_clock(clock, model_folder, imputation_folder, compiled_folder):
+    """
+    Compile the CSVs of a clock. A clock without an imputation file is not compiled
+    (returns None), as get_clock does not load it from the CSVs either.
+    """
+    model_path, impute_path = source_paths(clock, model_folder, imputation_folder)
+    if not os.path.exists(impute_path):
+        return None
+
+    model_df = pd.read_csv(model_path)
+    clock_weights = stack_models(model_df, pd.read_csv(impute_path))
+    vocab_hash = vocabulary_hash(model_df.columns.drop("intercept"))
+    return save_clock(clock_weights, compiled_folder, clock, vocab_hash,
+                      source_digests(clock, model_folder, imputation_folder))
+
+def get_clock(clock, model_folder, imputation_folder, compiled_folder=None):
+    """
+    Return a stacked clock, from its compiled artifact when available and up to date,
+    otherwise from the model and imputation CSVs.
+
+    An artifact is up to date when the digests of the CSVs it was compiled from match
+    the current files. A stale artifact is ignored (recompile it with this script);
+    an artifact without its model CSV, as deployed for scoring, is used as is.
+
+    Returns:
+        ClockWeights or None: None if neither a usable artifact nor both CSVs exist.
+    """
+    model_path, impute_path = source_paths(clock, model_folder, imputation_folder)
+    if compiled_folder is not None and artifact_complete(compiled_folder, clock):
+        if not os.path.exists(model_path):
+            return load_clock(compiled_folder, clock)
+        if read_meta(compiled_folder, clock).get("sources") == source_digests(clock, model_folder, imputation_folder):
+            vocab_hash = vocabulary_hash(pd.read_csv(model_path, nrows=0).columns.drop("intercept"))
+            return load_clock(compiled_folder, clock, vocab_hash)
+        print(f"Ignoring stale compiled clock {clock}: its model or imputation CSV changed")
+
+    if not (os.path.exists(model_path) and os.path.exists(impute_path)):
+        return None
+
+    return stack_models(pd.read_csv(model_path), pd.read_csv(impute_path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile model and imputation CSVs into clock artifacts")
+    parser.add_argument("--model_folder", type=str, default="../models/", help="Folder containing trained models")
+    parser.add_argument("--imputation_folder", type=str, default="../data_for_imputation/", help="Folder containing imputation files")
+    parser.add_argument("--compiled_folder", type=str, default="../compiled_clocks/", help="Folder to save compiled clocks")
+
+    args = parser.parse_args()
+
+    clocks = [f.replace("_models5.csv", "") for f in os.listdir(args.model_folder) if f.endswith("_models5.csv")]
+
+    for clock in clocks:
+        path = compile_clock(clock, args.model_folder, args.imputation_folder, args.compiled_folder)
+        if path is None:
+            print(f"Skipping {clock}: no imputation file")
+        else:
+            print(f"Compiled {clock} -> {path}")
@@ -0,0 +1,99 @@
+import os
+import copy
+import json
+
+SRC_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CONFIG = {
+    "paths": {
+        "data_folder": "../data/",
+        "aida_path": "../data/AIDA.h5ad",
+        "shard_folder": "../shards/",
+        "shard_dir": None,
+        "imputation_folder": "../data_for_imputation/",
+        "model_folder": "../models/",
+        "compiled_folder": "../compiled_clocks/",
+        "alignment_folder": "../alignment_cache/",
+        "cache_folder": None,
+        "predictions_folder": "../predictions/",
+        "external_predictions_folder": "../predictions_external/",
+        "store_folder": "../prediction_store/",
+        "results_folder": "../results/",
+        "figures_folder": "../figures/",
+        "external_figures_folder": "../figures_external/",
+        "manifest_path": "../run_manifest.json",
+        "metrics_path": None,
+    },
+    "datasets": ["Yoshida", "Liu", "eQTL", "Stephenson"],
+    "workers": 1,
+    "stage_workers": 2,
+    "pool_memory_mb": None,
+    "retries": 1,
+    "cache_budget_mb": None,
+    "train": {
+        "alphas": [1.0],
+        "l1_ratios": [0.5],
+        "fold_jobs": 1,
+        "inner_folds": None,
+        "out_of_core": {"enabled": False, "epochs": 20, "tol": 0.02, "chunk_size": 50000, "memory_budget_mb": None},
+        "subsample": {"strategy": None, "max_cells_per_donor": 200, "fraction": 0.25},
+    },
+    "external": {
+        "chunk_size": None,
+        "memory_budget_mb": None,
+        "gene_subset": False,
+        "output_format": "csv",
+        "donor_summary": False,
+        "pseudobulk": False,
+        "precision": "float32",
+        "precision_sample": 1000,
+        "precision_tolerance": 0.01,
+        "imputation": "scalar",
+    },
+    "evaluate": {"n_boot": 1000},
+    "plot": {"workers": 4},
+    "profile": {"enabled": False, "trace_memory": False, "cprofile_dir": None},
+}
+
+def merge(base, override):
+    """Recursively merge override into a copy of base."""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def resolve_paths(paths, base_folder):
+    return {key: None if path is None else os.path.normpath(os.path.join(base_folder, path))
+            for key, path in paths.items()}
+
+def load_config(path=None, overrides=None):
+    """
+    Build the pipeline configuration from DEFAULT_CONFIG, an optional JSON config file
+    and command-line overrides, in that order.
+
+    Default paths are relative to src/, as when the scripts are run from there; paths in
+    a config file are relative to the folder of the file.
+
+    Parameters:
+        path (str): Optional JSON config file with any subset of the DEFAULT_CONFIG keys.
+        overrides (dict): Values that take precedence over the file; None values are ignored.
+
+    Returns:
+        dict: Configuration with absolute paths.
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    config["paths"] = resolve_paths(config["paths"], SRC_FOLDER)
+
+    if path is not None:
+        with open(path) as f:
+            user_config = json.load(f)
+        if "paths" in user_config:
+            user_config["paths"] = resolve_paths(user_config["paths"], os.path.dirname(os.path.abspath(path)))
+        config = merge(config, user_config)
+
+    if overrides:
+        config = merge(config, {key: value for key, value in overrides.items() if value is not None})
+    return config
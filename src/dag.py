@@ -0,0 +1,85 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+Stage = namedtuple("Stage", ["name", "func", "deps", "resources"], defaults=[(), ()])
+
+def check_stages(stages):
+    """Raise ValueError for duplicate names, unknown dependencies or cycles."""
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate stage names")
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+
+    done, visiting = set(), set()
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through stage {name}")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+    for name in names:
+        visit(name)
+
+def run_dag(stages, workers=1):
+    """
+    Run pipeline stages in dependency order, running independent stages concurrently in threads.
+
+    A stage is called as func(upstream), where upstream maps the names of its dependencies
+    to their return values, so results are passed between stages in memory. Stages that
+    share a resource name (e.g. a process pool or matplotlib) never run at the same time.
+    When a stage fails, the stages that depend on it are skipped. Stages that start
+    process pools must not rely on fork inheritance (see scheduler.WORKER_CONTEXT).
+
+    Parameters:
+        stages (list): Stages to run.
+        workers (int): Maximum number of stages running at once.
+
+    Returns:
+        tuple: (dict of results by stage name, dict of exceptions by failed stage name)
+    """
+    if workers < 1:
+        raise ValueError(f"run_dag needs at least 1 worker, got {workers}")
+    check_stages(stages)
+    results, failures = {}, {}
+    pending = list(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            busy = {resource for stage in running.values() for resource in stage.resources}
+            for stage in list(pending):
+                if any(dep in failures for dep in stage.deps):
+                    print(f"Skipping {stage.name}: an upstream stage failed")
+                    failures[stage.name] = RuntimeError("upstream stage failed")
+                    pending.remove(stage)
+                    continue
+                if len(running) >= workers or not all(dep in results for dep in stage.deps):
+                    continue
+                if busy.intersection(stage.resources):
+                    continue
+                pending.remove(stage)
+                upstream = {dep: results[dep] for dep in stage.deps}
+                running[executor.submit(stage.func, upstream)] = stage
+                busy.update(stage.resources)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                    print(f"Finished stage {stage.name}")
+                except Exception as e:
+                    print(f"Stage {stage.name} failed: {e}")
+                    failures[stage.name] = e
+
+    return results, failures
@@ -1,34 +1,65 @@
 import os
+import argparse
 import pandas as pd
-from sklearn.metrics import mean_absolute_error, r2_score
-from scipy.stats import pearsonr, spearmanr
+from metrics import evaluate_groups, METRICS
+from prediction_store import STORE_FOLDER, CV_DATASET, SOURCES, list_partitions, read_predictions
 
 PREDICTIONS_FOLDER = "../predictions/"
 OUTPUT_PATH = "../results/summary_performance.csv"
-os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+N_BOOT = 1000
 
-summary = []
+def iter_predictions(predictions_folder=PREDICTIONS_FOLDER, store_folder=STORE_FOLDER, source="csv"):
+    """
+    Yield (cell_type, predictions) of the held-out predictions, from the CSV files or,
+    with source='parquet', from the Parquet store. Read from the format the predictions
+    were written in (prediction_store.prediction_source), so that older partitions or
+    files left by a run in the other format are not mistaken for the current ones.
+    """
+    if source not in SOURCES:
+        raise ValueError(f"Unknown prediction source: {source}")
+    if source == "parquet":
+        for cell_type, clock in list_partitions(store_folder, CV_DATASET):
+            yield cell_type, read_predictions(store_folder, CV_DATASET, cell_type, clock, columns=["donor_id", "true_age", "predicted_age"])
+        return
 
-for fname in os.listdir(PREDICTIONS_FOLDER):
-    if not fname.endswith(".csv"):
-        continue
+    for fname in os.listdir(predictions_folder):
+        if not fname.endswith(".csv"):
+            continue
+        yield fname.replace("_predictions", "").replace(".csv", ""), pd.read_csv(os.path.join(predictions_folder, fname))
 
-    df = pd.read_csv(os.path.join(PREDICTIONS_FOLDER, fname))
+def summarize(predictions_folder=PREDICTIONS_FOLDER, output_path=OUTPUT_PATH, store_folder=STORE_FOLDER, n_boot=N_BOOT,
+              source="csv"):
+    """
+    Evaluate the held-out predictions of every cell type and save the summary table.
+    source ('csv' or 'parquet') selects where the predictions are read, as in iter_predictions.
 
-    mae = mean_absolute_error(df["true_age"], df["predicted_age"])
-    pearson, _ = pearsonr(df["true_age"], df["predicted_age"])
-    spearman, _ = spearmanr(df["true_age"], df["predicted_age"])
-    r2 = r2_score(df["true_age"], df["predicted_age"])
+    Returns:
+        pd.DataFrame: One row per cell type, sorted by MAE.
+    """
+    frames = [df[["donor_id", "true_age", "predicted_age"]].assign(cell_type=cell_type)
+              for cell_type, df in iter_predictions(predictions_folder, store_folder, source)]
+    if not frames:
+        location = os.path.join(store_folder, CV_DATASET) if source == "parquet" else predictions_folder
+        raise FileNotFoundError(f"No held-out predictions found in {location}")
+    predictions = pd.concat(frames, ignore_index=True)
 
-    summary.append({
-        "cell_type": fname.replace("_predictions", "").replace(".csv", ""),
-        "MAE": mae,
-        "Pearson": pearson,
-        "Spearman": spearman,
-        "R2": r2,
-        "n_cells": len(df)
-    })
+    summary_df = evaluate_groups(predictions, "cell_type", n_boot=n_boot)
+    ci_columns = [f"{metric}_ci_{side}" for metric in METRICS for side in ["low", "high"]] if n_boot > 0 else []
+    summary_df = summary_df[["cell_type", *METRICS, "n_cells", *ci_columns]].sort_values("MAE")
 
-summary_df = pd.DataFrame(summary).sort_values("MAE")
-summary_df.to_csv(OUTPUT_PATH, index=False)
-print(f"Saved summary to {OUTPUT_PATH}")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    summary_df.to_csv(output_path, index=False)
+    print(f"Saved summary to {output_path}")
+    return summary_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the held-out predictions of every cell type")
+    parser.add_argument("--predictions_folder", type=str, default=PREDICTIONS_FOLDER, help="Folder with the held-out prediction CSVs")
+    parser.add_argument("--output_path", type=str, default=OUTPUT_PATH, help="Path of the summary table")
+    parser.add_argument("--store_folder", type=str, default=STORE_FOLDER, help="Root of the Parquet prediction store")
+    parser.add_argument("--source", choices=SOURCES, default="csv", help="Read the predictions from the CSV files or the Parquet store")
+    parser.add_argument("--n_boot", type=int, default=N_BOOT, help="Number of donor bootstrap replicates")
+
+    args = parser.parse_args()
+
+    summarize(args.predictions_folder, args.output_path, args.store_folder, args.n_boot, args.source)
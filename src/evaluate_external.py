@@ -1,82 +1,146 @@
 import os
+import argparse
 import pandas as pd
 import numpy as np
-from scipy.stats import pearsonr, spearmanr, ttest_ind
+from scipy.stats import ttest_ind_from_stats
 import glob
+from collections import Counter
+from metrics import grouped_metrics, bootstrap_ci
+from age_parsing import age_scheme, stage_codes
+from prediction_store import STORE_FOLDER, SOURCES, list_partitions, read_predictions
 
 PREDICTIONS_FOLDER = "../predictions_external/"
 OUTPUT_FOLDER = "../results"
 DATASETS = ["Yoshida", "Liu", "eQTL", "Stephenson"]
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-def group_ages_eQTL_Liu(age):
-    try:
-        age = float(age)
-    except Exception:
-        return np.nan
-    if age < 18:
-        return "young"
-    elif age < 65:
-        return "adult"
-    else:
-        return "aged adult"
+N_BOOT = 1000
+
+def group_ages_eQTL_Liu(ages):
+    """Age group of every numeric age: young (< 18), adult (< 65) or aged adult."""
+    return pd.cut(pd.to_numeric(pd.Series(ages), errors="coerce"), [-np.inf, 18, 65, np.inf],
+                  right=False, labels=["young", "adult", "aged adult"]).astype(object)
 
-def get_files(dataset):
-    folder = os.path.join(PREDICTIONS_FOLDER, dataset)
+def get_files(dataset, predictions_folder=PREDICTIONS_FOLDER):
+    folder = os.path.join(predictions_folder, dataset)
     return sorted(glob.glob(os.path.join(folder, "*.csv")))
 
-def evaluate_csv(df, dataset):
+def iter_predictions(dataset, predictions_folder=PREDICTIONS_FOLDER, store_folder=STORE_FOLDER, source="csv"):
+    """
+    Yield (cell_type label, predictions) for a dataset, from its CSV files or, with
+    source='parquet', from the Parquet store. Cell types scored by several clocks are
+    labelled with the clock, as in the CSV file names.
+    """
+    if source not in SOURCES:
+        raise ValueError(f"Unknown prediction source: {source}")
+    if source == "parquet":
+        partitions = list_partitions(store_folder, dataset)
+        n_clocks = Counter(cell_type for cell_type, _ in partitions)
+        for cell_type, clock in partitions:
+            label = cell_type if n_clocks[cell_type] == 1 else f"{cell_type} {clock}"
+            yield label, read_predictions(store_folder, dataset, cell_type, clock, columns=["donor_id", "age", "predicted_age"])
+        return
+
+    for filepath in get_files(dataset, predictions_folder):
+        cell_type = os.path.splitext(os.path.basename(filepath))[0].replace("_", " ")
+        yield cell_type, pd.read_csv(filepath)
+
+def adult_vs_aged_ttest(df):
+    """Welch t-test of predicted age between adult and aged adult cells of every cell type, from grouped moments."""
+    groups = df.assign(age_group=group_ages_eQTL_Liu(df["age"]).values).groupby(["cell_type", "age_group"])["predicted_age"]
+    moments = groups.agg(["mean", "std", "count"]).unstack("age_group")
+    moments = moments.reindex(columns=pd.MultiIndex.from_product([["mean", "std", "count"], ["adult", "aged adult"]]))
+    adult, aged = moments.xs("adult", axis=1, level=1), moments.xs("aged adult", axis=1, level=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tstat, t_pval = ttest_ind_from_stats(adult["mean"].values, adult["std"].values, adult["count"].values,
+                                             aged["mean"].values, aged["std"].values, aged["count"].values,
+                                             equal_var=False)
+    tstat = np.where(adult["count"].values * aged["count"].values > 0, tstat, np.nan)
+    t_pval = np.where(adult["count"].values * aged["count"].values > 0, t_pval, np.nan)
+    return pd.DataFrame({"tstat_adult_vs_aged": tstat, "t_pval_adult_vs_aged": t_pval}, index=moments.index)
+
+def evaluate_dataset(df, dataset, n_boot=N_BOOT):
+    """
+    Metrics of every cell type of an external dataset in one grouped pass.
+
+    eQTL and Liu have numeric ages and are scored with Pearson correlation, MAE and an
+    adult vs aged adult t-test; Yoshida and Stephenson have ordered age groups and are
+    scored with Spearman correlation on the ordinal codes of the groups. With n_boot > 0, donor-level
+    bootstrap intervals are added for the correlation (and MAE).
+
+    Parameters:
+        df (pd.DataFrame): Predictions with 'cell_type', 'donor_id', 'age' and 'predicted_age'.
+        dataset (str): Name of the dataset.
+        n_boot (int): Number of bootstrap replicates.
+
+    Returns:
+        pd.DataFrame: One row per cell type.
+    """
     df = df.dropna(subset=["age", "predicted_age"])
-    results = {}
 
     if dataset in ["eQTL", "Liu"]:
-        pear, pval = pearsonr(df["age"], df["predicted_age"])
-        mae = np.mean(np.abs(df["predicted_age"] - df["age"]))
-        results.update({
-            "pearson_corr": pear,
-            "pearson_pval": pval,
-            "mae": mae,
-            "n_cells": len(df)
-        })
-
-        df["age_group"] = df["age"].map(group_ages_eQTL_Liu)
-        group1 = df[df["age_group"] == "adult"]["predicted_age"]
-        group2 = df[df["age_group"] == "aged adult"]["predicted_age"]
-        if not group1.empty and not group2.empty:
-            tstat, t_pval = ttest_ind(group1, group2, equal_var=False, nan_policy="omit")
-        else:
-            tstat, t_pval = np.nan, np.nan
-        results.update({
-            "tstat_adult_vs_aged": tstat,
-            "t_pval_adult_vs_aged": t_pval,
+        ages = df["age"].astype(float)
+        metrics = grouped_metrics(ages, df["predicted_age"], df["cell_type"])
+        results = pd.DataFrame({
+            "pearson_corr": metrics["Pearson"],
+            "pearson_pval": metrics["Pearson_pval"],
+            "mae": metrics["MAE"],
+            "n_cells": metrics["n_cells"],
         })
+        results = results.join(adult_vs_aged_ttest(df))
+        if n_boot > 0:
+            ci = bootstrap_ci(ages, df["predicted_age"], df["cell_type"], df["donor_id"], n_boot)
+            results = results.join(ci[["Pearson_ci_low", "Pearson_ci_high", "MAE_ci_low", "MAE_ci_high"]]
+                                   .set_axis(["pearson_ci_low", "pearson_ci_high", "mae_ci_low", "mae_ci_high"], axis=1))
 
     elif dataset in ["Yoshida", "Stephenson"]:
-        categories = pd.Categorical(df["age"])
-        df = df.assign(age_code=categories.codes)
-        spear, spval = spearmanr(df["age_code"], df["predicted_age"])
-        results.update({
-            "spearman_corr": spear,
-            "spearman_pval": spval,
-            "n_age_groups": df["age"].nunique(),
-            "n_cells": len(df)
+        age_codes = stage_codes(df["age"], age_scheme(dataset).order)
+        metrics = grouped_metrics(age_codes, df["predicted_age"], df["cell_type"])
+        results = pd.DataFrame({
+            "spearman_corr": metrics["Spearman"],
+            "spearman_pval": metrics["Spearman_pval"],
+            "n_age_groups": df.groupby("cell_type")["age"].nunique(),
+            "n_cells": metrics["n_cells"],
         })
+        if n_boot > 0:
+            ci = bootstrap_ci(age_codes, df["predicted_age"], df["cell_type"], df["donor_id"], n_boot)
+            results = results.join(ci[["Spearman_ci_low", "Spearman_ci_high"]]
+                                   .set_axis(["spearman_ci_low", "spearman_ci_high"], axis=1))
+
+    else:
+        return pd.DataFrame()
+
+    return results.rename_axis("cell_type").reset_index()
 
-    return results
+def summarize_dataset(dataset, n_boot=N_BOOT, predictions_folder=PREDICTIONS_FOLDER, output_folder=OUTPUT_FOLDER,
+                      store_folder=STORE_FOLDER, source="csv"):
+    """
+    Evaluate every cell type of a dataset and save {dataset}_summary.csv. source ('csv'
+    or 'parquet') is the format the predictions were written in.
+
+    Returns:
+        pd.DataFrame: Output of evaluate_dataset.
+    """
+    print(f"== Evaluating: {dataset} ==")
+    predictions = [df[["donor_id", "age", "predicted_age"]].assign(cell_type=cell_type)
+                   for cell_type, df in iter_predictions(dataset, predictions_folder, store_folder, source)]
+
+    df_summary = evaluate_dataset(pd.concat(predictions, ignore_index=True), dataset, n_boot) if predictions else pd.DataFrame()
+    os.makedirs(output_folder, exist_ok=True)
+    summary_path = os.path.join(output_folder, f"{dataset}_summary.csv")
+    df_summary.to_csv(summary_path, index=False)
+    print(f"Saved: {summary_path}\n")
+    return df_summary
 
 if __name__ == "__main__":
-    for dataset in DATASETS:
-        print(f"== Evaluating: {dataset} ==")
-        dataset_results = []
-
-        for filepath in get_files(dataset):
-            cell_type = os.path.splitext(os.path.basename(filepath))[0].replace("_", " ")
-            df = pd.read_csv(filepath)
-            metrics = evaluate_csv(df, dataset)
-            row = {"cell_type": cell_type, **metrics}
-            dataset_results.append(row)
-
-        df_summary = pd.DataFrame(dataset_results)
-        summary_path = os.path.join(OUTPUT_FOLDER, f"{dataset}_summary.csv")
-        df_summary.to_csv(summary_path, index=False)
-        print(f"Saved: {summary_path}\n")
+    parser = argparse.ArgumentParser(description="Summarize the predictions of every external dataset")
+    parser.add_argument("--datasets", nargs="+", default=DATASETS, help="External datasets to evaluate")
+    parser.add_argument("--predictions_folder", type=str, default=PREDICTIONS_FOLDER, help="Folder with one prediction folder per dataset")
+    parser.add_argument("--output_folder", type=str, default=OUTPUT_FOLDER, help="Folder to save the summaries")
+    parser.add_argument("--store_folder", type=str, default=STORE_FOLDER, help="Root of the Parquet prediction store")
+    parser.add_argument("--source", choices=SOURCES, default="csv", help="Read the predictions from the CSV files or the Parquet store")
+    parser.add_argument("--n_boot", type=int, default=N_BOOT, help="Number of donor bootstrap replicates")
+
+    args = parser.parse_args()
+
+    for dataset in args.datasets:
+        summarize_dataset(dataset, args.n_boot, args.predictions_folder, args.output_folder, args.store_folder, args.source)
@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from manifest import value_digest
+from scheduler import WORKER_CONTEXT
+
+CACHE_FILE = ".figure_inputs.json"
+MAX_POINTS = 20000
+
+# A figure: draw(path, **kwargs) renders it to path. inputs is a JSON-serializable
+# description of everything the figure depends on (frame digests, file digests, code
+# versions); the figure is redrawn only when it changes.
+FigureJob = namedtuple("FigureJob", ["path", "draw", "kwargs", "inputs"])
+
+def frame_digest(df):
+    """Content digest of a DataFrame: its columns and the hash of every row."""
+    digest = hashlib.sha1(json.dumps([str(column) for column in df.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+def job_digest(job):
+    return value_digest({"draw": job.draw.__qualname__, "inputs": job.inputs})
+
+def read_cache(folder):
+    """Input digests of the figures in folder; empty when the cache is missing or unreadable."""
+    path = os.path.join(folder, CACHE_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable figure cache {path}: {e}")
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def write_cache(folder, cache):
+    path = os.path.join(folder, CACHE_FILE)
+    # Written under a temporary name and renamed, so an interrupted run never leaves a partial file.
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def render_job(job):
+    job.draw(job.path, **job.kwargs)
+    return job.path
+
+def render_figures(jobs, workers=1, force=False):
+    """
+    Render the figures whose inputs changed since they were last drawn, in a process pool.
+
+    The input digest of every figure is kept in CACHE_FILE next to it; a figure is skipped
+    when its file exists and its digest is unchanged.
+
+    Parameters:
+        jobs (list): FigureJob per figure.
+        workers (int): Number of processes rendering at once.
+        force (bool): Redraw every figure.
+
+    Returns:
+        list: Paths of the figures rendered.
+    """
+    folders = {os.path.dirname(job.path) for job in jobs}
+    caches = {folder: read_cache(folder) for folder in folders}
+    digests = {job.path: job_digest(job) for job in jobs}
+    stale = [job for job in jobs if force or not os.path.exists(job.path)
+             or caches[os.path.dirname(job.path)].get(os.path.basename(job.path)) != digests[job.path]]
+    print(f"Rendering {len(stale)} of {len(jobs)} figures")
+
+    if workers > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(stale)), mp_context=WORKER_CONTEXT) as executor:
+            rendered = list(executor.map(render_job, stale))
+    else:
+        rendered = [render_job(job) for job in stale]
+
+    for path in rendered:
+        caches[os.path.dirname(path)][os.path.basename(path)] = digests[path]
+    for folder in {os.path.dirname(path) for path in rendered}:
+        write_cache(folder, caches[folder])
+    return rendered
+
+def density_scatter(ax, x, y, max_points=MAX_POINTS, gridsize=60, color="blue"):
+    """
+    Predicted against true values with a least-squares line. Up to max_points points are
+    drawn as a regplot scatter; larger clouds as a log-scaled hexbin density, whose cost
+    does not grow with the number of points.
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if len(x) <= max_points:
+        sns.regplot(ax=ax, x=x, y=y, scatter_kws={"alpha": 0.3, "s": 10}, line_kws={"color": color})
+        return
+
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    ax.hexbin(x, y, gridsize=gridsize, bins="log", mincnt=1, cmap="Blues")
+    slope, intercept = np.polyfit(x, y, 1)
+    line = np.linspace(x.min(), x.max(), 2)
+    ax.plot(line, slope * line + intercept, color=color)
@@ -0,0 +1,87 @@
+import os
+import re
+import hashlib
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+GeneAlignment = namedtuple("GeneAlignment", ["present", "columns", "missing"])
+
+ENSEMBL_VERSION = re.compile(r"^(ENS[A-Z]*G\d+)\.\d+$")
+
+def vocabulary_hash(genes):
+    return hashlib.sha1("\n".join(map(str, genes)).encode()).hexdigest()
+
+def normalize_gene(name):
+    """Upper-case a gene name and strip the version suffix of Ensembl IDs (ENSG00000123.4 -> ENSG00000123)."""
+    name = str(name).strip().upper()
+    return ENSEMBL_VERSION.sub(r"\1", name)
+
+def first_positions(names):
+    normalized = pd.Index([normalize_gene(n) for n in names])
+    keep = ~normalized.duplicated()
+    return pd.Series(np.where(keep)[0], index=normalized[keep])
+
+def build_alignment(var_names, clock_genes, aliases=None):
+    """
+    Map the genes of a clock onto the columns of a dataset.
+
+    Gene names are compared after normalize_gene. Clock genes that are not found
+    in var_names are looked up in aliases (e.g. the 'feature_name' column of var,
+    which holds gene symbols when var_names are Ensembl IDs).
+
+    Parameters:
+        var_names (pd.Index): Gene names of the dataset columns.
+        clock_genes (pd.Index): Genes of the clock, in weight matrix order.
+        aliases (pd.Series or list): Optional alternative names of the dataset columns, same order as var_names.
+
+    Returns:
+        GeneAlignment: Positions of the present clock genes, the dataset columns they map to,
+            and positions of the clock genes that need imputation.
+    """
+    wanted = pd.Index([normalize_gene(g) for g in clock_genes])
+    columns = first_positions(var_names).reindex(wanted).to_numpy()
+
+    if aliases is not None:
+        unmatched = np.isnan(columns)
+        if unmatched.any():
+            columns[unmatched] = first_positions(aliases).reindex(wanted[unmatched]).to_numpy()
+
+    found = ~np.isnan(columns)
+    return GeneAlignment(
+        np.where(found)[0],
+        columns[found].astype(np.int64),
+        np.where(~found)[0],
+    )
+
+def subset_alignment(alignment, columns):
+    """Re-express an alignment against a matrix holding only the sorted dataset columns in columns."""
+    return GeneAlignment(alignment.present, np.searchsorted(columns, alignment.columns), alignment.missing)
+
+def alignment_key(var_names, clock_genes, aliases=None):
+    parts = [vocabulary_hash(var_names), vocabulary_hash(clock_genes)]
+    if aliases is not None:
+        parts.append(vocabulary_hash(aliases))
+    return hashlib.sha1("-".join(parts).encode()).hexdigest()
+
+def get_alignment(var_names, clock_genes, cache_folder=None, aliases=None):
+    """
+    Return the alignment of a clock onto a dataset, reading it from or writing it
+    to cache_folder, keyed by a hash of the var names, the clock genes and the aliases.
+    """
+    if cache_folder is None:
+        return build_alignment(var_names, clock_genes, aliases)
+
+    path = os.path.join(cache_folder, f"{alignment_key(var_names, clock_genes, aliases)}.npz")
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            return GeneAlignment(cached["present"], cached["columns"], cached["missing"])
+
+    alignment = build_alignment(var_names, clock_genes, aliases)
+    os.makedirs(cache_folder, exist_ok=True)
+    # Written under a temporary name and renamed, so concurrent workers never read a partial file.
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **alignment._asdict())
+    os.replace(tmp_path, path)
+    return alignment
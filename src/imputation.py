@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.neighbors import NearestNeighbors
+from scoring import missing_offset
+from gene_alignment import first_positions, normalize_gene
+from preprocessing import CellTypeData, normalize_counts, read_rows
+from out_of_core import celltype_source, source_var_names
+from aggregation import factorize_donors
+
+STRATEGIES = ["scalar", "celltype_mean", "donor_mean", "knn"]
+REFERENCE_STRATEGIES = ["celltype_mean", "donor_mean", "knn"]
+
+def sample_reference(filepath, cell_type, shard_dir=None, max_cells=5000, seed=0):
+    """
+    Log-normalized expression of at most max_cells random cells of a cell type of the
+    training data. Only the sampled rows are read from the .h5ad file; from shards, only
+    the parts that hold sampled rows are loaded, one at a time.
+
+    Returns:
+        CellTypeData: The sampled cells, in file order.
+    """
+    obs, source = celltype_source(filepath, cell_type, shard_dir)
+    rows = np.arange(len(obs))
+    if len(obs) > max_cells:
+        rows = np.sort(np.random.default_rng(seed).choice(len(obs), max_cells, replace=False))
+
+    if "adata" in source:
+        counts = read_rows(source["adata"].X, source["indices"][rows])
+    else:
+        starts = np.cumsum(source["sizes"]) - source["sizes"]
+        parts = []
+        for path, start, size in zip(source["parts"], starts, source["sizes"]):
+            lo, hi = np.searchsorted(rows, [start, start + size])
+            if hi > lo:
+                parts.append(sp.load_npz(f"{path}.npz").tocsr()[rows[lo:hi] - start])
+        counts = sp.vstack(parts, format="csr")
+    return CellTypeData(normalize_counts(counts, copy=False), source_var_names(source, shard_dir), obs.iloc[rows])
+
+def reference_expression(reference, genes, max_cells=5000, seed=0):
+    """
+    Dense log-expression of the given genes in a random subsample of reference cells
+    (a CellTypeData of the clock's cell type in the training data). Genes that the
+    reference lacks are NaN columns.
+
+    Returns:
+        np.ndarray: Reference cells x genes, float32.
+    """
+    n_cells = reference.X.shape[0]
+    rows = np.arange(n_cells)
+    if n_cells > max_cells:
+        rows = np.sort(np.random.default_rng(seed).choice(n_cells, max_cells, replace=False))
+
+    columns = first_positions(reference.var_names).reindex([normalize_gene(g) for g in genes]).to_numpy()
+    found = ~np.isnan(columns)
+    out = np.full((len(rows), len(genes)), np.nan, dtype=np.float32)
+    sub = reference.X[rows][:, columns[found].astype(np.int64)]
+    out[:, found] = sub.toarray() if sp.issparse(sub) else sub
+    return out
+
+def reference_terms(clock, alignment, expression):
+    """Contribution of the missing genes of every reference cell, reference cells x folds."""
+    values = expression[:, alignment.missing].astype(np.float64)
+    values = np.where(np.isnan(values), clock.impute[alignment.missing], values)
+    return values @ clock.weights[alignment.missing]
+
+def knn_offsets(X, clock, alignment, expression, k=15, batch_size=20000):
+    """
+    Contribution of the missing genes of every cell, averaged over its k nearest reference
+    cells in the space of the clock genes both datasets share.
+
+    Parameters:
+        X (scipy.sparse.csr_matrix or np.ndarray): Log-normalized expression of the cells to score.
+        clock (ClockWeights): The clock.
+        alignment (GeneAlignment): Alignment of the clock onto the columns of X.
+        expression (np.ndarray): reference_expression of the clock genes.
+        k (int): Number of neighbours.
+        batch_size (int): Cells queried at once.
+
+    Returns:
+        np.ndarray: Cells x folds.
+    """
+    terms = reference_terms(clock, alignment, expression)
+    present = np.nan_to_num(expression[:, alignment.present])
+    index = NearestNeighbors(n_neighbors=min(k, len(present))).fit(present)
+
+    offsets = np.empty((X.shape[0], terms.shape[1]))
+    for start in range(0, X.shape[0], batch_size):
+        query = X[start:start + batch_size][:, alignment.columns]
+        query = query.toarray() if sp.issparse(query) else np.asarray(query)
+        _, neighbours = index.kneighbors(query.astype(np.float32))
+        offsets[start:start + len(query)] = terms[neighbours].mean(axis=1)
+    return offsets
+
+def donor_sums(offsets, donor_ids, totals=None):
+    """
+    Add the per-cell offsets of a chunk to per-donor totals, so that donor means can
+    cover every chunk of a streamed cell type.
+
+    Returns:
+        dict: Donor -> (sum of the offsets of its cells, number of cells), totals updated in place.
+    """
+    totals = {} if totals is None else totals
+    codes, uniques = factorize_donors(donor_ids)
+    counts = np.bincount(codes, minlength=len(uniques))
+    sums = np.zeros((len(uniques), offsets.shape[1]))
+    np.add.at(sums, codes, offsets)
+    for donor, donor_sum, count in zip(uniques, sums, counts):
+        total, n = totals.get(donor, (0.0, 0))
+        totals[donor] = (total + donor_sum, n + count)
+    return totals
+
+def donor_means(offsets, donor_ids, totals=None):
+    """
+    Replace per-cell offsets by the mean over the cells of the same donor: the cells of
+    offsets, or every cell summed into totals by donor_sums. Cells without a donor id
+    share the mean of UNKNOWN_DONOR.
+    """
+    totals = donor_sums(offsets, donor_ids) if totals is None else totals
+    codes, uniques = factorize_donors(donor_ids)
+    means = np.array([totals[donor][0] / totals[donor][1] for donor in uniques])
+    return means[codes]
+
+def impute_offsets(strategy, X, clock, alignment, expression=None, donor_ids=None, k=15, donor_totals=None):
+    """
+    Contribution of the missing clock genes for score_matrix.
+
+    Strategies:
+        scalar: imputation file values times weights, one offset per fold.
+        celltype_mean: mean reference expression of the missing genes, one offset per fold.
+        knn: mean over the k nearest reference cells on the shared genes, per cell.
+        donor_mean: the knn offsets averaged over the cells of each donor, in X or, for a
+            streamed cell type, in donor_totals (donor_sums over all of its chunks).
+
+    Parameters:
+        strategy (str): One of STRATEGIES.
+        expression (np.ndarray): reference_expression of the clock genes, for every strategy but scalar.
+        donor_ids (array-like): Donor of every cell, for donor_mean.
+
+    Returns:
+        np.ndarray: (folds,) or cells x folds.
+    """
+    if len(alignment.missing) == 0 or strategy == "scalar":
+        return missing_offset(clock, alignment)
+    if expression is None:
+        raise ValueError(f"Imputation strategy '{strategy}' needs reference expression")
+
+    if strategy == "celltype_mean":
+        values = expression[:, alignment.missing].astype(np.float64)
+        observed = (~np.isnan(values)).sum(axis=0)
+        means = np.where(observed > 0, np.nansum(values, axis=0) / np.maximum(observed, 1), clock.impute[alignment.missing])
+        return means @ clock.weights[alignment.missing]
+
+    offsets = knn_offsets(X, clock, alignment, expression, k)
+    if strategy == "donor_mean":
+        offsets = donor_means(offsets, donor_ids, donor_totals)
+    elif strategy != "knn":
+        raise ValueError(f"Unknown imputation strategy: {strategy}")
+    return offsets
+
+def coverage(clock, alignment):
+    """
+    How much of a clock a dataset covers: its genes, how many are present and missing,
+    and the share of the absolute weight (mean over folds) that falls on missing genes.
+    """
+    magnitude = np.abs(clock.weights)
+    total = magnitude.sum(axis=0)
+    missing = magnitude[alignment.missing].sum(axis=0)
+    return {
+        "n_genes": len(clock.genes),
+        "n_present": len(alignment.present),
+        "n_missing": len(alignment.missing),
+        "missing_weight_share": float(np.mean(np.divide(missing, total, out=np.zeros_like(total), where=total > 0))),
+    }
@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from norm_cache import source_fingerprint
+
+MANIFEST_PATH = "../run_manifest.json"
+FULL_HASH_BYTES = 64 * 1024 ** 2
+
+def file_digest(path):
+    """
+    Content digest of a file or folder, or None when it does not exist.
+
+    Files up to FULL_HASH_BYTES are hashed completely; larger files (h5ad datasets)
+    use source_fingerprint. A folder digests the names and digests of its files.
+    """
+    if os.path.isdir(path):
+        digest = hashlib.sha1()
+        for root, dirs, files in sorted(os.walk(path)):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(file_digest(file_path).encode())
+        return digest.hexdigest()
+
+    if not os.path.exists(path):
+        return None
+    if os.path.getsize(path) > FULL_HASH_BYTES:
+        return source_fingerprint(path)
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 ** 2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def value_digest(value):
+    """Digest of a JSON-serializable value, such as a CELLTYPE_MAPPINGS entry or stage parameters."""
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+def code_version(modules):
+    """Digest of the source files of the given modules of src/."""
+    src = os.path.dirname(os.path.abspath(__file__))
+    return value_digest({module: file_digest(os.path.join(src, f"{module}.py")) for module in modules})
+
+class RunManifest:
+    """
+    Content-addressed record of the inputs every pipeline output was built from.
+
+    Each entry maps an output key, such as 'apply_external/Liu/naive B cell/naive B cell',
+    to the digests of its inputs and the paths it wrote. An output is stale when it has
+    no entry, when any input digest differs from the recorded one, or when one of the
+    paths it wrote is missing. A unit that legitimately writes nothing (e.g. a cell type
+    without healthy cells) is recorded with no paths and stays up to date. Downstream
+    outputs list the keys of their upstream outputs as inputs (see upstream_digest), so a
+    rebuilt unit also invalidates its summaries.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def stale(self, key, inputs, outputs=()):
+        """Whether key must be rebuilt: new inputs, or one of its outputs written last time is gone."""
+        entry = self.entries.get(key)
+        if entry is None or entry["inputs"] != inputs:
+            return True
+        written = set(entry["outputs"])
+        return not all(os.path.exists(path) for path in outputs if path in written)
+
+    def record(self, key, inputs, outputs=()):
+        """Record a built key with the outputs it actually wrote among outputs."""
+        written = [path for path in outputs if os.path.exists(path)]
+        with self.lock:
+            self.entries[key] = {"inputs": inputs, "outputs": written, "time": time.time()}
+
+    def keys(self, prefix):
+        with self.lock:
+            return [key for key in self.entries if key.startswith(prefix)]
+
+    def upstream_digest(self, keys):
+        """Digest of the recorded inputs of upstream outputs; None entries mark outputs never built."""
+        with self.lock:
+            return value_digest({key: self.entries.get(key, {}).get("inputs") for key in sorted(keys)})
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        with self.lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import t as t_dist
+from aggregation import factorize_donors
+
+METRICS = ["MAE", "Pearson", "Spearman", "R2"]
+
+def grouped_ranks(values, codes):
+    """
+    Average ranks (1-based, ties averaged) of values within each group, as scipy.stats.rankdata per group.
+
+    Parameters:
+        values (np.ndarray): Values to rank.
+        codes (np.ndarray): Integer group code of every value.
+
+    Returns:
+        np.ndarray: Rank of every value within its group.
+    """
+    order = np.lexsort((values, codes))
+    sorted_values, sorted_codes = values[order], codes[order]
+
+    new_run = np.ones(len(order), dtype=bool)
+    new_run[1:] = (sorted_values[1:] != sorted_values[:-1]) | (sorted_codes[1:] != sorted_codes[:-1])
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(order))
+    group_start = np.searchsorted(sorted_codes, sorted_codes, side="left")
+
+    run_ranks = (starts + ends + 1) / 2
+    ranks = np.empty(len(order))
+    ranks[order] = np.repeat(run_ranks, ends - starts) - group_start
+    return ranks
+
+def correlation_pvalue(r, n):
+    """Two-sided p-value of a correlation coefficient, as reported by scipy pearsonr and spearmanr."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dof = n - 2
+        t = r * np.sqrt(dof / np.maximum(1 - r ** 2, 0))
+        return np.where(dof > 0, 2 * t_dist.sf(np.abs(t), np.maximum(dof, 1)), np.nan)
+
+def correlation(n, sx, sy, sxx, syy, sxy):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx ** 2 / n
+        var_y = syy - sy ** 2 / n
+        return np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+
+def sufficient_statistics(y_true, y_pred, codes, n_groups):
+    """Per-group sums needed for MAE, Pearson and R2: n, Σx, Σy, Σx², Σy², Σxy, Σ|y-x|, Σ(y-x)²."""
+    error = y_pred - y_true
+    columns = [np.ones_like(y_true), y_true, y_pred, y_true ** 2, y_pred ** 2, y_true * y_pred,
+               np.abs(error), error ** 2]
+    return np.stack([np.bincount(codes, weights=c, minlength=n_groups) for c in columns], axis=-1)
+
+def metrics_from_statistics(stats):
+    """MAE, Pearson and R2 from the sums of sufficient_statistics (last axis)."""
+    n, sx, sy, sxx, syy, sxy, sae, sse = np.moveaxis(stats, -1, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mae = sae / n
+        r2 = 1 - sse / (sxx - sx ** 2 / n)
+    return mae, correlation(n, sx, sy, sxx, syy, sxy), r2
+
+def grouped_metrics(y_true, y_pred, groups):
+    """
+    Compute MAE, Pearson, Spearman and R2 with their p-values for every group in one pass.
+
+    Pearson, R2 and MAE come from per-group sufficient statistics reduced with
+    np.bincount; Spearman is the Pearson correlation of the within-group ranks.
+
+    Parameters:
+        y_true (array-like): True ages.
+        y_pred (array-like): Predicted ages.
+        groups (array-like): Group label (e.g. cell type) of every prediction.
+
+    Returns:
+        pd.DataFrame: One row per group, indexed by group label, with 'n_cells', 'MAE',
+            'Pearson', 'Pearson_pval', 'Spearman', 'Spearman_pval' and 'R2'.
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    codes, labels = pd.factorize(np.asarray(groups), sort=True)
+    n_groups = len(labels)
+
+    stats = sufficient_statistics(y_true, y_pred, codes, n_groups)
+    mae, pearson, r2 = metrics_from_statistics(stats)
+    n = stats[:, 0]
+
+    rank_true, rank_pred = grouped_ranks(y_true, codes), grouped_ranks(y_pred, codes)
+    spearman = metrics_from_statistics(sufficient_statistics(rank_true, rank_pred, codes, n_groups))[1]
+
+    return pd.DataFrame({
+        "n_cells": n.astype(int),
+        "MAE": mae,
+        "Pearson": pearson,
+        "Pearson_pval": correlation_pvalue(pearson, n),
+        "Spearman": spearman,
+        "Spearman_pval": correlation_pvalue(spearman, n),
+        "R2": r2,
+    }, index=pd.Index(labels, name="group"))
+
+def bootstrap_group(y_true, y_pred, rank_true, rank_pred, donors, n_boot, rng):
+    """
+    Donor-level bootstrap replicates of MAE, Pearson, Spearman and R2 for one group.
+
+    Each replicate draws donors with replacement and is represented as a row of a
+    (n_boot, n_donors) count matrix, so every replicate is a matrix product of the counts
+    with per-donor sufficient statistics. Spearman uses the within-group ranks of the
+    full sample rather than re-ranking every resample.
+
+    Returns:
+        np.ndarray: (n_boot, 4) replicates in the order of METRICS.
+    """
+    donor_codes, donor_labels = factorize_donors(donors)
+    n_donors = len(donor_labels)
+    counts = rng.multinomial(n_donors, np.full(n_donors, 1 / n_donors), size=n_boot).astype(np.float64)
+
+    mae, pearson, r2 = metrics_from_statistics(counts @ sufficient_statistics(y_true, y_pred, donor_codes, n_donors))
+    spearman = metrics_from_statistics(counts @ sufficient_statistics(rank_true, rank_pred, donor_codes, n_donors))[1]
+    return np.column_stack([mae, pearson, spearman, r2])
+
+def bootstrap_ci(y_true, y_pred, groups, donors, n_boot=1000, confidence=0.95, seed=0):
+    """
+    Percentile confidence intervals of MAE, Pearson, Spearman and R2 from a donor-level bootstrap per group.
+
+    Parameters:
+        y_true (array-like): True ages.
+        y_pred (array-like): Predicted ages.
+        groups (array-like): Group label of every prediction.
+        donors (array-like): Donor of every prediction; donors are the resampling unit.
+        n_boot (int): Number of bootstrap replicates.
+        confidence (float): Coverage of the intervals.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: One row per group with '<metric>_ci_low' and '<metric>_ci_high' columns.
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    donors = np.asarray(donors)
+    codes, labels = pd.factorize(np.asarray(groups), sort=True)
+    rank_true, rank_pred = grouped_ranks(y_true, codes), grouped_ranks(y_pred, codes)
+    rng = np.random.default_rng(seed)
+    tail = (1 - confidence) / 2 * 100
+
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+
+    rows = []
+    for g in range(len(labels)):
+        rows_g = order[bounds[g]:bounds[g + 1]]
+        replicates = bootstrap_group(y_true[rows_g], y_pred[rows_g], rank_true[rows_g], rank_pred[rows_g],
+                                     donors[rows_g], n_boot, rng)
+        low, high = np.nanpercentile(replicates, [tail, 100 - tail], axis=0)
+        rows.append(np.ravel(np.column_stack([low, high])))
+
+    columns = [f"{metric}_ci_{side}" for metric in METRICS for side in ["low", "high"]]
+    return pd.DataFrame(rows, columns=columns, index=pd.Index(labels, name="group"))
+
+def evaluate_groups(df, group_column, true_column="true_age", pred_column="predicted_age",
+                    donor_column="donor_id", n_boot=0, confidence=0.95, seed=0):
+    """
+    Metrics of every group of a prediction table, with donor bootstrap intervals when n_boot > 0.
+
+    Returns:
+        pd.DataFrame: Output of grouped_metrics, joined with bootstrap_ci, with the group
+            labels in group_column.
+    """
+    y_true, y_pred, groups = df[true_column].values, df[pred_column].values, df[group_column].values
+    result = grouped_metrics(y_true, y_pred, groups)
+    if n_boot > 0:
+        result = result.join(bootstrap_ci(y_true, y_pred, groups, df[donor_column].values, n_boot, confidence, seed))
+    return result.rename_axis(group_column).reset_index()
@@ -0,0 +1,112 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+NORMALIZATION_PARAMS = {"target_sum": 10000, "log1p": True, "age": "parsed"}
+
+def source_fingerprint(filepath, sample_bytes=1024 ** 2):
+    """
+    Fingerprint a source file from its size, mtime and a hash of its first and last megabyte.
+    For a shard folder, its index.json is fingerprinted.
+    """
+    if os.path.isdir(filepath):
+        filepath = os.path.join(filepath, "index.json")
+
+    stat = os.stat(filepath)
+    digest = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        digest.update(f.read(sample_bytes))
+        f.seek(max(stat.st_size - sample_bytes, 0))
+        digest.update(f.read(sample_bytes))
+    return f"{stat.st_size}-{stat.st_mtime_ns}-{digest.hexdigest()}"
+
+def cache_key(filepath, cell_type, healthy_only=False, params=NORMALIZATION_PARAMS, dtype=np.float32):
+    """Key of a normalized cell type: source fingerprint, cell-type mask, normalization parameters and dtype."""
+    parts = {
+        "source": source_fingerprint(filepath),
+        "cell_type": cell_type,
+        "healthy_only": bool(healthy_only),
+        "params": params,
+        "dtype": np.dtype(dtype).name,
+    }
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def read_cache(cache_folder, key):
+    """
+    Return (CSR matrix, var names, obs) of a cached entry, or None on a miss.
+    The matrix arrays are memory-mapped and the entry is marked as recently used.
+    """
+    path = os.path.join(cache_folder, key)
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    os.utime(meta_path)
+
+    X = sp.csr_matrix((
+        np.load(os.path.join(path, "data.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "indices.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "indptr.npy"), mmap_mode="r"),
+    ), shape=tuple(meta["shape"]), copy=False)
+    var_names = pd.Index(np.load(os.path.join(path, "var_names.npy")))
+    obs = pd.read_pickle(os.path.join(path, "obs.pkl"))
+
+    return X, var_names, obs
+
+def write_cache(cache_folder, key, X, var_names, obs, budget_mb=None):
+    """
+    Store a normalized matrix, in its own floating dtype, with its var names and obs,
+    then evict the least recently used entries until the cache fits budget_mb.
+    """
+    path = os.path.join(cache_folder, key)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    X = sp.csr_matrix(X)
+    np.save(os.path.join(tmp_path, "data.npy"), X.data)
+    np.save(os.path.join(tmp_path, "indices.npy"), X.indices)
+    np.save(os.path.join(tmp_path, "indptr.npy"), X.indptr)
+    np.save(os.path.join(tmp_path, "var_names.npy"), np.asarray(var_names, dtype=str))
+    obs.to_pickle(os.path.join(tmp_path, "obs.pkl"))
+
+    size = sum(os.path.getsize(os.path.join(tmp_path, f)) for f in os.listdir(tmp_path))
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"shape": list(X.shape), "bytes": size}, f)
+
+    # Another writer may have stored the same key since the check; its entry is kept.
+    if os.path.exists(path):
+        shutil.rmtree(tmp_path)
+    else:
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    if budget_mb is not None:
+        evict(cache_folder, budget_mb, keep=key)
+
+def evict(cache_folder, budget_mb, keep=None):
+    entries = []
+    for key in os.listdir(cache_folder):
+        meta_path = os.path.join(cache_folder, key, "meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            size = json.load(f)["bytes"]
+        entries.append((os.path.getmtime(meta_path), key, size))
+
+    total = sum(size for _, _, size in entries)
+    for _, key, size in sorted(entries):
+        if total <= budget_mb * 1024 ** 2:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_folder, key), ignore_errors=True)
+        total -= size
+        print(f"Evicted normalization cache entry {key}")
@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import anndata as ad
+from preprocessing import normalize_counts, read_rows, row_nnz, iter_row_chunks, training_obs, BYTES_PER_NNZ
+from sharding import shard_parts, load_shard_obs
+from aggregation import factorize_donors
+
+def stratified_order(donor_ids, rng):
+    """
+    A random order of the cells in which every stretch holds each donor in proportion
+    to its number of cells, so that each chunk of the order is a donor-stratified sample.
+    """
+    codes, _ = factorize_donors(donor_ids)
+    counts = np.bincount(codes)
+    shuffled = rng.permutation(len(codes))
+    by_donor = shuffled[np.argsort(codes[shuffled], kind="stable")]
+    within = np.arange(len(codes)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    position = np.empty(len(codes))
+    position[by_donor] = (within + rng.random(len(codes))) / np.repeat(counts, counts)
+    return np.argsort(position)
+
+def celltype_source(filepath, cell_type, shard_dir=None):
+    """
+    The training obs of a cell type and where its counts are, read without the counts.
+
+    Returns:
+        tuple: (pd.DataFrame with 'age', 'donor_id' and 'cell_id';
+            dict with the backed 'adata' and the .h5ad row 'indices' of the cells, or the
+            shard 'parts' with their number of cells in 'sizes')
+    """
+    if shard_dir is not None:
+        sub_obs, sizes = load_shard_obs(shard_dir, cell_type)
+        return training_obs(sub_obs), {"parts": shard_parts(shard_dir, cell_type), "sizes": sizes}
+
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"File not found: {filepath}")
+    adata = ad.read_h5ad(filepath, backed="r")
+    indices = np.where(adata.obs["cell_type"] == cell_type)[0]
+    if len(indices) == 0:
+        raise ValueError(f"No cells found for type: {cell_type}")
+    return training_obs(adata.obs.iloc[indices]), {"adata": adata, "indices": indices}
+
+def source_var_names(source, shard_dir=None):
+    """Gene names of the columns of a celltype_source."""
+    if "adata" in source:
+        return source["adata"].var_names
+    return pd.read_csv(os.path.join(shard_dir, "var.csv"), index_col=0).index
+
+def block_chunks(row_bytes, chunk_size=None, memory_budget_mb=None, n_blocks=8, rng=None):
+    """
+    Split rows into contiguous blocks of about 1 / n_blocks of a chunk and group
+    n_blocks random blocks into every chunk, so each chunk mixes rows from across the
+    whole span while reading only n_blocks contiguous stretches.
+
+    Yields:
+        list: Position arrays of the blocks of one chunk.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    block_size = None if chunk_size is None else max(1, chunk_size // n_blocks)
+    block_budget = None if memory_budget_mb is None else memory_budget_mb / n_blocks
+    blocks = list(iter_row_chunks(np.arange(len(row_bytes)), row_bytes, block_size, block_budget))
+    order = rng.permutation(len(blocks))
+    for start in range(0, len(blocks), n_blocks):
+        yield [blocks[block] for block in np.sort(order[start:start + n_blocks])]
+
+def iter_training_chunks(source, donor_ids, chunk_size=None, memory_budget_mb=None, seed=0, n_blocks=8):
+    """
+    Stream chunks of normalized expression that mix the donors of the cell type.
+
+    From an .h5ad file, each chunk is made of n_blocks random contiguous blocks of the
+    cell type's rows (block_chunks), so a pass reads every row once in long sequential
+    reads; the rows are shuffled again by every SGD update. From shards, whole parts are
+    read in random order and split into donor-stratified chunks, so at most one part of
+    raw counts is in memory.
+
+    Yields:
+        tuple: (positions of the chunk's cells in the cell type's obs, CSR float64 log-normalized expression)
+    """
+    rng = np.random.default_rng(seed)
+    if "adata" in source:
+        adata, indices = source["adata"], source["indices"]
+        row_bytes = row_nnz(adata)[indices] * BYTES_PER_NNZ
+        for blocks in block_chunks(row_bytes, chunk_size, memory_budget_mb, n_blocks, rng):
+            counts = sp.vstack([read_rows(adata.X, indices[block]) for block in blocks], format="csr")
+            yield np.concatenate(blocks), normalize_counts(counts, copy=False, dtype=np.float64)
+        return
+
+    starts = np.cumsum(source["sizes"]) - source["sizes"]
+    for part in rng.permutation(len(source["parts"])):
+        X = normalize_counts(sp.load_npz(f"{source['parts'][part]}.npz").tocsr(), copy=False, dtype=np.float64)
+        offset = starts[part]
+        order = stratified_order(donor_ids[offset:offset + X.shape[0]], rng)
+        row_bytes = np.diff(X.indptr)[order] * BYTES_PER_NNZ
+        for chunk in iter_row_chunks(order, row_bytes, chunk_size, memory_budget_mb):
+            positions = np.sort(chunk)
+            yield offset + positions, X[positions]
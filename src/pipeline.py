@@ -0,0 +1,288 @@
+import os
+from functools import partial
+from celltype_mappings import CELLTYPE_MAPPINGS
+from manifest import RunManifest, file_digest, value_digest, code_version
+from norm_cache import source_fingerprint
+from scheduler import run_units, check_failures
+from clock_artifacts import artifact_path
+from prediction_store import partition_path, prediction_source
+from imputation import REFERENCE_STRATEGIES
+from dag import Stage, run_dag
+from profiling import profile
+import train_model
+import apply_external_models as external
+import evaluate
+import evaluate_external
+import visualize
+import visualize_external
+
+STAGES = ["train", "evaluate", "plot", "apply_external", "evaluate_external", "plot_external"]
+TRAIN_CODE = ["train_model", "out_of_core", "subsampling", "preprocessing", "age_parsing", "scoring", "clock_artifacts", "gene_alignment", "prediction_store"]
+EXTERNAL_CODE = ["apply_external_models", "preprocessing", "scoring", "clock_artifacts", "gene_alignment",
+                 "aggregation", "prediction_store", "precision", "age_parsing", "imputation", "out_of_core",
+                 "norm_cache", "sharding"]
+
+def configure_external(config):
+    """Point apply_external_models at the folders of the configuration."""
+    paths = config["paths"]
+    external.configure(paths["data_folder"], paths["model_folder"], paths["imputation_folder"],
+                       paths["compiled_folder"], paths["alignment_folder"],
+                       paths["external_predictions_folder"], paths["store_folder"], config["external"]["precision"],
+                       config["external"]["imputation"], paths["aida_path"], paths["shard_dir"])
+
+def run_step(manifest, key, inputs, outputs, func, force=False):
+    """Run func when the output key is stale and record it; returns its result, or None when up to date."""
+    if not force and not manifest.stale(key, inputs, outputs):
+        print(f"Up to date: {key}")
+        return None
+    result = func()
+    manifest.record(key, inputs, outputs)
+    manifest.save()
+    return result
+
+def train_stage(manifest, config, force=False):
+    """
+    Train the clocks whose data, imputation file, search grid or training code changed.
+
+    Returns:
+        list: Manifest keys of all trained cell types.
+    """
+    paths, train = config["paths"], config["train"]
+    imputation_folder = paths["imputation_folder"]
+    cell_types = [f.replace("Impute_avg_", "").replace(".csv", "")
+                  for f in os.listdir(imputation_folder) if f.endswith(".csv")]
+    data_digest = source_fingerprint(paths["shard_dir"] or paths["aida_path"])
+    code = code_version(TRAIN_CODE)
+    out_of_core = None
+    if train["out_of_core"]["enabled"]:
+        out_of_core = {key: value for key, value in train["out_of_core"].items() if key != "enabled"}
+    subsample = train["subsample"] if train["subsample"]["strategy"] is not None else None
+    params = value_digest({"alphas": train["alphas"], "l1_ratios": train["l1_ratios"], "inner_folds": train["inner_folds"],
+                           "output_format": config["external"]["output_format"], "out_of_core": out_of_core,
+                           "subsample": subsample})
+
+    keys, stale = {}, []
+    for cell_type in cell_types:
+        key = f"train/{cell_type}"
+        inputs = {
+            "data": data_digest,
+            "impute": file_digest(os.path.join(imputation_folder, f"Impute_avg_{cell_type}.csv")),
+            "params": params,
+            "code": code,
+        }
+        outputs = [os.path.join(paths["model_folder"], f"{cell_type}_models5.csv")]
+        keys[cell_type] = (key, inputs, outputs)
+        if force or manifest.stale(key, inputs, outputs):
+            stale.append(cell_type)
+
+    print(f"Training {len(stale)} of {len(cell_types)} cell types")
+    if stale:
+        failures = train_model.main(paths["aida_path"], paths["model_folder"], paths["predictions_folder"], stale,
+                                    paths["shard_dir"], imputation_folder, paths["compiled_folder"],
+                                    config["workers"], config["pool_memory_mb"], config["retries"],
+                                    train["alphas"], train["l1_ratios"], train["fold_jobs"],
+                                    paths["cache_folder"], config["cache_budget_mb"],
+                                    config["external"]["output_format"], paths["store_folder"], out_of_core,
+                                    subsample, train["inner_folds"])
+        failed = {unit.cell_type for unit in failures}
+        for cell_type in stale:
+            if cell_type not in failed:
+                manifest.record(*keys[cell_type])
+        manifest.save()
+        check_failures(failures)
+
+    return [key for key, _, _ in keys.values()]
+
+def clock_inputs(clock):
+    """Digests of the files a clock is loaded from, or None when it cannot be loaded."""
+    model = file_digest(os.path.join(external.MODEL_FOLDER, f"{clock}_models5.csv"))
+    impute = file_digest(os.path.join(external.IMPUTE_FOLDER, f"Impute_avg_{clock}.csv"))
+    compiled = file_digest(artifact_path(external.COMPILED_FOLDER, clock))
+    if compiled is None and (model is None or impute is None):
+        return None
+    return {"model": model, "impute": impute, "compiled": compiled}
+
+def prediction_outputs(dataset, cell_type, clock, clock_targets, output_format):
+    outputs = []
+    if output_format in ("csv", "both"):
+        outputs.append(os.path.join(external.OUTPUT_FOLDER, dataset,
+                                    external.prediction_file(cell_type, clock, clock_targets)))
+    if output_format in ("parquet", "both"):
+        outputs.append(partition_path(external.STORE_FOLDER, dataset, cell_type, clock))
+    return outputs
+
+def external_stage(manifest, config, dataset, force=False):
+    """
+    Apply the clocks to the (cell type, clock) units of an external dataset whose inputs changed:
+    the h5ad file, the clock files, the CELLTYPE_MAPPINGS entry, the training data read by the
+    reference imputation strategies, the loading and output options or the code.
+
+    Returns:
+        list: Manifest keys of all units of the dataset.
+    """
+    options = config["external"]
+    data_digest = source_fingerprint(os.path.join(external.DATA_FOLDER, f"{dataset}.h5ad"))
+    code = code_version(EXTERNAL_CODE)
+    params = value_digest({key: options[key] for key in ["output_format", "donor_summary", "pseudobulk", "precision", "imputation",
+                                                         "gene_subset", "chunk_size", "memory_budget_mb"]})
+    reference = external.REFERENCE_SHARD_DIR or external.REFERENCE_PATH
+    reference_digest = None
+    if options["imputation"] in REFERENCE_STRATEGIES and reference is not None and os.path.exists(reference):
+        reference_digest = source_fingerprint(reference)
+    mapping = CELLTYPE_MAPPINGS.get(dataset, {})
+
+    keys, records, units = [], {}, []
+    for unit in external.dataset_units(dataset):
+        stale_clocks = []
+        for clock in unit.clocks:
+            clock_digests = clock_inputs(clock)
+            if clock_digests is None:
+                print(f"Skipping {dataset} / {unit.cell_type} → {clock}: missing model or impute")
+                continue
+
+            key = f"apply_external/{dataset}/{unit.cell_type}/{clock}"
+            inputs = {"data": data_digest, **clock_digests, "mapping": value_digest(mapping.get(unit.cell_type)),
+                      "reference": reference_digest, "params": params, "code": code}
+            outputs = prediction_outputs(dataset, unit.cell_type, clock, unit.clocks, options["output_format"])
+            keys.append(key)
+            records[(unit.cell_type, clock)] = (key, inputs, outputs)
+            if force or manifest.stale(key, inputs, outputs):
+                stale_clocks.append(clock)
+
+        if stale_clocks:
+            units.append(unit._replace(clocks=tuple(stale_clocks)))
+
+    print(f"{dataset}: applying {sum(len(u.clocks) for u in units)} of {len(keys)} (cell type, clock) units")
+    if units:
+        external.imputation_coverage(dataset)
+    if units and options["precision"] == "float32" and options["precision_sample"] > 0:
+        external.validate_dataset_precision(dataset, options["precision_sample"], options["precision_tolerance"])
+    if units:
+        task = partial(external.process_unit, chunk_size=options["chunk_size"],
+                       memory_budget_mb=options["memory_budget_mb"], gene_subset=options["gene_subset"],
+                       cache_folder=config["paths"]["cache_folder"], cache_budget_mb=config["cache_budget_mb"],
+                       donor_summary=options["donor_summary"], pseudobulk=options["pseudobulk"],
+                       output_format=options["output_format"])
+        failures = run_units(task, units, config["workers"], config["pool_memory_mb"], config["retries"],
+                             external.configure, external.settings())
+        for unit in units:
+            if unit in failures:
+                continue
+            for clock in unit.clocks:
+                manifest.record(*records[(unit.cell_type, clock)])
+        manifest.save()
+        check_failures(failures)
+
+    return keys
+
+def pipeline_stages(config, manifest, stages=STAGES, force=False):
+    """
+    Declare the selected stages as a dependency DAG.
+
+    Training and external inference rebuild only their stale units; the evaluation
+    summaries and figures list the manifest keys of their upstream units as inputs and
+    are rebuilt only when one of those units was rebuilt with different inputs, or when
+    their code changed. Summaries are passed to the figure stages in memory. Stages that
+    start worker pools share the 'process_pool' resource and stages that draw share
+    'matplotlib', so they do not run at the same time.
+
+    Returns:
+        list: Stages for dag.run_dag.
+    """
+    paths = config["paths"]
+    n_boot = config["evaluate"]["n_boot"]
+    summary_path = os.path.join(paths["results_folder"], "summary_performance.csv")
+    source = prediction_source(config["external"]["output_format"])
+    selected = lambda *names: tuple(name for name in names if name.split(":")[0] in stages)
+    dag = []
+
+    if "train" in stages:
+        dag.append(Stage("train", lambda upstream: train_stage(manifest, config, force), (), ("process_pool",)))
+
+    if "evaluate" in stages:
+        def evaluate_aida(upstream):
+            train_keys = upstream["train"] if "train" in upstream else manifest.keys("train/")
+            return run_step(
+                manifest, "evaluate",
+                {"upstream": manifest.upstream_digest(train_keys), "source": source,
+                 "code": code_version(["evaluate", "metrics"])},
+                [summary_path],
+                partial(evaluate.summarize, paths["predictions_folder"], summary_path, paths["store_folder"], n_boot,
+                        source),
+                force)
+        dag.append(Stage("evaluate", evaluate_aida, selected("train")))
+
+    if "plot" in stages:
+        def plot_aida(upstream):
+            return run_step(
+                manifest, "plot",
+                {"upstream": manifest.upstream_digest(["evaluate"]), "source": source,
+                 "code": code_version(["visualize", "figures"])},
+                [os.path.join(paths["figures_folder"], "mae_per_cell_type.png")],
+                partial(visualize.plot_summary, upstream.get("evaluate"), summary_path, paths["predictions_folder"],
+                        paths["figures_folder"], paths["store_folder"], config["plot"]["workers"], source=source),
+                force)
+        dag.append(Stage("plot", plot_aida, selected("evaluate"), ("matplotlib",)))
+
+    for dataset in config["datasets"]:
+        apply_name, evaluate_name = f"apply_external:{dataset}", f"evaluate_external:{dataset}"
+
+        if "apply_external" in stages:
+            def apply_dataset(upstream, dataset=dataset):
+                return external_stage(manifest, config, dataset, force)
+            dag.append(Stage(apply_name, apply_dataset, selected("train"), ("process_pool",)))
+
+        if "evaluate_external" in stages:
+            def evaluate_dataset(upstream, dataset=dataset, apply_name=apply_name):
+                unit_keys = upstream[apply_name] if apply_name in upstream else manifest.keys(f"apply_external/{dataset}/")
+                return run_step(
+                    manifest, f"evaluate_external/{dataset}",
+                    {"upstream": manifest.upstream_digest(unit_keys), "source": source,
+                     "code": code_version(["evaluate_external", "metrics", "prediction_store", "age_parsing"])},
+                    [os.path.join(paths["results_folder"], f"{dataset}_summary.csv")],
+                    partial(evaluate_external.summarize_dataset, dataset, n_boot, paths["external_predictions_folder"],
+                            paths["results_folder"], paths["store_folder"], source),
+                    force)
+            dag.append(Stage(evaluate_name, evaluate_dataset, selected(apply_name)))
+
+    if "plot_external" in stages:
+        def plot_external(upstream):
+            summaries = {name.split(":", 1)[1]: summary for name, summary in upstream.items() if summary is not None}
+            missing = [dataset for dataset in visualize_external.datasets if dataset not in summaries
+                       and not os.path.exists(os.path.join(paths["results_folder"], f"{dataset}_summary.csv"))]
+            if missing:
+                print(f"Skipping external figures: no summary for {', '.join(missing)}")
+                return None
+            return run_step(
+                manifest, "plot_external",
+                {"upstream": manifest.upstream_digest([f"evaluate_external/{d}" for d in visualize_external.datasets]),
+                 "code": code_version(["visualize_external", "figures"])},
+                [paths["external_figures_folder"]],
+                partial(visualize_external.plot_external, summaries, paths["results_folder"],
+                        paths["external_figures_folder"], config["plot"]["workers"]),
+                force)
+        evaluate_names = selected(*[f"evaluate_external:{dataset}" for dataset in config["datasets"]])
+        dag.append(Stage("plot_external", plot_external, evaluate_names, ("matplotlib",)))
+
+    return dag
+
+def timed(stage):
+    """Wrap a stage so its wall time and memory are recorded as a 'pipeline' metrics record."""
+    def func(upstream):
+        with profile("pipeline", step=stage.name):
+            return stage.func(upstream)
+    return stage._replace(func=func)
+
+def run(config, stages=STAGES, force=False):
+    """
+    Rebuild the stale parts of the pipeline, like a small make, running independent
+    stages concurrently (config['stage_workers']).
+
+    Returns:
+        dict: Exceptions of the failed stages by stage name.
+    """
+    configure_external(config)
+    manifest = RunManifest(config["paths"]["manifest_path"])
+    dag = [timed(stage) for stage in pipeline_stages(config, manifest, stages, force)]
+    _, failures = run_dag(dag, config["stage_workers"])
+    return failures
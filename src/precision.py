@@ -0,0 +1,111 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import anndata as ad
+from celltype_mappings import CELLTYPE_MAPPINGS
+from preprocessing import normalize_counts, read_rows
+from scoring import score_matrix
+from clock_artifacts import get_clock
+from gene_alignment import get_alignment
+
+TOLERANCE = 0.01
+
+def reference_clock(clock, model_folder, imputation_folder, compiled_folder=None):
+    """
+    The clock in float64: stacked from the model and imputation CSVs when they exist,
+    otherwise the compiled (float32) artifact cast up.
+    """
+    clock_weights = get_clock(clock, model_folder, imputation_folder)
+    if clock_weights is None:
+        clock_weights = get_clock(clock, model_folder, imputation_folder, compiled_folder)
+    if clock_weights is None:
+        return None
+    return clock_weights._replace(weights=np.asarray(clock_weights.weights, dtype=np.float64),
+                                  impute=np.asarray(clock_weights.impute, dtype=np.float64))
+
+def precision_errors(counts, var_names, reference, clock, alignment=None):
+    """
+    Absolute difference per cell between the float32 pipeline (float32 normalization and
+    the clock as it is used for scoring, compiled weights included) and the float64 reference.
+    """
+    _, expected = score_matrix(normalize_counts(counts, dtype=np.float64), var_names, reference, alignment)
+    _, predicted = score_matrix(normalize_counts(counts, dtype=np.float32), var_names, clock, alignment)
+    return np.abs(predicted - expected)
+
+def validate_precision(adata, targets, model_folder, imputation_folder, compiled_folder=None,
+                       sample_size=1000, tolerance=TOLERANCE, healthy_only=False, seed=0):
+    """
+    Compare float32 and float64 predictions on a random sample of cells of every cell type.
+
+    Parameters:
+        adata (AnnData): Backed dataset with raw counts.
+        targets (dict): Clocks to check per cell type, e.g. a CELLTYPE_MAPPINGS entry.
+        sample_size (int): Maximum number of cells sampled per cell type.
+        tolerance (float): Largest accepted absolute age error in years.
+        healthy_only (bool): Sample only cells with disease 'normal'.
+
+    Returns:
+        pd.DataFrame: One row per (cell type, clock) with the number of cells, the max and
+            mean absolute error and whether the max is within tolerance.
+    """
+    rng = np.random.default_rng(seed)
+    aliases = adata.var["feature_name"] if "feature_name" in adata.var.columns else None
+    mask = (adata.obs["disease"] == "normal").values if healthy_only and "disease" in adata.obs.columns else True
+    cell_types = adata.obs["cell_type"].astype(str).values
+
+    rows = []
+    for cell_type, clocks in targets.items():
+        indices = np.where((cell_types == cell_type) & mask)[0]
+        if len(indices) == 0:
+            continue
+        indices = np.sort(rng.choice(indices, min(sample_size, len(indices)), replace=False))
+        counts = read_rows(adata.X, indices)
+
+        for clock in [clocks] if isinstance(clocks, str) else clocks:
+            clock_weights = get_clock(clock, model_folder, imputation_folder, compiled_folder)
+            reference = reference_clock(clock, model_folder, imputation_folder, compiled_folder)
+            if clock_weights is None:
+                continue
+            alignment = get_alignment(adata.var_names, clock_weights.genes, aliases=aliases)
+            errors = precision_errors(counts, adata.var_names, reference, clock_weights, alignment)
+            rows.append({"cell_type": cell_type, "clock": clock, "n_cells": len(indices),
+                         "max_abs_error": errors.max(), "mean_abs_error": errors.mean(),
+                         "passed": bool(errors.max() <= tolerance)})
+
+    return pd.DataFrame(rows, columns=["cell_type", "clock", "n_cells", "max_abs_error", "mean_abs_error", "passed"])
+
+def check_precision(report, tolerance=TOLERANCE):
+    """Raise ValueError naming the (cell type, clock) pairs of a validate_precision report above tolerance."""
+    failed = report[~report["passed"]]
+    if len(failed):
+        pairs = ", ".join(f"{row.cell_type} → {row.clock} ({row.max_abs_error:.2g} years)" for row in failed.itertuples())
+        raise ValueError(f"float32 predictions differ from float64 by more than {tolerance} years: {pairs}")
+
+def dataset_targets(dataset_name, adata):
+    """Clocks per cell type of a dataset: its CELLTYPE_MAPPINGS entry, or the cell type's own clock."""
+    mapping = CELLTYPE_MAPPINGS.get(dataset_name, {})
+    return {cell_type: mapping.get(cell_type, cell_type) for cell_type in adata.obs["cell_type"].astype(str).unique()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check float32 predictions against the float64 reference")
+    parser.add_argument("--data_path", type=str, default="../data/AIDA.h5ad", help="Path to the input .h5ad file")
+    parser.add_argument("--model_folder", type=str, default="../models/", help="Folder containing trained models")
+    parser.add_argument("--imputation_folder", type=str, default="../data_for_imputation/", help="Folder containing imputation files")
+    parser.add_argument("--compiled_folder", type=str, default="../compiled_clocks/", help="Folder containing compiled clocks")
+    parser.add_argument("--sample_size", type=int, default=1000, help="Cells sampled per cell type")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Largest accepted absolute age error in years")
+    parser.add_argument("--healthy_only", action="store_true", help="Sample only cells with disease 'normal'")
+
+    args = parser.parse_args()
+
+    adata = ad.read_h5ad(args.data_path, backed="r")
+    dataset_name = os.path.splitext(os.path.basename(args.data_path))[0]
+    report = validate_precision(adata, dataset_targets(dataset_name, adata), args.model_folder, args.imputation_folder,
+                                args.compiled_folder, args.sample_size, args.tolerance, args.healthy_only)
+    print(report.to_string(index=False))
+
+    if not report["passed"].all():
+        print(f"{(~report['passed']).sum()} clocks above the tolerance of {args.tolerance} years")
+        sys.exit(1)
@@ -0,0 +1,135 @@
+import os
+import time
+import shutil
+import argparse
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+STORE_FOLDER = "../prediction_store/"
+PARTITIONS = ["dataset", "cell_type", "clock"]
+DICTIONARY_COLUMNS = ["donor_id", "age"]
+CV_DATASET = "AIDA_cv"
+SOURCES = ["csv", "parquet"]
+
+def partition_path(store_folder, *values):
+    """Hive-style folder of a (dataset, cell_type, clock) partition, or of a prefix of it."""
+    return os.path.join(store_folder, *[f"{key}={quote(str(value), safe=' ,')}"
+                                        for key, value in zip(PARTITIONS, values)])
+
+def clear_partition(store_folder, dataset, cell_type, clock):
+    shutil.rmtree(partition_path(store_folder, dataset, cell_type, clock), ignore_errors=True)
+
+def to_table(df):
+    """
+    Convert predictions to Arrow with float32 predictions and dictionary-encoded donor and
+    age labels. Ages that are all numbers are stored as numbers, as they read back from CSV.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column.startswith("predicted_age"):
+            df[column] = df[column].astype(np.float32)
+        elif column in DICTIONARY_COLUMNS and not pd.api.types.is_numeric_dtype(df[column]):
+            numeric = pd.to_numeric(df[column], errors="coerce")
+            if column == "age" and numeric.notna().sum() == df[column].notna().sum():
+                df[column] = numeric
+            else:
+                df[column] = df[column].astype(str).astype("category")
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def append_predictions(store_folder, dataset, cell_type, clock, df):
+    """
+    Append a batch of predictions to the (dataset, cell_type, clock) partition as a new Parquet part.
+
+    Returns:
+        str: Path of the written part.
+    """
+    folder = partition_path(store_folder, dataset, cell_type, clock)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"part-{time.time_ns()}-{os.getpid()}.parquet")
+    pq.write_table(to_table(df), path)
+    return path
+
+def write_predictions(df, csv_path, store_folder, dataset, cell_type, clock, output_format="csv"):
+    """
+    Save a complete prediction table as a CSV file, as a fresh store partition, or both.
+
+    Parameters:
+        df (pd.DataFrame): Predictions.
+        csv_path (str): Path of the CSV file.
+        store_folder (str): Root of the store.
+        dataset, cell_type, clock (str): Partition of the predictions in the store.
+        output_format (str): 'csv', 'parquet' or 'both'.
+    """
+    if output_format in ("csv", "both"):
+        df.to_csv(csv_path, index=False)
+    if output_format in ("parquet", "both"):
+        clear_partition(store_folder, dataset, cell_type, clock)
+        append_predictions(store_folder, dataset, cell_type, clock, df)
+
+def prediction_source(output_format):
+    """Where predictions written with output_format are read back from: the store unless only CSVs were written."""
+    return "csv" if output_format == "csv" else "parquet"
+
+def open_store(store_folder, dataset):
+    """Open the partitions of one dataset; every dataset has its own schema."""
+    partitioning = ds.partitioning(pa.schema([(key, pa.string()) for key in PARTITIONS[1:]]), flavor="hive")
+    return ds.dataset(partition_path(store_folder, dataset), format="parquet", partitioning=partitioning)
+
+def partition_filter(cell_type=None, clock=None):
+    expression = None
+    for key, value in zip(PARTITIONS[1:], [cell_type, clock]):
+        if value is not None:
+            condition = ds.field(key) == value
+            expression = condition if expression is None else expression & condition
+    return expression
+
+def read_predictions(store_folder, dataset, cell_type=None, clock=None, columns=None):
+    """
+    Read predictions of a dataset from the store. Partition filters are pushed down,
+    so only the matching partitions are opened.
+
+    Parameters:
+        store_folder (str): Root of the store.
+        dataset (str): Dataset to read.
+        cell_type, clock (str): Optional partition values to select.
+        columns (list): Optional columns to read.
+
+    Returns:
+        pd.DataFrame: Matching predictions, including the 'cell_type' and 'clock' columns.
+    """
+    table = open_store(store_folder, dataset).to_table(columns=columns, filter=partition_filter(cell_type, clock))
+    return table.to_pandas()
+
+def list_partitions(store_folder, dataset):
+    """
+    Returns:
+        list: (cell_type, clock) pairs stored for a dataset.
+    """
+    if not os.path.isdir(partition_path(store_folder, dataset)):
+        return []
+    partitions = set()
+    for fragment in open_store(store_folder, dataset).get_fragments():
+        keys = ds.get_partition_keys(fragment.partition_expression)
+        partitions.add((keys["cell_type"], keys["clock"]))
+    return sorted(partitions)
+
+def export_csv(store_folder, dataset, output_folder):
+    """Write one CSV per (cell_type, clock) partition of a dataset."""
+    os.makedirs(output_folder, exist_ok=True)
+    for cell_type, clock in list_partitions(store_folder, dataset):
+        df = read_predictions(store_folder, dataset, cell_type, clock).drop(columns=PARTITIONS[1:])
+        name = cell_type if clock == cell_type else f"{cell_type}_{clock}"
+        df.to_csv(os.path.join(output_folder, f"{name.replace(' ', '_')}.csv"), index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export predictions from the Parquet store to CSV")
+    parser.add_argument("--store_folder", type=str, default=STORE_FOLDER, help="Root of the prediction store")
+    parser.add_argument("--dataset", type=str, required=True, help="Dataset to export")
+    parser.add_argument("--output_folder", type=str, required=True, help="Folder to save the CSVs")
+
+    args = parser.parse_args()
+    export_csv(args.store_folder, args.dataset, args.output_folder)
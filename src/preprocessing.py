@@ -3,52 +3,256 @@ import pandas as pd
 import numpy as np
 import scipy.sparse as sp
 import os
+from collections import namedtuple
+from sharding import load_shard
+from norm_cache import cache_key, read_cache, write_cache
+from age_parsing import parse_ages
 
-def load_celltype_data(filepath, cell_type):
+PRECISIONS = {"float32": np.float32, "float64": np.float64}
+
+def normalize_counts(X, copy=True, dtype=np.float32):
     """
-    Load expression data for a specific cell type from a .h5ad file,
-    normalize it, and extract donor and age metadata.
+    Library-size normalize raw counts to 1e4 per cell and apply log1p.
+
+    The scaling and log1p are applied to the stored values only, so no
+    intermediate sparse matrices are allocated. Library sizes are summed in
+    float64 whatever the output dtype.
+
+    Parameters:
+        X (scipy.sparse matrix): Raw counts, cells x genes.
+        copy (bool): If False and X is already a CSR matrix of dtype, it is normalized in place.
+        dtype: Floating dtype of the result; float64 is the reference precision.
+
+    Returns:
+        scipy.sparse.csr_matrix: Log-normalized expression.
+    """
+    X = sp.csr_matrix(X, copy=copy)
+    if X.dtype != dtype:
+        X = X.astype(dtype)
+
+    row_sums = np.asarray(X.sum(axis=1, dtype=np.float64)).ravel()
+    row_sums[row_sums == 0] = 1e-12
+
+    X.data *= np.repeat(10000 / row_sums, np.diff(X.indptr)).astype(X.dtype)
+    np.log1p(X.data, out=X.data)
+    return X
+
+def read_rows(X, indices, block_rows=50000, min_density=0.05):
+    """
+    Read selected rows of a backed sparse matrix as CSR.
+
+    Fancy indexing a backed matrix issues two small HDF5 reads per row. When the selected
+    rows make up at least min_density of the span they cover, the span is instead read in
+    contiguous blocks of block_rows rows and the selected rows are taken from each block.
+
+    Parameters:
+        X: Backed matrix (adata.X of a file opened with backed="r").
+        indices (np.ndarray): Sorted row indices.
+
+    Returns:
+        scipy.sparse.csr_matrix: The selected rows, in order.
+    """
+    indices = np.asarray(indices)
+    if len(indices) == 0 or len(indices) < min_density * (indices[-1] - indices[0] + 1):
+        return sp.csr_matrix(X[indices])
+
+    parts = []
+    for start in range(indices[0], indices[-1] + 1, block_rows):
+        stop = min(start + block_rows, indices[-1] + 1)
+        lo, hi = np.searchsorted(indices, [start, stop])
+        if hi > lo:
+            parts.append(sp.csr_matrix(X[start:stop])[indices[lo:hi] - start])
+    return sp.vstack(parts, format="csr")
+
+def load_gene_subset(X, indices, columns, block_rows=50000, dtype=np.float32):
+    """
+    Read selected rows of a backed matrix and keep only selected genes, log-normalized
+    with library sizes computed over all genes while the rows are streamed.
+
+    Parameters:
+        X: Backed matrix (adata.X of a file opened with backed="r").
+        indices (np.ndarray): Sorted row indices.
+        columns (np.ndarray): Column positions of the genes to keep.
+        block_rows (int): Number of selected rows read at once.
+        dtype: Floating dtype of the result.
+
+    Returns:
+        np.ndarray: Dense array, rows x columns.
+    """
+    out = np.empty((len(indices), len(columns)), dtype=dtype)
+    for start in range(0, len(indices), block_rows):
+        block = read_rows(X, indices[start:start + block_rows])
+
+        row_sums = np.asarray(block.sum(axis=1, dtype=np.float64)).ravel()
+        row_sums[row_sums == 0] = 1e-12
+
+        sub = block[:, columns].toarray().astype(dtype)
+        sub *= (10000 / row_sums).astype(dtype)[:, None]
+        out[start:start + block.shape[0]] = np.log1p(sub)
+    return out
+
+# Approximate peak bytes per stored value while a chunk is read, normalized and scored:
+# the float32/int32 read, the float64 normalized and log copies and the clock gene gather.
+BYTES_PER_NNZ = 48
+
+def matrix_format(adata):
+    """Storage format of the X of a backed .h5ad file: 'csr', 'csc' or 'dense'."""
+    X = adata.file["X"]
+    if not hasattr(X, "keys"):
+        return "dense"
+    encoding = X.attrs.get("encoding-type", X.attrs.get("h5sparse_format", ""))
+    encoding = encoding.decode() if isinstance(encoding, bytes) else str(encoding)
+    return "csc" if encoding.startswith("csc") else "csr"
+
+def row_nnz(adata):
+    """
+    Number of stored values in every row of a backed .h5ad matrix. For CSR only indptr
+    is read. CSC offers no per-row counts without reading every index, so each row is
+    given the mean count (fixed-size chunks); dense rows store every gene.
+    """
+    X = adata.file["X"]
+    layout = matrix_format(adata)
+    if layout == "csr":
+        return np.diff(X["indptr"][:])
+    if layout == "csc":
+        return np.full(adata.n_obs, X["data"].shape[0] / max(adata.n_obs, 1))
+    return np.full(adata.n_obs, adata.n_vars)
+
+def stored_row_bytes(adata):
+    """
+    Bytes stored on disk for every row of a backed .h5ad matrix (values plus column
+    indices), estimated as in row_nnz for CSC.
+    """
+    X = adata.file["X"]
+    if matrix_format(adata) == "dense":
+        return np.full(adata.n_obs, adata.n_vars * X.dtype.itemsize)
+    return row_nnz(adata) * (X["data"].dtype.itemsize + X["indices"].dtype.itemsize)
+
+def iter_row_chunks(indices, row_bytes, chunk_size=None, memory_budget_mb=None):
+    """
+    Split row indices into chunks of at most chunk_size rows whose summed row_bytes
+    stay within memory_budget_mb. A single row larger than the budget forms its own chunk.
+
+    Parameters:
+        indices (np.ndarray): Sorted row indices to iterate over.
+        row_bytes (np.ndarray): Estimated bytes needed per row, same length as indices.
+        chunk_size (int): Maximum number of rows per chunk.
+        memory_budget_mb (float): Maximum estimated memory per chunk in megabytes.
+
+    Yields:
+        np.ndarray: Row indices of one chunk.
+    """
+    budget = np.inf if memory_budget_mb is None else memory_budget_mb * 1024 ** 2
+    max_rows = len(indices) if chunk_size is None else chunk_size
+
+    start = 0
+    cumulative = np.cumsum(row_bytes, dtype=np.float64)
+    while start < len(indices):
+        offset = cumulative[start - 1] if start > 0 else 0.0
+        stop = np.searchsorted(cumulative, offset + budget, side="right")
+        stop = min(max(stop, start + 1), start + max_rows, len(indices))
+        yield indices[start:stop]
+        start = stop
+
+class CellTypeData(namedtuple("CellTypeData", ["X", "var_names", "obs"])):
+    """
+    Normalized expression of one cell type: a CSR matrix (cells x genes), the gene
+    index of its columns and an obs frame with 'age', 'donor_id' and 'cell_id'.
+    """
+    __slots__ = ()
+
+    def to_frame(self):
+        """Legacy view: a pandas sparse DataFrame of genes with 'age', 'donor_id' and 'cell_id' columns."""
+        df = pd.DataFrame.sparse.from_spmatrix(
+            self.X,
+            index=self.obs.index,
+            columns=self.var_names
+        )
+
+        df["age"] = self.obs["age"]
+        df["donor_id"] = self.obs["donor_id"].values
+        df["cell_id"] = self.obs["cell_id"].values
+        return df
+
+def training_obs(sub_obs):
+    """The 'age', 'donor_id' and 'cell_id' columns used for training, from the obs of an AIDA cell type or its shard."""
+    obs = pd.DataFrame(index=sub_obs.index)
+    if "age" in sub_obs.columns:
+        obs["age"] = pd.to_numeric(sub_obs["age"]).astype(int).values
+    else:
+        obs["age"] = parse_ages("AIDA", sub_obs["development_stage"])["age"].astype(int).values
+    obs["donor_id"] = sub_obs["donor_id"].values
+    obs["cell_id"] = sub_obs.index
+    return obs
+
+def load_celltype(filepath, cell_type, shard_dir=None, cache_folder=None, cache_budget_mb=None, dtype=np.float64):
+    """
+    Load the normalized expression matrix of a specific cell type from a .h5ad file
+    together with its donor and age metadata, without building a DataFrame of genes.
 
     Parameters:
         filepath (str): Path to the .h5ad file.
         cell_type (str): Name of the cell type to extract.
+        shard_dir (str): Optional folder written by sharding.py. When given,
+            the cell type is read from its shard instead of the .h5ad file.
+        cache_folder (str): Optional normalization cache. On a hit the source is not opened.
+        cache_budget_mb (float): Disk budget of the normalization cache.
+        dtype: Floating dtype of the expression. Training uses the float64 default;
+            scoring may pass float32. Cache entries are kept per dtype.
 
     Returns:
-        pd.DataFrame: Normalized gene expression with 'age' and 'donor_id' columns.
+        CellTypeData: Log-normalized CSR expression, var names and obs metadata.
     """
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"File not found: {filepath}")
+    key = None
+    if cache_folder is not None:
+        key = cache_key(shard_dir or filepath, cell_type, dtype=dtype)
+        cached = read_cache(cache_folder, key)
+        if cached is not None:
+            print(f"Loaded {len(cached[2])} cells of type '{cell_type}' from normalization cache")
+            return CellTypeData(*cached)
 
-    adata = ad.read_h5ad(filepath, backed="r")
+    if shard_dir is not None:
+        sub_X, var_names, sub_obs = load_shard(shard_dir, cell_type)
+        print(f"Found {len(sub_obs)} cells of type '{cell_type}' in shard")
+    else:
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f"File not found: {filepath}")
 
-    selected = adata.obs["cell_type"] == cell_type
-    indices = np.where(selected)[0]
+        adata = ad.read_h5ad(filepath, backed="r")
 
-    if len(indices) == 0:
-        raise ValueError(f"No cells found for type: {cell_type}")
+        selected = adata.obs["cell_type"] == cell_type
+        indices = np.where(selected)[0]
 
-    print(f"Found {len(indices)} cells of type '{cell_type}'")
+        if len(indices) == 0:
+            raise ValueError(f"No cells found for type: {cell_type}")
 
-    sub_X = adata.X[indices]
-    sub_obs = adata.obs.iloc[indices]
+        print(f"Found {len(indices)} cells of type '{cell_type}'")
 
-    row_sums = np.array(sub_X.sum(axis=1)).flatten()
-    row_sums[row_sums == 0] = 1e-12
+        sub_X = read_rows(adata.X, indices)
+        sub_obs = adata.obs.iloc[indices]
+        var_names = adata.var_names
 
-    normalizer = sp.diags(1 / row_sums)
-    X_norm = normalizer @ sub_X
-    X_norm = X_norm.multiply(10000)
-    X_log = X_norm.copy()
-    X_log.data = np.log1p(X_log.data)
+    X_log = normalize_counts(sub_X, copy=False, dtype=dtype)
 
-    df = pd.DataFrame.sparse.from_spmatrix(
-        X_log,
-        index=sub_obs.index,
-        columns=adata.var_names
-    )
+    obs = training_obs(sub_obs)
+
+    if key is not None:
+        write_cache(cache_folder, key, X_log, var_names, obs, cache_budget_mb)
+
+    return CellTypeData(X_log, var_names, obs)
+
+def load_celltype_data(filepath, cell_type, shard_dir=None):
+    """
+    Load expression data for a specific cell type from a .h5ad file,
+    normalize it, and extract donor and age metadata.
 
-    df["age"] = sub_obs["development_stage"].str.split("-", expand=True)[0].astype(int)
-    df["donor_id"] = sub_obs["donor_id"].values
-    df["cell_id"] = sub_obs.index
+    Parameters:
+        filepath (str): Path to the .h5ad file.
+        cell_type (str): Name of the cell type to extract.
+        shard_dir (str): Optional folder written by sharding.py. When given,
+            the cell type is read from its shard instead of the .h5ad file.
 
-    return df
+    Returns:
+        pd.DataFrame: Normalized gene expression with 'age' and 'donor_id' columns.
+    """
+    return load_celltype(filepath, cell_type, shard_dir).to_frame()
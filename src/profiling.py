@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import time
+import cProfile
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+METRICS_ENV = "AGING_CLOCK_METRICS"
+TRACE_MEMORY_ENV = "AGING_CLOCK_TRACE_MEMORY"
+CPROFILE_ENV = "AGING_CLOCK_CPROFILE"
+
+# Peak traced bytes seen by every open profile block. tracemalloc has a single peak per
+# process, so before a block resets it the peak so far is folded into all open blocks:
+# a nested block or a block in another thread never hides an outer block's peak.
+_open_peaks = []
+_peaks_lock = threading.Lock()
+
+def enable(metrics_path, trace_memory=False, cprofile_dir=None):
+    """
+    Turn on instrumentation for this process and the worker processes it starts.
+
+    The settings are kept in environment variables, so forked and spawned workers
+    append to the same JSONL file. Without enable(), profile() only yields a counter dict.
+
+    Parameters:
+        metrics_path (str): JSONL file the stage records are appended to.
+        trace_memory (bool): Also record the peak traced Python allocation per stage (slower).
+        cprofile_dir (str): Optional folder for cProfile .prof dumps of the outer stages.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(metrics_path)), exist_ok=True)
+    os.environ[METRICS_ENV] = os.path.abspath(metrics_path)
+    os.environ[TRACE_MEMORY_ENV] = "1" if trace_memory else ""
+    if cprofile_dir is not None:
+        os.makedirs(cprofile_dir, exist_ok=True)
+        os.environ[CPROFILE_ENV] = os.path.abspath(cprofile_dir)
+
+def disable():
+    """Turn instrumentation off again for this process and workers started afterwards."""
+    for name in [METRICS_ENV, TRACE_MEMORY_ENV, CPROFILE_ENV]:
+        os.environ.pop(name, None)
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError):
+        return None
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def start_peak():
+    """Open a peak allocation record for a block and restart the tracemalloc peak."""
+    with _peaks_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        peak = tracemalloc.get_traced_memory()[1]
+        for record in _open_peaks:
+            record[0] = max(record[0], peak)
+        tracemalloc.reset_peak()
+        record = [0]
+        _open_peaks.append(record)
+        return record
+
+def stop_peak(record):
+    """Close a record from start_peak and return the peak traced bytes during its block."""
+    with _peaks_lock:
+        _open_peaks.remove(record)
+        return max(record[0], tracemalloc.get_traced_memory()[1])
+
+def profile_filename(stage, labels):
+    name = "-".join([stage, *[str(value) for value in labels.values()]])
+    return f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)}-{os.getpid()}.prof"
+
+@contextmanager
+def profile(stage, cprofile=False, **labels):
+    """
+    Time a pipeline stage and append one JSON record to the metrics file.
+
+    The record holds the stage name, its labels (e.g. dataset, cell_type, clock), wall
+    and CPU seconds, current and peak RSS, the peak traced allocation when memory
+    tracing is on (nested blocks included; blocks running concurrently in other threads
+    share the process-wide peak), and the counters added to the yielded dict (e.g. cells, bytes_read).
+    With cprofile=True and a cProfile folder configured, the block also runs under
+    cProfile and its stats are dumped to a .prof file for pstats or snakeviz.
+
+    Example:
+        with profile("load", dataset="Liu", cell_type=cell_type) as counters:
+            X = ...
+            counters["cells"] = X.shape[0]
+    """
+    counters = {}
+    metrics_path = os.environ.get(METRICS_ENV)
+    if not metrics_path:
+        yield counters
+        return
+
+    trace_memory = bool(os.environ.get(TRACE_MEMORY_ENV))
+    peak = start_peak() if trace_memory else None
+
+    cprofile_dir = os.environ.get(CPROFILE_ENV) if cprofile else None
+    profiler = cProfile.Profile() if cprofile_dir else None
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    status = "ok"
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield counters
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(cprofile_dir, profile_filename(stage, labels)))
+
+        seconds = time.perf_counter() - start_wall
+        record = {
+            "stage": stage,
+            **labels,
+            "status": status,
+            "seconds": seconds,
+            "cpu_seconds": time.process_time() - start_cpu,
+            "rss_mb": current_rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+            **counters,
+            "pid": os.getpid(),
+            "time": time.time(),
+        }
+        if trace_memory:
+            record["alloc_peak_mb"] = stop_peak(peak) / 1024 ** 2
+        if "cells" in counters and seconds > 0:
+            record["cells_per_sec"] = counters["cells"] / seconds
+
+        with open(metrics_path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+def read_metrics(metrics_path):
+    """Load a JSONL metrics file as a DataFrame with one row per stage record."""
+    with open(metrics_path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+def summarize_metrics(metrics_path, by=("stage",)):
+    """
+    Aggregate stage records: number of calls, total and mean seconds, share of the time
+    spent in the stage, cells per second, megabytes read and the largest peak RSS.
+
+    Returns:
+        pd.DataFrame: One row per group of by, sorted by total seconds.
+    """
+    df = read_metrics(metrics_path)
+    by = list(by)
+    for column in ["cells", "bytes_read", *by]:
+        if column not in df.columns:
+            df[column] = 0.0 if column in ("cells", "bytes_read") else None
+
+    summary = df.groupby(by, dropna=False).agg(
+        calls=("seconds", "size"),
+        seconds=("seconds", "sum"),
+        mean_seconds=("seconds", "mean"),
+        cells=("cells", "sum"),
+        mb_read=("bytes_read", lambda b: b.sum() / 1024 ** 2),
+        peak_rss_mb=("peak_rss_mb", "max"),
+    ).sort_values("seconds", ascending=False)
+    # Stages nest (a cell type contains its load, score and write records), so shares are
+    # taken within a stage rather than over the whole file.
+    stage_seconds = summary.groupby(level="stage")["seconds"].transform("sum") if "stage" in by else summary["seconds"].sum()
+    summary["share"] = summary["seconds"] / stage_seconds
+    summary["cells_per_sec"] = summary["cells"] / summary["seconds"].where(summary["seconds"] > 0)
+    return summary.reset_index()
+
+def print_summary(metrics_path, by=("stage",)):
+    if not os.path.exists(metrics_path):
+        return
+    print(f"\nStage timings ({metrics_path}):")
+    print(summarize_metrics(metrics_path, by).to_string(index=False, float_format=lambda v: f"{v:.2f}"))
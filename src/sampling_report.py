@@ -0,0 +1,84 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from preprocessing import load_celltype
+from train_model import train_matrix_by_fold, donor_folds
+from subsampling import make_sampler
+from metrics import grouped_metrics
+
+def sampling_settings(caps=(), fractions=()):
+    """The settings compared by sampling_report: all cells, then every donor cap and coreset fraction."""
+    settings = [("all", None)]
+    settings += [(f"donor_cap_{cap}", {"strategy": "donor_cap", "max_cells_per_donor": cap}) for cap in caps]
+    settings += [(f"coreset_{fraction:g}", {"strategy": "coreset", "fraction": fraction}) for fraction in fractions]
+    return settings
+
+def sampling_report(data, settings, n_folds=5, alphas=(1.0,), l1_ratios=(0.5,), n_jobs=1):
+    """
+    Train the fold models of one cell type under every subsampling setting and compare
+    fit time and held-out accuracy with training on all cells. Held-out predictions always
+    cover every cell, so MAE and Pearson are computed on the same cells for all settings.
+
+    Parameters:
+        data (CellTypeData): Normalized expression of one cell type.
+        settings (list): (label, make_sampler options or None) pairs, e.g. from sampling_settings.
+
+    Returns:
+        pd.DataFrame: One row per setting with the mean training cells per fold, the fit
+            seconds (sampler included), the speedup and the held-out MAE and Pearson, with
+            their change from the 'all' setting.
+    """
+    folds = list(donor_folds(data.obs["donor_id"].values, n_folds))
+    rows = []
+    for label, options in settings:
+        start = time.perf_counter()
+        sampler = None if options is None else make_sampler(data, **options)
+        _, preds, _ = train_matrix_by_fold(data, n_folds, alphas, l1_ratios, n_jobs, sampler)
+        seconds = time.perf_counter() - start
+
+        train_cells = [len(train_rows) if sampler is None else len(sampler(train_rows)) for train_rows, _ in folds]
+        metrics = grouped_metrics(preds["true_age"], preds["predicted_age"], np.zeros(len(preds))).iloc[0]
+        rows.append({"setting": label, "train_cells": float(np.mean(train_cells)), "seconds": seconds,
+                     "MAE": metrics["MAE"], "Pearson": metrics["Pearson"]})
+        print(f"  {label:<16} {rows[-1]['train_cells']:10.0f} cells {seconds:8.2f} s  MAE {metrics['MAE']:.2f}")
+
+    report = pd.DataFrame(rows)
+    full = report.iloc[0]
+    report["speedup"] = full["seconds"] / report["seconds"]
+    report["delta_MAE"] = report["MAE"] - full["MAE"]
+    report["delta_Pearson"] = report["Pearson"] - full["Pearson"]
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare training time and accuracy of cell subsampling strategies")
+    parser.add_argument("--data_path", type=str, default="../data/AIDA.h5ad", help="Path to the input .h5ad file")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Folder with per-cell-type shards written by sharding.py")
+    parser.add_argument("--imputation_folder", type=str, default="../data_for_imputation/", help="Folder containing imputation files")
+    parser.add_argument("--cell_types", nargs="+", default=None, help="Cell types to compare (default: all with an imputation file)")
+    parser.add_argument("--caps", type=int, nargs="*", default=[50, 200], help="Cells per donor of the donor_cap settings")
+    parser.add_argument("--fractions", type=float, nargs="*", default=[0.1, 0.25], help="Fractions of the coreset settings")
+    parser.add_argument("--alphas", type=float, nargs="+", default=[1.0], help="ElasticNet alphas to search")
+    parser.add_argument("--l1_ratios", type=float, nargs="+", default=[0.5], help="ElasticNet l1_ratios to search")
+    parser.add_argument("--fold_jobs", type=int, default=1, help="Number of folds fitted in parallel")
+    parser.add_argument("--output_path", type=str, default="../results/subsampling_report.csv", help="CSV file for the report")
+
+    args = parser.parse_args()
+
+    cell_types = args.cell_types or [f.replace("Impute_avg_", "").replace(".csv", "")
+                                     for f in os.listdir(args.imputation_folder) if f.endswith(".csv")]
+    settings = sampling_settings(args.caps, args.fractions)
+
+    reports = []
+    for cell_type in cell_types:
+        print(f"Processing: {cell_type}")
+        data = load_celltype(args.data_path, cell_type, args.shard_dir)
+        report = sampling_report(data, settings, alphas=args.alphas, l1_ratios=args.l1_ratios, n_jobs=args.fold_jobs)
+        report.insert(0, "cell_type", cell_type)
+        reports.append(report)
+
+    report = pd.concat(reports, ignore_index=True)
+    os.makedirs(os.path.dirname(args.output_path) or ".", exist_ok=True)
+    report.to_csv(args.output_path, index=False)
+    print(report.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
@@ -0,0 +1,152 @@
+import multiprocessing
+from collections import namedtuple, Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import anndata as ad
+from preprocessing import row_nnz, BYTES_PER_NNZ
+
+WorkUnit = namedtuple("WorkUnit", ["dataset", "cell_type", "clocks", "memory_mb"])
+
+# Worker processes are spawned, not forked: pools are started from pipeline stages running
+# in threads, and a fork copies whatever locks the other threads hold. Spawned workers get
+# nothing but the environment (profiling settings) and what they are passed explicitly.
+WORKER_CONTEXT = multiprocessing.get_context("spawn")
+
+class UnitsFailed(RuntimeError):
+    """Work units that still failed after all retries, mapped to their last exception in failures."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        names = ", ".join(f"{unit.dataset} / {unit.cell_type}" for unit in failures)
+        super().__init__(f"{len(failures)} work units failed: {names}")
+
+def check_failures(failures):
+    """Raise UnitsFailed when run_units returned failures."""
+    if failures:
+        raise UnitsFailed(failures)
+
+def celltype_memory_mb(filepath, healthy_only=False):
+    """
+    Estimate the memory needed to process each cell type of a .h5ad file from its
+    cell counts in obs and the stored values per row. The matrix itself is not read.
+
+    Returns:
+        dict: Estimated megabytes per cell type, only for cell types with at least one cell.
+    """
+    adata = ad.read_h5ad(filepath, backed="r")
+    obs = adata.obs
+
+    keep = np.ones(adata.n_obs, dtype=bool)
+    if healthy_only and "disease" in obs.columns:
+        keep &= (obs["disease"] == "normal").values
+
+    row_mb = row_nnz(adata) * BYTES_PER_NNZ / 1024 ** 2
+    cell_types = obs["cell_type"].astype(str).values
+    sizes = {}
+    for cell_type in np.unique(cell_types[keep]):
+        sizes[cell_type] = float(row_mb[keep & (cell_types == cell_type)].sum())
+    return sizes
+
+def run_units(func, units, workers=1, memory_budget_mb=None, retries=1, initializer=None, initargs=()):
+    """
+    Run func(unit) for every work unit, in a pool of worker processes when workers > 1.
+
+    Units are admitted largest first while the summed memory_mb of the running units
+    stays within memory_budget_mb; a unit that does not fit waits until others finish,
+    unless nothing else is running. Failed units are retried up to retries times.
+
+    A worker that dies (e.g. killed for memory) breaks the whole pool and fails every
+    running unit with BrokenProcessPool. A unit that was running alone is charged a
+    retry; units that broke together are resubmitted without one and then run alone,
+    so that the unit that breaks the pool again is identified.
+
+    Parameters:
+        func (callable): Top-level function taking a WorkUnit.
+        units (list): WorkUnits to run.
+        workers (int): Number of worker processes.
+        memory_budget_mb (float): Maximum summed memory_mb of concurrently running units.
+        retries (int): Number of times a failed unit is resubmitted.
+        initializer (callable): Optional function called with initargs in every worker
+            process before it runs units, e.g. to pass module settings.
+
+    Returns:
+        dict: The units that still failed after all retries, mapped to their last exception.
+    """
+    attempts = Counter()
+    failures = {}
+    suspects = set()
+
+    def record_failure(unit, error):
+        attempts[unit] += 1
+        if attempts[unit] <= retries:
+            print(f"Retrying {unit.dataset} / {unit.cell_type} after error: {error}")
+            return True
+        print(f"Failed for {unit.dataset} / {unit.cell_type}: {error}")
+        failures[unit] = error
+        return False
+
+    if workers <= 1:
+        for unit in units:
+            while True:
+                try:
+                    func(unit)
+                    break
+                except Exception as e:
+                    if not record_failure(unit, e):
+                        break
+        return failures
+
+    pending = sorted(units, key=lambda u: u.memory_mb, reverse=True)
+    running = {}
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT,
+                                   initializer=initializer, initargs=initargs)
+
+    executor = new_pool()
+    try:
+        while pending or running:
+            used = sum(u.memory_mb for u in running.values())
+            for unit in list(pending):
+                if len(running) >= workers:
+                    break
+                if running and (unit in suspects or suspects.intersection(running.values())):
+                    continue
+                if running and memory_budget_mb is not None and used + unit.memory_mb > memory_budget_mb:
+                    continue
+                pending.remove(unit)
+                running[executor.submit(func, unit)] = unit
+                used += unit.memory_mb
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = {}
+            for future in done:
+                unit = running.pop(future)
+                try:
+                    future.result()
+                    print(f"Finished {unit.dataset} / {unit.cell_type}")
+                except BrokenProcessPool as e:
+                    broken[unit] = e
+                except Exception as e:
+                    if record_failure(unit, e):
+                        pending.append(unit)
+
+            if broken:
+                # Every unit still running was lost with the pool.
+                broken.update({unit: BrokenProcessPool("lost with the process pool") for unit in running.values()})
+                running.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = new_pool()
+                if len(broken) == 1:
+                    unit, error = broken.popitem()
+                    if record_failure(unit, error):
+                        pending.append(unit)
+                else:
+                    print(f"Process pool broke while running {len(broken)} units, running them alone")
+                    suspects.update(broken)
+                    pending.extend(broken)
+            pending.sort(key=lambda u: u.memory_mb, reverse=True)
+    finally:
+        executor.shutdown()
+
+    return failures
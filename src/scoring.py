@@ -0,0 +1,133 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from gene_alignment import build_alignment
+
+ClockWeights = namedtuple("ClockWeights", ["genes", "weights", "intercepts", "impute"])
+# Several clocks aligned onto the same columns, with their weights side by side: columns
+# are the union of the clock columns, weights is columns x (folds of all clocks), intercepts
+# and offsets (missing_offset) are per fold, and folds holds the slice of every clock's folds.
+ClockBlock = namedtuple("ClockBlock", ["columns", "weights", "intercepts", "offsets", "folds"])
+
+def stack_models(model_df, impute_df=None):
+    """
+    Stack the fold models of a clock into a single genes x folds weight matrix.
+
+    Parameters:
+        model_df (pd.DataFrame): One row per fold model, gene coefficients plus an 'intercept' column.
+        impute_df (pd.DataFrame): Imputation values, one column per gene (first row is used).
+
+    Returns:
+        ClockWeights: Genes with a nonzero weight in any fold, their weights (genes x folds),
+            the fold intercepts and the imputation value of every gene (0.0 if unknown).
+    """
+    intercepts = model_df["intercept"].to_numpy(dtype=np.float64)
+    coeffs = model_df.drop(columns="intercept").apply(pd.to_numeric, errors="coerce").fillna(0.0)
+    coeffs = coeffs.loc[:, (coeffs != 0).any(axis=0)]
+
+    genes = coeffs.columns
+    weights = coeffs.to_numpy(dtype=np.float64).T
+
+    impute = np.zeros(len(genes))
+    if impute_df is not None:
+        values = pd.to_numeric(impute_df.iloc[0], errors="coerce").reindex(genes)
+        impute = values.fillna(0.0).to_numpy(dtype=np.float64)
+
+    return ClockWeights(genes, weights, intercepts, impute)
+
+def missing_offset(clock, alignment):
+    """Contribution of the missing clock genes to every fold: imputation values times weights, summed."""
+    return clock.impute[alignment.missing] @ clock.weights[alignment.missing]
+
+def score_matrix(X, var_names, clock, alignment=None, offsets=None):
+    """
+    Score log-normalized expression with all fold models of a clock in one sparse product.
+
+    Genes of the clock that are missing from var_names contribute a constant
+    bias (imputation value times weight), so the cells x genes matrix is never densified.
+    Other imputation strategies pass their contribution of the missing genes as offsets.
+    The product runs in the floating dtype of X (float32 halves the memory traffic);
+    intercepts and the imputation bias are added in float64.
+
+    Parameters:
+        X (scipy.sparse.csr_matrix or np.ndarray): Log-normalized expression, cells x genes.
+        var_names (pd.Index): Gene names of the columns of X.
+        clock (ClockWeights): Stacked clock from stack_models.
+        alignment (GeneAlignment): Precomputed alignment of the clock genes onto var_names.
+        offsets (np.ndarray): Contribution of the missing genes, per fold (folds,) or per
+            cell (cells x folds), e.g. from imputation.impute_offsets. Defaults to missing_offset.
+
+    Returns:
+        tuple: (np.ndarray of per-fold predictions, cells x folds; np.ndarray of the ensemble mean)
+    """
+    if alignment is None:
+        alignment = build_alignment(var_names, clock.genes)
+
+    if offsets is None:
+        offsets = missing_offset(clock, alignment)
+    bias = clock.intercepts + offsets
+    print(f"    Using {len(alignment.present)} present genes, imputing {len(alignment.missing)}")
+
+    X_sub = X[:, alignment.columns]
+    dtype = X.dtype if np.issubdtype(X.dtype, np.floating) else np.float64
+    weights = clock.weights[alignment.present].astype(dtype, copy=False)
+    fold_preds = np.asarray(X_sub @ weights, dtype=np.float64) + bias
+
+    return fold_preds, fold_preds.mean(axis=1)
+
+def stack_clocks(clocks, alignments):
+    """
+    Concatenate the weight matrices of several clocks column-wise over the union of
+    their dataset columns, so that score_clocks scores all of them in one product.
+
+    Parameters:
+        clocks (dict): {clock name: ClockWeights}.
+        alignments (dict): {clock name: GeneAlignment} onto the columns of the matrix to score.
+
+    Returns:
+        ClockBlock: The stacked clocks.
+    """
+    columns = np.unique(np.concatenate([alignments[name].columns for name in clocks]))
+    n_folds = [len(clock.intercepts) for clock in clocks.values()]
+    starts = np.concatenate([[0], np.cumsum(n_folds)])
+
+    weights = np.zeros((len(columns), starts[-1]))
+    intercepts, offsets = np.empty(starts[-1]), np.empty(starts[-1])
+    folds = {}
+    for (name, clock), start, stop in zip(clocks.items(), starts[:-1], starts[1:]):
+        alignment = alignments[name]
+        rows = np.searchsorted(columns, alignment.columns)
+        np.add.at(weights[:, start:stop], rows, clock.weights[alignment.present])
+        intercepts[start:stop] = clock.intercepts
+        offsets[start:stop] = missing_offset(clock, alignment)
+        folds[name] = slice(start, stop)
+
+    return ClockBlock(columns, weights, intercepts, offsets, folds)
+
+def score_clocks(X, block, offsets=None):
+    """
+    Score log-normalized expression with every clock of a block in one sparse product.
+
+    Parameters:
+        X (scipy.sparse.csr_matrix or np.ndarray): Log-normalized expression, cells x genes.
+        block (ClockBlock): Clocks from stack_clocks, aligned onto the columns of X.
+        offsets (dict): {clock name: contribution of its missing genes}, replacing the
+            imputation-file offset of those clocks, per fold or per cell x fold.
+
+    Returns:
+        dict: {clock name: (np.ndarray of per-fold predictions, cells x folds; np.ndarray of the ensemble mean)}
+    """
+    if offsets is None:
+        offsets = {}
+    print(f"    Scoring {len(block.folds)} clocks on {len(block.columns)} genes")
+
+    dtype = X.dtype if np.issubdtype(X.dtype, np.floating) else np.float64
+    fold_preds = np.asarray(X[:, block.columns] @ block.weights.astype(dtype, copy=False), dtype=np.float64)
+    fold_preds += block.intercepts
+
+    scores = {}
+    for name, folds in block.folds.items():
+        preds = fold_preds[:, folds]
+        preds += offsets.get(name, block.offsets[folds])
+        scores[name] = (preds, preds.mean(axis=1))
+    return scores
@@ -0,0 +1,397 @@
+import io
+import os
+import json
+import time
+import socket
+import asyncio
+import zipfile
+import argparse
+import http.client
+from urllib.parse import urlsplit, parse_qs, urlencode
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import anndata as ad
+from preprocessing import normalize_counts
+from scoring import score_matrix
+from clock_artifacts import get_clock, ARTIFACT_SUFFIX
+from gene_alignment import get_alignment, vocabulary_hash
+from aggregation import donor_summary
+
+OBS_COLUMNS = ["cell_id", "donor_id", "cell_type", "age"]
+MAX_BODY_MB = 512
+
+class BadRequest(ValueError):
+    """A request the server cannot parse or will not read; answered with status and the connection closed."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class ClockRegistry:
+    """
+    Clocks and gene alignments held in memory for the lifetime of the server.
+
+    All clocks found in compiled_folder or model_folder are loaded at start-up. Alignments
+    are kept per (vocabulary hash, clock), so a sample with the gene order of an earlier
+    sample (or of the reference dataset, aligned at start-up) is scored without any lookup.
+    """
+
+    def __init__(self, model_folder, imputation_folder, compiled_folder=None, alignment_folder=None, reference_var_names=None):
+        names = set()
+        if compiled_folder is not None and os.path.isdir(compiled_folder):
+            names.update(f[:-len(ARTIFACT_SUFFIX)] for f in os.listdir(compiled_folder) if f.endswith(ARTIFACT_SUFFIX))
+        if os.path.isdir(model_folder):
+            names.update(f.replace("_models5.csv", "") for f in os.listdir(model_folder) if f.endswith("_models5.csv"))
+
+        self.clocks = {}
+        for name in sorted(names):
+            clock = get_clock(name, model_folder, imputation_folder, compiled_folder)
+            if clock is not None:
+                self.clocks[name] = clock
+        self.alignment_folder = alignment_folder
+        self.alignments = {}
+
+        if reference_var_names is not None:
+            for name in self.clocks:
+                self.alignment(reference_var_names, vocabulary_hash(reference_var_names), name)
+
+    def alignment(self, var_names, vocab_hash, clock):
+        key = (vocab_hash, clock)
+        if key not in self.alignments:
+            self.alignments[key] = get_alignment(var_names, self.clocks[clock].genes, self.alignment_folder)
+        return self.alignments[key]
+
+def decode_sample(body, content_type):
+    """
+    Read a submitted sample: an .h5ad file, or an .npz archive written by encode_sample.
+    Raises BadRequest for a body that cannot be read as either.
+
+    Returns:
+        tuple: (scipy.sparse.csr_matrix of raw counts, pd.Index of var names, pd.DataFrame of obs).
+    """
+    try:
+        return read_sample(body, content_type)
+    except (OSError, ValueError, KeyError, TypeError, zipfile.BadZipFile) as e:
+        raise BadRequest(f"Could not read the sample: {e}")
+
+def read_sample(body, content_type):
+    if "hdf5" in content_type or "h5ad" in content_type:
+        adata = ad.read_h5ad(io.BytesIO(body))
+        X, var_names = sp.csr_matrix(adata.X), adata.var_names
+        obs = pd.DataFrame({column: adata.obs[column].astype(str).values if column != "age" else adata.obs[column].values
+                            for column in OBS_COLUMNS if column in adata.obs.columns})
+        if "cell_id" not in obs.columns:
+            obs["cell_id"] = adata.obs_names.values
+    else:
+        with np.load(io.BytesIO(body), allow_pickle=False) as archive:
+            X = sp.csr_matrix((archive["data"], archive["indices"], archive["indptr"]), shape=tuple(archive["shape"]))
+            var_names = pd.Index(archive["var_names"])
+            obs = pd.DataFrame({column: archive[column] for column in OBS_COLUMNS if column in archive.files})
+
+    if "cell_id" not in obs.columns:
+        obs["cell_id"] = np.arange(X.shape[0]).astype(str)
+    if "donor_id" not in obs.columns:
+        obs["donor_id"] = "sample"
+    if "age" not in obs.columns:
+        obs["age"] = np.nan
+    return X, var_names, obs
+
+def encode_sample(X, var_names, obs=None):
+    """
+    Pack a raw count matrix (cells x genes) and optional obs columns ('cell_id', 'donor_id',
+    'cell_type', 'age') into the .npz body accepted by the server.
+    """
+    X = sp.csr_matrix(X)
+    arrays = {"data": X.data, "indices": X.indices, "indptr": X.indptr, "shape": np.array(X.shape),
+              "var_names": np.asarray(var_names, dtype=str)}
+    if obs is not None:
+        for column in OBS_COLUMNS:
+            if column in obs.columns:
+                values = obs[column].values
+                arrays[column] = values.astype(float) if column == "age" else np.asarray(values, dtype=str)
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+class Job:
+    """One submitted sample, normalized and waiting for its batch to be scored."""
+
+    def __init__(self, X, var_names, obs, clocks, donors):
+        self.X, self.var_names, self.obs = X, var_names, obs
+        self.clocks, self.donors = clocks, donors
+        self.vocab_hash = vocabulary_hash(var_names)
+        self.future = asyncio.get_running_loop().create_future()
+
+def clock_rows(obs, clock, clocks):
+    """
+    Rows of a sample scored by a clock. With a cell_type column, the cells of that cell type;
+    without one, all cells when the clock was asked for in clocks and none otherwise.
+    Clocks not in a non-empty clocks score no rows.
+    """
+    if clocks and clock not in clocks:
+        return np.zeros(len(obs), dtype=bool)
+    if "cell_type" in obs.columns:
+        return (obs["cell_type"] == clock).values
+    return np.full(len(obs), bool(clocks))
+
+def score_batch(registry, jobs):
+    """
+    Score a micro-batch. Samples with the same gene order are stacked, and every clock
+    scores the matching rows of the whole stack in one sparse product.
+
+    Returns:
+        list: One response dict per job, in order.
+    """
+    cells = [[] for _ in jobs]
+    groups = {}
+    for i, job in enumerate(jobs):
+        groups.setdefault(job.vocab_hash, []).append(i)
+
+    for vocab_hash, members in groups.items():
+        X = sp.vstack([jobs[i].X for i in members], format="csr")
+        offsets = np.cumsum([0] + [jobs[i].X.shape[0] for i in members])
+        var_names = jobs[members[0]].var_names
+
+        for clock_name, clock in registry.clocks.items():
+            rows = np.concatenate([clock_rows(jobs[i].obs, clock_name, jobs[i].clocks) for i in members])
+            if not rows.any():
+                continue
+            selected = np.where(rows)[0]
+            _, preds = score_matrix(X[selected], var_names, clock, registry.alignment(var_names, vocab_hash, clock_name))
+
+            owner = np.searchsorted(offsets, selected, side="right") - 1
+            for position, i in enumerate(members):
+                mine = owner == position
+                if mine.any():
+                    result = jobs[i].obs.iloc[selected[mine] - offsets[position]].copy()
+                    result["clock"] = clock_name
+                    result["predicted_age"] = preds[mine]
+                    cells[i].append(result)
+
+    responses = []
+    for job, parts in zip(jobs, cells):
+        result = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=[*job.obs.columns, "clock", "predicted_age"])
+        response = {"cells": json.loads(result.to_json(orient="records"))}
+        if job.donors:
+            donors = [donor_summary(df).assign(clock=clock) for clock, df in result.groupby("clock")]
+            donors = pd.concat(donors, ignore_index=True) if donors else pd.DataFrame()
+            response["donors"] = json.loads(donors.to_json(orient="records"))
+        responses.append(response)
+    return responses
+
+class MicroBatcher:
+    """
+    Collects jobs that arrive within window_ms of the first one (up to max_cells cells)
+    and scores them together in a worker thread, so the event loop keeps accepting requests.
+    """
+
+    def __init__(self, registry, window_ms=5.0, max_cells=200000):
+        self.registry = registry
+        self.window = window_ms / 1000
+        self.max_cells = max_cells
+        self.queue = asyncio.Queue()
+
+    async def submit(self, job):
+        await self.queue.put(job)
+        return await job.future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            n_cells = batch[0].X.shape[0]
+            deadline = loop.time() + self.window
+            while n_cells < self.max_cells:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    job = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(job)
+                n_cells += job.X.shape[0]
+
+            try:
+                responses = await loop.run_in_executor(None, score_batch, self.registry, batch)
+                for job, response in zip(batch, responses):
+                    job.future.set_result(response)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+
+def prepare_job(body, content_type, clocks, donors):
+    X, var_names, obs = decode_sample(body, content_type)
+    return X, var_names, obs, normalize_counts(X), clocks, donors
+
+async def read_request(reader, max_body_bytes=MAX_BODY_MB * 1024 ** 2):
+    """
+    Read one HTTP request. Raises BadRequest for a malformed request line or Content-Length,
+    and for a body above max_body_bytes, which is then left unread.
+    """
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    if not request_line:
+        return None
+    parts = request_line.split(" ")
+    if len(parts) != 3:
+        raise BadRequest(f"Malformed request line: {request_line[:100]!r}")
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise BadRequest(f"Invalid Content-Length: {headers['content-length'][:100]!r}")
+    if length < 0:
+        raise BadRequest(f"Invalid Content-Length: {length}")
+    if length > max_body_bytes:
+        raise BadRequest(f"Body of {length} bytes exceeds the limit of {max_body_bytes} bytes", 413)
+    body = await reader.readexactly(length)
+    return method, target, headers, body
+
+def write_response(writer, status, payload):
+    body = json.dumps(payload).encode()
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}[status]
+    writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+
+async def handle(reader, writer, registry, batcher, max_body_bytes=MAX_BODY_MB * 1024 ** 2):
+    """Serve the requests of one keep-alive connection."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                request = await read_request(reader, max_body_bytes)
+            except BadRequest as e:
+                print(f"Rejected request ({e.status}): {e}")
+                write_response(writer, e.status, {"error": str(e)})
+                await writer.drain()
+                break
+            if request is None:
+                break
+            method, target, headers, body = request
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+
+            if method == "GET" and url.path == "/health":
+                write_response(writer, 200, {"status": "ok", "clocks": len(registry.clocks)})
+            elif method == "GET" and url.path == "/clocks":
+                write_response(writer, 200, {"clocks": list(registry.clocks)})
+            elif method == "POST" and url.path == "/predict":
+                start = time.perf_counter()
+                clocks = [c for value in query.get("clocks", []) for c in value.split(",") if c]
+                unknown = [c for c in clocks if c not in registry.clocks]
+                if unknown:
+                    write_response(writer, 400, {"error": f"Unknown clocks: {', '.join(unknown)}"})
+                else:
+                    try:
+                        X, var_names, obs, X_log, clocks, donors = await loop.run_in_executor(
+                            None, prepare_job, body, headers.get("content-type", ""), clocks,
+                            query.get("donors", ["1"])[0] != "0")
+                        if not clocks and "cell_type" not in obs.columns:
+                            write_response(writer, 400, {"error": "Give clocks in the query or a cell_type column in the sample"})
+                        else:
+                            response = await batcher.submit(Job(X_log, var_names, obs, clocks, donors))
+                            response["milliseconds"] = (time.perf_counter() - start) * 1000
+                            write_response(writer, 200, response)
+                    except BadRequest as e:
+                        write_response(writer, e.status, {"error": str(e)})
+                    except Exception as e:
+                        write_response(writer, 500, {"error": str(e)})
+            else:
+                write_response(writer, 404, {"error": f"No route for {method} {url.path}"})
+            await writer.drain()
+
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(registry, host="127.0.0.1", port=8765, socket_path=None, window_ms=5.0, max_cells=200000, max_body_mb=MAX_BODY_MB):
+    """
+    Run the scoring server until cancelled, on a TCP port or, when socket_path is given, a Unix socket.
+
+    Routes:
+        GET /health, GET /clocks
+        POST /predict?clocks=a,b&donors=1 with an .h5ad body (Content-Type application/x-hdf5)
+            or an encode_sample .npz body; returns per-cell and per-donor predictions as JSON.
+            Without clocks the sample needs a cell_type column. Bodies above max_body_mb
+            are refused with 413.
+    """
+    batcher = MicroBatcher(registry, window_ms, max_cells)
+    batch_task = asyncio.create_task(batcher.run())
+    max_body_bytes = int(max_body_mb * 1024 ** 2)
+    callback = lambda reader, writer: handle(reader, writer, registry, batcher, max_body_bytes)
+
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(callback, path=socket_path)
+        print(f"Serving {len(registry.clocks)} clocks on {socket_path}")
+    else:
+        server = await asyncio.start_server(callback, host, port)
+        print(f"Serving {len(registry.clocks)} clocks on http://{host}:{port}")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def predict(X, var_names, obs=None, clocks=None, donors=True, host="127.0.0.1", port=8765, socket_path=None):
+    """
+    Client helper: send a raw count matrix to a running server.
+
+    Returns:
+        tuple: (pd.DataFrame of per-cell predictions, pd.DataFrame of per-donor predictions).
+    """
+    connection = UnixHTTPConnection(socket_path) if socket_path else http.client.HTTPConnection(host, port, timeout=60)
+    query = {"donors": int(donors), **({"clocks": ",".join(clocks)} if clocks else {})}
+    target = f"/predict?{urlencode(query)}"
+    connection.request("POST", target, body=encode_sample(X, var_names, obs),
+                       headers={"Content-Type": "application/x-npz"})
+    response = json.loads(connection.getresponse().read())
+    connection.close()
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return pd.DataFrame(response["cells"]), pd.DataFrame(response.get("donors", []))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve age predictions for small samples from preloaded clocks")
+    parser.add_argument("--model_folder", type=str, default="../models/", help="Folder containing trained models")
+    parser.add_argument("--imputation_folder", type=str, default="../data_for_imputation/", help="Folder containing imputation files")
+    parser.add_argument("--compiled_folder", type=str, default="../compiled_clocks/", help="Folder containing compiled clocks")
+    parser.add_argument("--alignment_folder", type=str, default="../alignment_cache/", help="Folder to cache gene alignments")
+    parser.add_argument("--reference_path", type=str, default=None, help="Optional .h5ad file whose genes are aligned at start-up")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--socket", type=str, default=None, help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--window_ms", type=float, default=5.0, help="Time requests are collected into one batch")
+    parser.add_argument("--max_batch_cells", type=int, default=200000, help="Maximum number of cells per batch")
+    parser.add_argument("--max_body_mb", type=float, default=MAX_BODY_MB, help="Largest request body accepted, in megabytes")
+
+    args = parser.parse_args()
+
+    reference = ad.read_h5ad(args.reference_path, backed="r").var_names if args.reference_path else None
+    registry = ClockRegistry(args.model_folder, args.imputation_folder, args.compiled_folder, args.alignment_folder, reference)
+    try:
+        asyncio.run(serve(registry, args.host, args.port, args.socket, args.window_ms, args.max_batch_cells, args.max_body_mb))
+    except KeyboardInterrupt:
+        pass
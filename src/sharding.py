@@ -0,0 +1,182 @@
+import os
+import json
+import shutil
+import argparse
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import anndata as ad
+import scipy.sparse as sp
+from celltype_mappings import CELLTYPE_MAPPINGS
+from age_parsing import parse_ages
+
+SHARD_INDEX = "index.json"
+OBS_COLUMNS = ["cell_type", "donor_id", "development_stage", "disease"]
+
+def shard_name(cell_type):
+    """Folder name of a cell type's shard. Percent-encoded, so distinct cell types never share a folder."""
+    return quote(cell_type, safe="")
+
+def clear_shards(output_dir):
+    """Remove the index, var and cell type folders of a previous shard_h5ad run in output_dir."""
+    index_path = os.path.join(output_dir, SHARD_INDEX)
+    if os.path.exists(index_path):
+        for entry in read_shard_index(output_dir)["cell_types"].values():
+            shutil.rmtree(os.path.join(output_dir, entry["dir"]), ignore_errors=True)
+        os.remove(index_path)
+    if os.path.exists(os.path.join(output_dir, "var.csv")):
+        os.remove(os.path.join(output_dir, "var.csv"))
+
+def shard_h5ad(filepath, output_dir, dataset_name=None, healthy_only=False, chunk_size=50000):
+    """
+    Split a .h5ad file into per-cell-type CSR shards in a single pass over the matrix.
+
+    The expression matrix is read once in row chunks. Every cell is routed to its
+    cell type and the raw counts of each chunk are written as one part per cell type,
+    together with an obs sidecar CSV. The development stages are parsed once, through
+    their categories, into the 'age' and 'age_code' columns of the sidecar.
+    The shards of a previous run in output_dir are removed first.
+
+    Parameters:
+        filepath (str): Path to the .h5ad file.
+        output_dir (str): Folder to write the shards to.
+        dataset_name (str): Dataset key in CELLTYPE_MAPPINGS. Defaults to the file name.
+        healthy_only (bool): Keep only cells with disease == "normal". Off by default, as load_celltype
+            keeps every cell of the .h5ad file.
+        chunk_size (int): Number of rows read from disk at once.
+
+    Returns:
+        dict: The shard index that was written to output_dir.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"File not found: {filepath}")
+
+    if dataset_name is None:
+        dataset_name = os.path.splitext(os.path.basename(filepath))[0]
+    mapping = CELLTYPE_MAPPINGS.get(dataset_name, {})
+
+    adata = ad.read_h5ad(filepath, backed="r")
+    obs = adata.obs
+
+    keep = np.ones(adata.n_obs, dtype=bool)
+    if healthy_only and "disease" in obs.columns:
+        keep &= (obs["disease"] == "normal").values
+
+    cell_types = pd.Categorical(obs["cell_type"])
+    codes = np.where(keep, cell_types.codes, -1)
+    obs_columns = [c for c in OBS_COLUMNS if c in obs.columns]
+    obs = obs[obs_columns]
+    if "development_stage" in obs.columns:
+        obs = pd.concat([obs, parse_ages(dataset_name, obs["development_stage"]).set_index(obs.index)], axis=1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    clear_shards(output_dir)
+    adata.var[[c for c in ["feature_name"] if c in adata.var.columns]].to_csv(os.path.join(output_dir, "var.csv"))
+
+    n_parts = np.zeros(len(cell_types.categories), dtype=int)
+    n_cells = np.zeros(len(cell_types.categories), dtype=int)
+
+    for start in range(0, adata.n_obs, chunk_size):
+        stop = min(start + chunk_size, adata.n_obs)
+        chunk_codes = codes[start:stop]
+        if not np.any(chunk_codes >= 0):
+            continue
+
+        X_chunk = sp.csr_matrix(adata.X[start:stop])
+        obs_chunk = obs.iloc[start:stop]
+
+        for code in np.unique(chunk_codes[chunk_codes >= 0]):
+            rows = np.where(chunk_codes == code)[0]
+            folder = os.path.join(output_dir, shard_name(cell_types.categories[code]))
+            if n_parts[code] == 0:
+                # Parts left over from an interrupted run, which wrote no index yet.
+                shutil.rmtree(folder, ignore_errors=True)
+                os.makedirs(folder)
+
+            part = f"part-{n_parts[code]:05d}"
+            sp.save_npz(os.path.join(folder, f"{part}.npz"), X_chunk[rows], compressed=False)
+            obs_chunk.iloc[rows].to_csv(os.path.join(folder, f"{part}.obs.csv"))
+
+            n_parts[code] += 1
+            n_cells[code] += len(rows)
+
+        print(f"Sharded rows {start}-{stop} of {adata.n_obs}")
+
+    index = {
+        "source": os.path.abspath(filepath),
+        "dataset": dataset_name,
+        "healthy_only": bool(healthy_only),
+        "n_vars": int(adata.n_vars),
+        "cell_types": {},
+    }
+    for code, cell_type in enumerate(cell_types.categories):
+        if n_cells[code] == 0:
+            continue
+        clocks = mapping.get(cell_type, cell_type)
+        index["cell_types"][cell_type] = {
+            "dir": shard_name(cell_type),
+            "n_cells": int(n_cells[code]),
+            "n_parts": int(n_parts[code]),
+            "clocks": [clocks] if isinstance(clocks, str) else list(clocks),
+        }
+
+    with open(os.path.join(output_dir, SHARD_INDEX), "w") as f:
+        json.dump(index, f, indent=2)
+
+    print(f"Wrote {len(index['cell_types'])} cell type shards to {output_dir}")
+    return index
+
+def read_shard_index(shard_dir):
+    with open(os.path.join(shard_dir, SHARD_INDEX)) as f:
+        return json.load(f)
+
+def shard_parts(shard_dir, cell_type):
+    """Paths of the parts of one cell type's shard, without extension, in order."""
+    index = read_shard_index(shard_dir)
+    if cell_type not in index["cell_types"]:
+        raise ValueError(f"No cells found for type: {cell_type}")
+
+    entry = index["cell_types"][cell_type]
+    folder = os.path.join(shard_dir, entry["dir"])
+    return [os.path.join(folder, f"part-{i:05d}") for i in range(entry["n_parts"])]
+
+def load_shard_obs(shard_dir, cell_type):
+    """
+    The obs of one cell type's shard, without its counts.
+
+    Returns:
+        tuple: (pd.DataFrame of obs, list of the number of cells in every part)
+    """
+    frames = [pd.read_csv(f"{part}.obs.csv", index_col=0, dtype=str) for part in shard_parts(shard_dir, cell_type)]
+    return pd.concat(frames), [len(frame) for frame in frames]
+
+def load_shard(shard_dir, cell_type):
+    """
+    Load the raw counts and obs of one cell type from a shard folder.
+
+    Parameters:
+        shard_dir (str): Folder written by shard_h5ad.
+        cell_type (str): Name of the cell type to load.
+
+    Returns:
+        tuple: (scipy.sparse.csr_matrix of raw counts, pd.Index of var names, pd.DataFrame of obs)
+    """
+    parts = shard_parts(shard_dir, cell_type)
+    X = sp.vstack([sp.load_npz(f"{part}.npz") for part in parts], format="csr")
+    obs, _ = load_shard_obs(shard_dir, cell_type)
+    var_names = pd.read_csv(os.path.join(shard_dir, "var.csv"), index_col=0).index
+
+    return X, var_names, obs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a .h5ad file into per-cell-type shards")
+    parser.add_argument("--data_path", type=str, default="../data/AIDA.h5ad", help="Path to the input .h5ad file")
+    parser.add_argument("--output_folder", type=str, default=None, help="Folder to save shards (default: ../shards/<dataset>/)")
+    parser.add_argument("--chunk_size", type=int, default=50000, help="Number of rows read from disk at once")
+    parser.add_argument("--healthy_only", action="store_true", help="Keep only cells with disease 'normal'")
+
+    args = parser.parse_args()
+
+    dataset_name = os.path.splitext(os.path.basename(args.data_path))[0]
+    output_folder = args.output_folder or os.path.join("../shards/", dataset_name)
+    shard_h5ad(args.data_path, output_folder, dataset_name, args.healthy_only, args.chunk_size)
@@ -0,0 +1,84 @@
+import numpy as np
+from functools import partial
+from aggregation import factorize_donors
+
+STRATEGIES = ["donor_cap", "coreset"]
+
+def take_per_donor(codes, priority, quota):
+    """
+    Rows with the highest priority within every donor, quota[donor] of them.
+
+    Parameters:
+        codes (np.ndarray): Donor code of every row.
+        priority (np.ndarray): Rows of a donor are taken in decreasing priority.
+        quota (np.ndarray): Number of rows to take per donor code.
+
+    Returns:
+        np.ndarray: Sorted positions of the taken rows.
+    """
+    order = np.lexsort((-priority, codes))
+    counts = np.bincount(codes, minlength=len(quota))
+    within = np.arange(len(codes)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.sort(order[within < quota[codes[order]]])
+
+def donor_cap(rows, donor_ids, max_cells, seed=0):
+    """At most max_cells random rows of every donor among rows."""
+    codes, uniques = factorize_donors(donor_ids[rows])
+    priority = np.random.default_rng(seed).random(len(rows))
+    return rows[take_per_donor(codes, priority, np.full(len(uniques), max_cells))]
+
+def leverage_scores(X, n_genes=2000, rank=50, seed=0):
+    """
+    Approximate leverage of every cell in the centred expression of the n_genes most
+    variable genes: squared row norms of an orthonormal basis of its top rank directions,
+    found by a randomized range finder with one power iteration. The centring is applied
+    implicitly, so X stays sparse.
+    """
+    mean = np.asarray(X.mean(axis=0), dtype=np.float64).ravel()
+    squares = X.multiply(X) if hasattr(X, "multiply") else np.square(X)
+    variance = np.asarray(squares.mean(axis=0), dtype=np.float64).ravel() - mean ** 2
+    columns = np.sort(np.argsort(variance)[::-1][:n_genes])
+    sub, mean = X[:, columns], mean[columns]
+
+    omega = np.random.default_rng(seed).normal(size=(len(columns), min(rank + 10, len(columns))))
+    Y = np.asarray(sub @ omega) - mean @ omega
+    Z = np.asarray(sub.T @ Y) - np.outer(mean, Y.sum(axis=0))
+    Y = np.asarray(sub @ Z) - mean @ Z
+    Q, _ = np.linalg.qr(Y)
+    return np.square(Q[:, :rank]).sum(axis=1)
+
+def coreset(rows, donor_ids, leverage, fraction, seed=0):
+    """
+    A donor-stratified sample of fraction of the rows of every donor (at least one), drawn
+    without replacement with probability proportional to leverage mixed half and half with
+    uniform, so that high-leverage cells are kept without dropping typical ones.
+    """
+    codes, uniques = factorize_donors(donor_ids[rows])
+    mean = leverage[rows].mean()
+    # Rows without any leverage (e.g. identical expression) are sampled uniformly.
+    weights = 0.5 * leverage[rows] / mean + 0.5 if mean > 0 else np.ones(len(rows))
+    # Weighted sampling without replacement: the largest log(u) / w per donor (Efraimidis-Spirakis).
+    priority = np.log(np.random.default_rng(seed).random(len(rows))) / weights
+    quota = np.maximum(np.ceil(fraction * np.bincount(codes, minlength=len(uniques))), 1).astype(int)
+    return rows[take_per_donor(codes, priority, quota)]
+
+def make_sampler(data, strategy, max_cells_per_donor=None, fraction=None, n_genes=2000, rank=50, seed=0):
+    """
+    Function that selects the training rows of a fold, for train_matrix_by_fold(sampler=...).
+
+    Parameters:
+        data (CellTypeData): Normalized expression of one cell type.
+        strategy (str): 'donor_cap' (at most max_cells_per_donor cells per donor) or
+            'coreset' (fraction of each donor's cells, favouring high-leverage cells).
+        n_genes, rank (int): Genes and directions of leverage_scores, for 'coreset'.
+
+    Returns:
+        callable: rows -> selected rows.
+    """
+    donor_ids = np.asarray(data.obs["donor_id"].values)
+    if strategy == "donor_cap":
+        return partial(donor_cap, donor_ids=donor_ids, max_cells=max_cells_per_donor, seed=seed)
+    if strategy == "coreset":
+        leverage = leverage_scores(data.X, n_genes, rank, seed)
+        return partial(coreset, donor_ids=donor_ids, leverage=leverage, fraction=fraction, seed=seed)
+    raise ValueError(f"Unknown subsampling strategy: {strategy}")
@@ -0,0 +1,152 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import anndata as ad
+
+CELL_TYPES = ["CD14-positive monocyte", "naive B cell", "natural killer cell", "naive thymus-derived CD4-positive, alpha-beta T cell",
+              "CD16-positive, CD56-dim natural killer cell, human", "effector memory CD8-positive, alpha-beta T cell"]
+
+def gene_ids(n_genes, offset=0):
+    return pd.Index([f"ENSG{i:011d}" for i in range(offset, offset + n_genes)])
+
+def make_donors(n_donors, rng, min_age=19, max_age=80):
+    """Donor ids and integer ages spread uniformly over the adult range."""
+    ages = rng.integers(min_age, max_age + 1, n_donors)
+    return pd.Index([f"donor{i}" for i in range(n_donors)]), ages
+
+def make_counts(n_cells, n_genes, density, ages, age_genes, age_effect, rng, block_rows=50000):
+    """
+    Sparse raw counts with about density * n_genes stored values per cell.
+
+    Gene detection rates follow a log-normal popularity profile, counts are Poisson
+    around a per-gene mean, and the counts of age_genes scale with exp(age_effect * z),
+    where z is the standardized age of the cell's donor. Rows are drawn in blocks so
+    the dense cells x genes matrix is never materialized.
+    """
+    popularity = rng.lognormal(0.0, 1.0, n_genes)
+    popularity /= popularity.sum()
+    gene_means = rng.lognormal(0.0, 0.8, n_genes)
+    z = (ages - ages.mean()) / max(ages.std(), 1e-12)
+    is_age_gene = np.zeros(n_genes, dtype=bool)
+    is_age_gene[age_genes] = True
+
+    blocks = []
+    for start in range(0, n_cells, block_rows):
+        stop = min(start + block_rows, n_cells)
+        nnz = rng.binomial(n_genes, density, stop - start)
+        rows = np.repeat(np.arange(stop - start), nnz)
+        cols = rng.choice(n_genes, nnz.sum(), p=popularity)
+
+        rate = gene_means[cols]
+        scale = np.exp(age_effect * z[start:stop][rows])
+        rate = np.where(is_age_gene[cols], rate * scale, rate)
+        values = (1 + rng.poisson(rate)).astype(np.float32)
+
+        block = sp.coo_matrix((values, (rows, cols)), shape=(stop - start, n_genes)).tocsr()
+        block.sum_duplicates()
+        blocks.append(block)
+    return sp.vstack(blocks, format="csr")
+
+def make_dataset(path, n_cells=10000, n_genes=2000, density=0.05, n_cell_types=3, n_donors=40,
+                 n_age_genes=50, age_effect=0.3, seed=0):
+    """
+    Write a synthetic .h5ad file with the obs and var layout of the AIDA dataset.
+
+    Cells are spread over donors and cell types with Dirichlet proportions, so cell
+    type sizes and cells per donor are uneven as in real atlases.
+
+    Parameters:
+        path (str): Output .h5ad path.
+        n_cells (int): Number of cells.
+        n_genes (int): Number of genes.
+        density (float): Expected fraction of nonzero values per cell.
+        n_cell_types (int): Number of cell types, named after CELL_TYPES.
+        n_donors (int): Number of donors.
+        n_age_genes (int): Number of genes whose expression depends on donor age.
+        age_effect (float): Log fold change of the age genes per standard deviation of age.
+        seed (int): Random seed.
+
+    Returns:
+        pd.Index: The gene ids (var_names) of the dataset.
+    """
+    rng = np.random.default_rng(seed)
+    cell_types = [CELL_TYPES[i] if i < len(CELL_TYPES) else f"cell type {i}" for i in range(n_cell_types)]
+    donors, donor_ages = make_donors(n_donors, rng)
+
+    donor_of_cell = rng.choice(n_donors, n_cells, p=rng.dirichlet(np.full(n_donors, 5.0)))
+    type_of_cell = rng.choice(n_cell_types, n_cells, p=rng.dirichlet(np.full(n_cell_types, 2.0)))
+    order = np.lexsort((donor_of_cell, type_of_cell))
+    donor_of_cell, type_of_cell = donor_of_cell[order], type_of_cell[order]
+    ages = donor_ages[donor_of_cell]
+
+    var_names = gene_ids(n_genes)
+    age_genes = rng.choice(n_genes, min(n_age_genes, n_genes), replace=False)
+    X = make_counts(n_cells, n_genes, density, ages.astype(np.float64), age_genes, age_effect, rng)
+
+    obs = pd.DataFrame({
+        "cell_type": pd.Categorical.from_codes(type_of_cell, cell_types),
+        "donor_id": pd.Categorical.from_codes(donor_of_cell, donors),
+        "development_stage": pd.Categorical([f"{age}-year-old human stage" for age in ages]),
+        "disease": pd.Categorical(["normal"] * n_cells),
+    }, index=[f"cell{i}" for i in range(n_cells)])
+    var = pd.DataFrame({"feature_name": [f"GENE{i}" for i in range(n_genes)]}, index=var_names)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    ad.AnnData(X, obs=obs, var=var).write_h5ad(path)
+    print(f"Wrote {n_cells} cells x {n_genes} genes ({X.nnz} stored values) to {path}")
+    return var_names
+
+def make_clocks(var_names, cell_types, model_folder, imputation_folder, n_clock_genes=300,
+                missing_fraction=0.1, n_folds=5, seed=0):
+    """
+    Write fake *_models5.csv and Impute_avg_*.csv files for the given cell types.
+
+    Every model file has one row per fold, a coefficient column for every gene of the
+    dataset plus missing_fraction extra genes that the dataset lacks (so imputation is
+    exercised) and an 'intercept' column; n_clock_genes coefficients per fold are nonzero.
+    """
+    rng = np.random.default_rng(seed)
+    n_missing = int(round(n_clock_genes * missing_fraction))
+    genes = var_names.append(gene_ids(n_missing, offset=len(var_names)))
+    os.makedirs(model_folder, exist_ok=True)
+    os.makedirs(imputation_folder, exist_ok=True)
+
+    for cell_type in cell_types:
+        clock_genes = np.concatenate([rng.choice(len(var_names), n_clock_genes - n_missing, replace=False),
+                                      len(var_names) + np.arange(n_missing)])
+        coeffs = np.zeros((n_folds, len(genes)))
+        coeffs[:, clock_genes] = rng.normal(0.0, 0.5, (n_folds, len(clock_genes)))
+        coeffs[rng.random(coeffs.shape) < 0.2] = 0.0
+
+        models = pd.DataFrame(coeffs, columns=genes)
+        models["intercept"] = rng.normal(50.0, 5.0, n_folds)
+        models.to_csv(os.path.join(model_folder, f"{cell_type}_models5.csv"), index=False)
+
+        impute = pd.DataFrame([rng.lognormal(0.0, 0.5, len(clock_genes))], columns=genes[clock_genes])
+        impute.insert(0, "x", "avg")
+        impute.to_csv(os.path.join(imputation_folder, f"Impute_avg_{cell_type}.csv"), index=False)
+
+    print(f"Wrote {len(cell_types)} clocks to {model_folder}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic AIDA-like .h5ad file with matching clock files")
+    parser.add_argument("--output_folder", type=str, default="../synthetic/", help="Folder for data/, models/ and data_for_imputation/")
+    parser.add_argument("--n_cells", type=int, default=10000, help="Number of cells")
+    parser.add_argument("--n_genes", type=int, default=2000, help="Number of genes")
+    parser.add_argument("--density", type=float, default=0.05, help="Fraction of nonzero values per cell")
+    parser.add_argument("--n_cell_types", type=int, default=3, help="Number of cell types")
+    parser.add_argument("--n_donors", type=int, default=40, help="Number of donors")
+    parser.add_argument("--n_clock_genes", type=int, default=300, help="Nonzero genes per clock")
+    parser.add_argument("--missing_fraction", type=float, default=0.1, help="Fraction of clock genes absent from the data")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+    args = parser.parse_args()
+
+    var_names = make_dataset(os.path.join(args.output_folder, "data", "AIDA.h5ad"), args.n_cells, args.n_genes,
+                             args.density, args.n_cell_types, args.n_donors, seed=args.seed)
+    cell_types = ad.read_h5ad(os.path.join(args.output_folder, "data", "AIDA.h5ad"), backed="r").obs["cell_type"].cat.categories
+    make_clocks(var_names, cell_types, os.path.join(args.output_folder, "models"),
+                os.path.join(args.output_folder, "data_for_imputation"), args.n_clock_genes,
+                args.missing_fraction, seed=args.seed)
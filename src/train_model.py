@@ -1,63 +1,496 @@
 import os
+import argparse
+from functools import partial
+import numpy as np
 import pandas as pd
-from preprocessing import load_celltype_data as load_data_by_celltype
-from sklearn.linear_model import ElasticNet
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+from preprocessing import load_celltype, CellTypeData
+from sklearn.linear_model import ElasticNet, SGDRegressor
+from out_of_core import celltype_source, source_var_names, iter_training_chunks
+from subsampling import STRATEGIES, make_sampler
+from scoring import stack_models
+from clock_artifacts import save_clock, source_digests
+from gene_alignment import vocabulary_hash
+from scheduler import WorkUnit, run_units, check_failures, celltype_memory_mb
+from prediction_store import STORE_FOLDER, CV_DATASET, write_predictions
+from profiling import profile, enable, print_summary
 from sklearn.model_selection import KFold
 
-def train_and_predict_by_fold(df, n_folds=5, alpha=1.0, l1_ratio=0.5):
-    donors = df["donor_id"].unique()
+# Without an inner CV, the grid point is selected on one validation split that holds out
+# a third of the training donors.
+VALIDATION_FOLDS = 3
+
+def donor_folds(donor_ids, n_folds=5):
+    """
+    Donor-grouped KFold splits as row indices, without copying any data.
+    Splits are identical to KFold over the donors in order of first appearance.
+    """
+    donors = pd.unique(donor_ids)
+    codes = pd.Index(donors).get_indexer(donor_ids)
     kf = KFold(n_splits=n_folds, shuffle=True, random_state=42)
 
-    models = []
-    test_preds = []
+    for train_idx, test_idx in kf.split(donors):
+        test_mask = np.isin(codes, test_idx)
+        yield np.where(~test_mask)[0], np.where(test_mask)[0]
+
+def fit_fold_path(X, y, train_rows, test_rows, alphas, l1_ratios, max_iter=10000):
+    """
+    Fit one fold along the regularization path. For every l1_ratio the model is
+    warm-started from the previous (larger) alpha, so the whole path costs little
+    more than a single fit at the smallest alpha.
+
+    Returns:
+        list: One (alpha, l1_ratio, coef, intercept, test predictions) tuple per path point.
+    """
+    X_train, y_train = X[train_rows], y[train_rows]
+    X_test = X[test_rows]
+
+    path = []
+    for l1_ratio in l1_ratios:
+        model = ElasticNet(l1_ratio=l1_ratio, max_iter=max_iter, warm_start=True)
+        for alpha in sorted(alphas, reverse=True):
+            model.set_params(alpha=alpha)
+            model.fit(X_train, y_train)
+            path.append((alpha, l1_ratio, model.coef_.copy(), model.intercept_, model.predict(X_test)))
+    return path
+
+def grid_points(alphas, l1_ratios):
+    """The alpha / l1_ratio grid in the order of fit_fold_path."""
+    return pd.DataFrame([(alpha, l1_ratio) for l1_ratio in l1_ratios for alpha in sorted(alphas, reverse=True)],
+                        columns=["alpha", "l1_ratio"])
+
+def count_training_donors(train_donors):
+    n_donors = len(pd.unique(train_donors))
+    if n_donors < 2:
+        raise ValueError(f"Grid selection needs at least 2 training donors per fold, found {n_donors}")
+    return n_donors
+
+def inner_grid_maes(X, y, donor_ids, train_rows, alphas, l1_ratios, inner_folds=3):
+    """
+    Mean MAE of every grid point in a donor-grouped CV over the training rows of one
+    outer fold, so that the grid point is selected without its held-out cells.
+
+    Returns:
+        np.ndarray: One MAE per path point of fit_fold_path.
+    """
+    train_donors = donor_ids[train_rows]
+    n_donors = count_training_donors(train_donors)
+
+    maes = []
+    for inner_train, inner_test in donor_folds(train_donors, min(inner_folds, n_donors)):
+        path = fit_fold_path(X, y, train_rows[inner_train], train_rows[inner_test], alphas, l1_ratios)
+        maes.append([np.mean(np.abs(point[4] - y[train_rows[inner_test]])) for point in path])
+    return np.mean(maes, axis=0)
+
+def validation_fit(X, y, donor_ids, train_rows, test_rows, alphas, l1_ratios, max_iter=10000):
+    """
+    Select the grid point of one outer fold in a single pass: the warm-started path is
+    fitted on two thirds of the training donors and scored on the other third, and only
+    the selected point is refitted on all training rows, warm-started from its path
+    coefficients.
+
+    Returns:
+        tuple: ((alpha, l1_ratio, coef, intercept, test predictions) of the refitted model,
+            np.ndarray of the validation MAE of every path point)
+    """
+    train_donors = donor_ids[train_rows]
+    n_donors = count_training_donors(train_donors)
+    inner_train, inner_val = next(donor_folds(train_donors, min(VALIDATION_FOLDS, n_donors)))
+    path = fit_fold_path(X, y, train_rows[inner_train], train_rows[inner_val], alphas, l1_ratios, max_iter)
+    maes = np.array([np.mean(np.abs(point[4] - y[train_rows[inner_val]])) for point in path])
+
+    alpha, l1_ratio, coef, _, _ = path[np.argmin(maes)]
+    model = ElasticNet(alpha=alpha, l1_ratio=l1_ratio, max_iter=max_iter, warm_start=True)
+    model.coef_ = coef.copy()
+    model.fit(X[train_rows], y[train_rows])
+    return (alpha, l1_ratio, model.coef_.copy(), model.intercept_, model.predict(X[test_rows])), maes
 
-    for fold_idx, (train_idx, test_idx) in enumerate(kf.split(donors)):
-        train_donors = donors[train_idx]
-        test_donors = donors[test_idx]
+def fit_fold(X, y, donor_ids, train_rows, test_rows, alphas, l1_ratios, inner_folds=None):
+    """
+    Fit one outer fold and select its grid point: by validation_fit, or, when inner_folds
+    is given, by inner_grid_maes over the full path (about inner_folds + 1 path fits).
 
-        train_df = df[df["donor_id"].isin(train_donors)].copy()
-        test_df = df[df["donor_id"].isin(test_donors)].copy()
+    Returns:
+        tuple: ((alpha, l1_ratio, coef, intercept, test predictions) of the selected model,
+            np.ndarray of the selection MAE of every grid point, NaN for a single-point grid)
+    """
+    if len(alphas) * len(l1_ratios) == 1:
+        return fit_fold_path(X, y, train_rows, test_rows, alphas, l1_ratios)[0], np.full(1, np.nan)
+    if inner_folds is None:
+        return validation_fit(X, y, donor_ids, train_rows, test_rows, alphas, l1_ratios)
+    path = fit_fold_path(X, y, train_rows, test_rows, alphas, l1_ratios)
+    maes = inner_grid_maes(X, y, donor_ids, train_rows, alphas, l1_ratios, inner_folds)
+    return path[np.argmin(maes)], maes
 
-        X_train = train_df.drop(columns=["age", "donor_id", "cell_id"])
-        y_train = train_df["age"]
-        X_test = test_df.drop(columns=["age", "donor_id", "cell_id"])
+def train_matrix_by_fold(data, n_folds=5, alphas=(1.0,), l1_ratios=(0.5,), n_jobs=1, sampler=None, inner_folds=None):
+    """
+    Train donor-grouped fold models directly on a CSR matrix.
 
-        model = ElasticNet(alpha=alpha, l1_ratio=l1_ratio, max_iter=10000)
-        model.fit(X_train, y_train)
+    Folds are fitted in parallel threads (coordinate descent releases the GIL) along the
+    alpha / l1_ratio grid. Every fold keeps the grid point with the lowest MAE on its own
+    training donors (a validation split, or an inner donor-grouped CV with inner_folds),
+    and only that model predicts its held-out cells, so the reported predictions take no
+    part in the selection.
+    With a sampler, models are fitted on a subsample of the training rows of every fold
+    and still predict all of its held-out rows.
 
-        model_coeffs = pd.Series(model.coef_, index=X_train.columns)
-        model_df = model_coeffs.to_frame().T
-        model_df["intercept"] = model.intercept_
+    Parameters:
+        data (CellTypeData): Normalized expression of one cell type.
+        n_folds (int): Number of donor folds.
+        alphas (sequence): Regularization strengths to search.
+        l1_ratios (sequence): ElasticNet mixing parameters to search.
+        n_jobs (int): Number of folds fitted at once.
+        sampler (callable): Optional training row selection, e.g. from subsampling.make_sampler.
+        inner_folds (int): Optional number of inner donor folds used to select the grid point.
+
+    Returns:
+        tuple: (pd.DataFrame of fold models, pd.DataFrame of held-out predictions,
+            pd.DataFrame with the mean selection MAE of every grid point and the number
+            of outer folds that selected it)
+    """
+    X, var_names, meta = data
+    y = meta["age"].to_numpy(dtype=float)
+    donor_ids = meta["donor_id"].values
+    folds = list(donor_folds(donor_ids, n_folds))
+    if sampler is not None:
+        folds = [(sampler(train_rows), test_rows) for train_rows, test_rows in folds]
+
+    results = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(fit_fold)(X, y, donor_ids, train_rows, test_rows, alphas, l1_ratios, inner_folds)
+        for train_rows, test_rows in folds
+    )
+    maes = np.array([fold_maes for _, fold_maes in results])
+    selected = np.argmin(np.nan_to_num(maes, nan=0.0), axis=1)
+
+    grid = grid_points(alphas, l1_ratios)
+    grid["mean_mae"] = maes.mean(axis=0)
+    grid["n_selected"] = np.bincount(selected, minlength=len(grid))
+
+    models = []
+    test_preds = []
+    for (point, _), (_, test_rows) in zip(results, folds):
+        _, _, coef, intercept, y_pred = point
+
+        model_df = pd.DataFrame(coef[None, :], columns=var_names)
+        model_df["intercept"] = intercept
         models.append(model_df)
 
-        y_pred = model.predict(X_test)
-        pred_df = pd.DataFrame({
-            "cell_id": test_df["cell_id"],
-            "donor_id": test_df["donor_id"],
-            "true_age": test_df["age"],
+        test_preds.append(pd.DataFrame({
+            "cell_id": meta["cell_id"].values[test_rows],
+            "donor_id": meta["donor_id"].values[test_rows],
+            "true_age": meta["age"].values[test_rows],
             "predicted_age": y_pred
-        })
-        test_preds.append(pred_df)
+        }))
 
-    return pd.concat(models, ignore_index=True), pd.concat(test_preds, ignore_index=True)
+    return pd.concat(models, ignore_index=True), pd.concat(test_preds, ignore_index=True), grid
 
-def main(h5ad_path, output_model_dir, output_pred_dir, cell_types):
-    os.makedirs(output_model_dir, exist_ok=True)
-    os.makedirs(output_pred_dir, exist_ok=True)
+def train_out_of_core(filepath, cell_type, shard_dir=None, n_folds=5, alphas=(1.0,), l1_ratios=(0.5,),
+                      epochs=20, chunk_size=50000, memory_budget_mb=None, seed=0, inner_folds=None, tol=0.02):
+    """
+    Train donor-grouped fold models with a bounded memory footprint.
+
+    Cells are streamed in chunks (iter_training_chunks) and every (fold, alpha, l1_ratio)
+    model is updated on the chunk's cells outside its fold with an averaged SGD elastic net.
+    This is an approximation of train_matrix_by_fold: SGDRegressor has the loss and penalty
+    of ElasticNet, but stops after a few passes and its averaged coefficients are not sparse,
+    so the models keep far more genes and can be less accurate than coordinate descent.
+    Training stops once no coefficient vector moves by more than tol (relative) in a pass.
+
+    Ages are centred on the fold's training mean, which is added back to the intercept. The
+    grid point of every fold is selected by the MAE of models trained without a validation
+    third of its training donors or, with inner_folds, in an inner donor-grouped CV, as in
+    train_matrix_by_fold; every extra split adds one model per grid point. A first pass
+    sums the expression of every gene and sets the step size; a last pass predicts the
+    held-out cells.
+
+    Parameters:
+        filepath (str): Path to the .h5ad file.
+        cell_type (str): Name of the cell type.
+        shard_dir (str): Optional folder written by sharding.py, read instead of the file.
+        n_folds (int): Number of donor folds, split as in train_matrix_by_fold.
+        alphas, l1_ratios (sequence): Grid searched, as in train_matrix_by_fold.
+        epochs (int): Maximum number of training passes over the data.
+        chunk_size (int): Maximum number of cells per chunk.
+        memory_budget_mb (float): Maximum estimated memory per chunk.
+        inner_folds (int): Optional number of inner donor folds used to select the grid point.
+        tol (float): Relative coefficient change below which training stops.
+
+    Returns:
+        tuple: (pd.DataFrame of fold models, pd.DataFrame of held-out predictions,
+            pd.DataFrame with the mean selection MAE of every grid point and the number of
+            outer folds that selected it, pd.Series of the mean expression of every gene)
+    """
+    obs, source = celltype_source(filepath, cell_type, shard_dir)
+    var_names = source_var_names(source, shard_dir)
+    print(f"Streaming {len(obs)} cells of type '{cell_type}'")
+
+    y = obs["age"].to_numpy(dtype=float)
+    donor_ids = obs["donor_id"].values
+    grid = grid_points(alphas, l1_ratios)
 
-    for cell_type in cell_types:
-        print(f"Processing: {cell_type}")
-        df = load_data_by_celltype(h5ad_path, cell_type)
-        models_df, preds_df = train_and_predict_by_fold(df)
+    # Every outer fold trains one model per grid point on its training cells and, to select
+    # the grid point, one per grid point and validation split (or inner donor fold) of its
+    # training donors.
+    fold_of = np.empty(len(obs), dtype=np.int64)
+    inner_of = np.full((n_folds, len(obs)), -1, dtype=np.int64)
+    tasks = [(fold, -1) for fold in range(n_folds)]
+    for fold, (train_rows, test_rows) in enumerate(donor_folds(donor_ids, n_folds)):
+        fold_of[test_rows] = fold
+        if len(grid) > 1:
+            n_donors = count_training_donors(donor_ids[train_rows])
+            splits = donor_folds(donor_ids[train_rows], min(inner_folds or VALIDATION_FOLDS, n_donors))
+            for inner, (_, inner_test) in enumerate(splits):
+                inner_of[fold, train_rows[inner_test]] = inner
+                tasks.append((fold, inner))
+                if inner_folds is None:
+                    break
 
+    def in_training(task, positions):
+        fold, inner = task
+        return (fold_of[positions] != fold) & ((inner < 0) | (inner_of[fold, positions] != inner))
+
+    def held_out(task, positions):
+        fold, inner = task
+        return fold_of[positions] == fold if inner < 0 else inner_of[fold, positions] == inner
+
+    everyone = np.arange(len(obs))
+    centers = {task: y[in_training(task, everyone)].mean() for task in tasks}
+    # A first pass sums the expression of every gene, for the imputation values of the
+    # compiled clock, and sets the step size: SGD is stable for steps below 1 / ||x||^2,
+    # and log expression rows are far from unit norm.
+    gene_sums = np.zeros(len(var_names))
+    row_norms = np.empty(len(obs))
+    for positions, X in iter_training_chunks(source, donor_ids, chunk_size, memory_budget_mb, seed):
+        gene_sums += np.asarray(X.sum(axis=0), dtype=np.float64).ravel()
+        row_norms[positions] = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+    eta0 = 1.0 / np.percentile(row_norms, 99)
+
+    models = {task: [SGDRegressor(penalty="elasticnet", alpha=point.alpha, l1_ratio=point.l1_ratio,
+                                  learning_rate="invscaling", eta0=eta0, average=True, random_state=seed)
+                     for point in grid.itertuples()] for task in tasks}
+    previous = None
+    for epoch in range(epochs):
+        for positions, X in iter_training_chunks(source, donor_ids, chunk_size, memory_budget_mb, seed + epoch + 1):
+            for task in tasks:
+                train = in_training(task, positions)
+                if train.any():
+                    X_train, y_train = X[train], y[positions[train]] - centers[task]
+                    for model in models[task]:
+                        model.partial_fit(X_train, y_train)
+
+        coefs = np.array([model.coef_ for task in tasks for model in models[task]])
+        if previous is not None:
+            change = np.max(np.linalg.norm(coefs - previous, axis=1)
+                            / np.maximum(np.linalg.norm(coefs, axis=1), 1e-12))
+            print(f"  Epoch {epoch + 1}/{epochs}: relative coefficient change {change:.2e}")
+            if change < tol:
+                break
+        else:
+            print(f"  Epoch {epoch + 1}/{epochs}")
+        previous = coefs
+
+    predictions = np.empty((len(obs), len(grid)))
+    inner_errors = np.zeros((n_folds, len(grid)))
+    inner_counts = np.zeros(n_folds)
+    for positions, X in iter_training_chunks(source, donor_ids, chunk_size, memory_budget_mb, seed):
+        for task in tasks:
+            test = held_out(task, positions)
+            if not test.any():
+                continue
+            task_preds = np.column_stack([model.predict(X[test]) for model in models[task]]) + centers[task]
+            fold, inner = task
+            if inner < 0:
+                predictions[positions[test]] = task_preds
+            else:
+                inner_errors[fold] += np.abs(task_preds - y[positions[test], None]).sum(axis=0)
+                inner_counts[fold] += test.sum()
+
+    if len(grid) > 1:
+        inner_maes = inner_errors / inner_counts[:, None]
+        selected = np.argmin(inner_maes, axis=1)
+    else:
+        inner_maes = np.full((n_folds, 1), np.nan)
+        selected = np.zeros(n_folds, dtype=np.int64)
+    grid["mean_mae"] = inner_maes.mean(axis=0)
+    grid["n_selected"] = np.bincount(selected, minlength=len(grid))
+
+    outer = [models[(fold, -1)][selected[fold]] for fold in range(n_folds)]
+    models_df = pd.DataFrame(np.vstack([model.coef_ for model in outer]), columns=var_names)
+    models_df["intercept"] = [model.intercept_[0] + centers[(fold, -1)] for fold, model in enumerate(outer)]
+
+    order = np.concatenate([np.where(fold_of == fold)[0] for fold in range(n_folds)])
+    preds_df = pd.DataFrame({
+        "cell_id": obs["cell_id"].values[order],
+        "donor_id": donor_ids[order],
+        "true_age": obs["age"].values[order],
+        "predicted_age": predictions[order, selected[fold_of[order]]],
+    })
+
+    return models_df, preds_df, grid, pd.Series(gene_sums / len(obs), index=var_names)
+
+def train_and_predict_by_fold(df, n_folds=5, alpha=1.0, l1_ratio=0.5):
+    """Legacy entry point for the DataFrame returned by load_celltype_data."""
+    genes = df.columns.drop(["age", "donor_id", "cell_id"])
+    data = CellTypeData(sp.csr_matrix(df[genes].sparse.to_coo()), genes, df[["age", "donor_id", "cell_id"]])
+    models_df, preds_df, _ = train_matrix_by_fold(data, n_folds, (alpha,), (l1_ratio,))
+    return models_df, preds_df
+
+def compile_trained_clock(models_df, data, cell_type, imputation_folder, compiled_folder, gene_means=None,
+                          model_folder=None):
+    """
+    Compile trained fold models. Without an imputation file, one is written with the mean
+    of every clock gene in the training data (from data, or from gene_means when the data
+    was streamed), so that the compiled clock and its CSVs impute the same values.
+    The digests of the saved model CSV in model_folder and of the imputation file are
+    recorded, so that get_clock notices when either changes.
+    """
+    impute_path = os.path.join(imputation_folder, f"Impute_avg_{cell_type}.csv")
+    if not os.path.exists(impute_path):
+        genes = stack_models(models_df).genes
+        if gene_means is None:
+            columns = pd.Index(data.var_names).get_indexer(genes)
+            gene_means = pd.Series(np.asarray(data.X[:, columns].mean(axis=0)).ravel(), index=genes)
+        impute_df = pd.DataFrame([gene_means.reindex(genes).fillna(0.0).to_numpy(dtype=np.float64)], columns=genes)
+        impute_df.insert(0, "x", "avg")
+        os.makedirs(imputation_folder, exist_ok=True)
+        impute_df.to_csv(impute_path, index=False)
+        print(f"Wrote training means of {len(genes)} clock genes to {impute_path}")
+    clock = stack_models(models_df, pd.read_csv(impute_path))
+
+    vocab_hash = vocabulary_hash(models_df.columns.drop("intercept"))
+    sources = None if model_folder is None else source_digests(cell_type, model_folder, imputation_folder)
+    return save_clock(clock, compiled_folder, cell_type, vocab_hash, sources)
+
+def train_celltype(h5ad_path, cell_type, output_model_dir, output_pred_dir, shard_dir=None,
+                   imputation_folder="../data_for_imputation/", compiled_folder=None,
+                   alphas=(1.0,), l1_ratios=(0.5,), fold_jobs=1, cache_folder=None, cache_budget_mb=None,
+                   output_format="csv", store_folder=STORE_FOLDER, out_of_core=None, subsample=None, inner_folds=None):
+    """
+    Train, save and optionally compile the clock of one cell type. out_of_core, a dict of
+    train_out_of_core options (epochs, tol, chunk_size, memory_budget_mb), streams the cells
+    instead of loading them. subsample, a dict of make_sampler options (strategy,
+    max_cells_per_donor, fraction), fits the in-memory models on a subsample of the cells.
+    inner_folds selects the grid point by an inner donor CV instead of a validation split.
+    """
+    print(f"Processing: {cell_type}")
+    labels = {"dataset": CV_DATASET, "cell_type": cell_type}
+    data, gene_means = None, None
+    if out_of_core is not None:
+        with profile("fit", cprofile=True, out_of_core=True, **labels) as counters:
+            models_df, preds_df, grid, gene_means = train_out_of_core(h5ad_path, cell_type, shard_dir, alphas=alphas,
+                                                                      l1_ratios=l1_ratios, inner_folds=inner_folds,
+                                                                      **out_of_core)
+            counters["cells"] = len(preds_df)
+            counters["grid_size"] = len(grid)
+    else:
+        with profile("load", **labels) as counters:
+            data = load_celltype(h5ad_path, cell_type, shard_dir, cache_folder, cache_budget_mb)
+            counters["cells"] = data.X.shape[0]
+            counters["nnz"] = data.X.nnz
+
+        sampler = None if subsample is None else make_sampler(data, **subsample)
+        with profile("fit", cprofile=True, **labels) as counters:
+            models_df, preds_df, grid = train_matrix_by_fold(data, alphas=alphas, l1_ratios=l1_ratios, n_jobs=fold_jobs,
+                                                             sampler=sampler, inner_folds=inner_folds)
+            counters["cells"] = data.X.shape[0]
+            counters["grid_size"] = len(grid)
+
+    with profile("write", **labels) as counters:
         models_df.to_csv(os.path.join(output_model_dir, f"{cell_type}_models5.csv"), index=False)
-        preds_df.to_csv(os.path.join(output_pred_dir, f"{cell_type}_predictions.csv"), index=False)
+        write_predictions(preds_df, os.path.join(output_pred_dir, f"{cell_type}_predictions.csv"),
+                          store_folder, CV_DATASET, cell_type, cell_type, output_format)
+        counters["rows"] = len(preds_df)
+
+    if len(grid) > 1:
+        for point in grid[grid["n_selected"] > 0].itertuples():
+            print(f"Selected alpha={point.alpha}, l1_ratio={point.l1_ratio} in {point.n_selected} folds "
+                  f"(selection MAE {point.mean_mae:.2f})")
+        grid.to_csv(os.path.join(output_model_dir, f"{cell_type}_path.csv"), index=False)
+
+    if compiled_folder is not None:
+        compile_trained_clock(models_df, data, cell_type, imputation_folder, compiled_folder, gene_means,
+                              output_model_dir)
+
+    print(f"Saved models and predictions for {cell_type}")
+
+def train_unit(unit, **kwargs):
+    train_celltype(cell_type=unit.cell_type, **kwargs)
+
+def main(h5ad_path, output_model_dir, output_pred_dir, cell_types, shard_dir=None,
+         imputation_folder="../data_for_imputation/", compiled_folder=None,
+         workers=1, memory_budget_mb=None, retries=1, alphas=(1.0,), l1_ratios=(0.5,), fold_jobs=1,
+         cache_folder=None, cache_budget_mb=None, output_format="csv", store_folder=STORE_FOLDER, out_of_core=None,
+         subsample=None, inner_folds=None):
+    os.makedirs(output_model_dir, exist_ok=True)
+    os.makedirs(output_pred_dir, exist_ok=True)
+
+    sizes = celltype_memory_mb(h5ad_path) if os.path.exists(h5ad_path) else {}
+    if out_of_core is not None and out_of_core.get("memory_budget_mb") is not None:
+        sizes = {cell_type: min(size, out_of_core["memory_budget_mb"]) for cell_type, size in sizes.items()}
+    units = [WorkUnit("AIDA", cell_type, (cell_type,), sizes.get(cell_type, 0.0)) for cell_type in cell_types]
 
-        print(f"Saved models and predictions for {cell_type}")
+    task = partial(train_unit, h5ad_path=h5ad_path, output_model_dir=output_model_dir,
+                   output_pred_dir=output_pred_dir, shard_dir=shard_dir,
+                   imputation_folder=imputation_folder, compiled_folder=compiled_folder,
+                   alphas=alphas, l1_ratios=l1_ratios, fold_jobs=fold_jobs,
+                   cache_folder=cache_folder, cache_budget_mb=cache_budget_mb,
+                   output_format=output_format, store_folder=store_folder, out_of_core=out_of_core,
+                   subsample=subsample, inner_folds=inner_folds)
+    return run_units(task, units, workers, memory_budget_mb, retries)
 
 if __name__ == "__main__":
-    h5ad_path = "../data/AIDA.h5ad"
-    output_model_dir = "../models/"
-    output_pred_dir = "../predictions/"
-    cell_types = [f.replace("Impute_avg_", "").replace(".csv", "") for f in os.listdir("../data_for_imputation") if f.endswith(".csv")]
-    main(h5ad_path, output_model_dir, output_pred_dir, cell_types)
+    parser = argparse.ArgumentParser(description="Train ElasticNet aging clocks per cell type")
+    parser.add_argument("--data_path", type=str, default="../data/AIDA.h5ad", help="Path to the input .h5ad file")
+    parser.add_argument("--shard_dir", type=str, default=None, help="Folder with per-cell-type shards written by sharding.py")
+    parser.add_argument("--imputation_folder", type=str, default="../data_for_imputation/", help="Folder containing imputation files")
+    parser.add_argument("--model_folder", type=str, default="../models/", help="Folder to save trained models")
+    parser.add_argument("--output_folder", type=str, default="../predictions/", help="Folder to save predictions")
+    parser.add_argument("--compiled_folder", type=str, default="../compiled_clocks/", help="Folder to save compiled clocks")
+    parser.add_argument("--alphas", type=float, nargs="+", default=[1.0], help="ElasticNet alphas to search")
+    parser.add_argument("--l1_ratios", type=float, nargs="+", default=[0.5], help="ElasticNet l1_ratios to search")
+    parser.add_argument("--fold_jobs", type=int, default=1, help="Number of folds fitted in parallel")
+    parser.add_argument("--inner_folds", type=int, default=None, help="Select the grid point by an inner donor CV with this many folds instead of one validation split (about inner_folds + 1 fits per fold)")
+    parser.add_argument("--cache_folder", type=str, default=None, help="Folder to cache normalized expression")
+    parser.add_argument("--cache_budget_mb", type=float, default=None, help="Disk budget of the normalization cache")
+    parser.add_argument("--output_format", choices=["csv", "parquet", "both"], default="csv", help="Save held-out predictions as CSV, to the Parquet store or both")
+    parser.add_argument("--store_folder", type=str, default=STORE_FOLDER, help="Root of the Parquet prediction store")
+    parser.add_argument("--out_of_core", action="store_true", help="Stream cells in chunks and fit an approximate SGD elastic net instead of loading each cell type")
+    parser.add_argument("--epochs", type=int, default=20, help="Maximum passes over the data with --out_of_core")
+    parser.add_argument("--tol", type=float, default=0.02, help="Relative coefficient change that ends --out_of_core training")
+    parser.add_argument("--chunk_size", type=int, default=50000, help="Cells per chunk with --out_of_core")
+    parser.add_argument("--chunk_memory_mb", type=float, default=None, help="Memory budget of a chunk with --out_of_core")
+    parser.add_argument("--subsample", choices=STRATEGIES, default=None, help="Fit on a donor-stratified subsample of the training cells")
+    parser.add_argument("--max_cells_per_donor", type=int, default=200, help="Cells kept per donor with --subsample donor_cap")
+    parser.add_argument("--coreset_fraction", type=float, default=0.25, help="Fraction of every donor's cells kept with --subsample coreset")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--pool_memory_mb", type=float, default=None, help="Memory budget shared by all worker processes")
+    parser.add_argument("--retries", type=int, default=1, help="Number of retries for a failed cell type")
+    parser.add_argument("--profile", action="store_true", help="Write per-stage timings to metrics.jsonl next to the predictions")
+    parser.add_argument("--trace_memory", action="store_true", help="Also track peak Python allocations per stage")
+    parser.add_argument("--cprofile_dir", type=str, default=None, help="Folder for cProfile dumps of every fit")
+
+    args = parser.parse_args()
+
+    metrics_path = os.path.join(args.output_folder, "metrics.jsonl")
+    if args.profile:
+        enable(metrics_path, args.trace_memory, args.cprofile_dir)
+
+    out_of_core = None
+    if args.out_of_core:
+        out_of_core = {"epochs": args.epochs, "tol": args.tol, "chunk_size": args.chunk_size,
+                       "memory_budget_mb": args.chunk_memory_mb}
+    subsample = None
+    if args.subsample is not None:
+        subsample = {"strategy": args.subsample, "max_cells_per_donor": args.max_cells_per_donor,
+                     "fraction": args.coreset_fraction}
+
+    cell_types = [f.replace("Impute_avg_", "").replace(".csv", "") for f in os.listdir(args.imputation_folder) if f.endswith(".csv")]
+    failures = main(args.data_path, args.model_folder, args.output_folder, cell_types, args.shard_dir,
+                    args.imputation_folder, args.compiled_folder, args.workers, args.pool_memory_mb, args.retries,
+                    args.alphas, args.l1_ratios, args.fold_jobs, args.cache_folder, args.cache_budget_mb,
+                    args.output_format, args.store_folder, out_of_core, subsample, args.inner_folds)
+
+    if args.profile:
+        print_summary(metrics_path)
+    check_failures(failures)
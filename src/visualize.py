@@ -1,79 +1,152 @@
 import os
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from prediction_store import STORE_FOLDER, CV_DATASET, SOURCES, read_predictions, partition_path
+from figures import FigureJob, render_figures, frame_digest, density_scatter
+from manifest import file_digest, code_version
 
 SUMMARY_PATH = "../results/summary_performance.csv"
 PREDICTIONS_FOLDER = "../predictions/"
 OUTPUT_FOLDER = "../figures/"
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-summary_df = pd.read_csv(SUMMARY_PATH)
-
-# === Plot b: Cell counts per cell type ===
-plt.figure(figsize=(10, 12))
-sorted_df = summary_df.sort_values("n_cells", ascending=True)
-ax = sns.barplot(
-    data=summary_df.sort_values("n_cells", ascending=True),
-    x="n_cells", y="cell_type", palette="Blues_d", hue="cell_type", legend=False
-)
-for i, count in enumerate(sorted_df["n_cells"]):
-    ax.text(count + 1000, i, f"{count:,}", va='center', ha='left', fontsize=8)
-plt.title("Number of Cells per Cell Type")
-plt.xlabel("Cell Count")
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_FOLDER, "cell_counts.png"))
-plt.close()
-
-# === Plot d: Pearson Correlation per Cell Type ===
-plt.figure(figsize=(10, 12))
-sorted_df = summary_df.sort_values("Pearson", ascending=False)
-ax = sns.barplot(
-    data=sorted_df,
-    x="Pearson", y="cell_type", palette="Blues_d", hue="cell_type", legend=False
-)
-ax.set_xlim(-0.2, 0.65)
-for i, (pearson, mae) in enumerate(zip(sorted_df["Pearson"], sorted_df["MAE"])):
-    ax.text(pearson + 0.005, i, f"{pearson:.2f}", va='center', ha='left', fontsize=8, color="black")
-    ax.text(0.62, i, f"MAE = {mae:.2f}", va='center', ha='left', fontsize=8, color="gray")
-
-plt.title("Pearson Correlation per Cell Type")
-plt.xlabel("Pearson r")
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_FOLDER, "pearson_per_cell_type.png"))
-plt.close()
-
-# === Plot 2: MAE per Cell Type ===
-plt.figure(figsize=(10, 12))
-sorted_df = summary_df.sort_values("MAE", ascending=True)
-ax = sns.barplot(
-    data=summary_df.sort_values("MAE", ascending=True),
-    x="MAE", y="cell_type", palette="Reds_r", hue="cell_type", legend=False
-)
-for i, mae in enumerate(sorted_df["MAE"]):
-    ax.text(mae + 0.05, i, f"{mae:.2f}", va='center', ha='left', fontsize=8)
-plt.title("Mean Absolute Error (MAE) per Cell Type")
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_FOLDER, "mae_per_cell_type.png"))
-plt.close()
-
-# === Plot e: Predicted vs. True Age for Top 9 cell types ===
-top_n = summary_df.sort_values("Pearson", ascending=False).head(9)
-fig, axs = plt.subplots(3, 3, figsize=(16, 14))
-axs = axs.flatten()
-
-for i, row in enumerate(top_n.itertuples()):
-    df = pd.read_csv(os.path.join(PREDICTIONS_FOLDER, f"{row.cell_type}_predictions.csv"))
-    sns.regplot(ax=axs[i], data=df, x="true_age", y="predicted_age",
-                scatter_kws={"alpha": 0.3, "s": 10}, line_kws={"color": "blue"})
-    axs[i].set_title(
-        f"{row.cell_type}\nMAE={row.MAE:.2f}, r={row.Pearson:.2f}, n={row.n_cells}"
+
+def draw_cell_counts(path, summary_df):
+    # === Plot b: Cell counts per cell type ===
+    plt.figure(figsize=(10, 12))
+    sorted_df = summary_df.sort_values("n_cells", ascending=True)
+    ax = sns.barplot(
+        data=summary_df.sort_values("n_cells", ascending=True),
+        x="n_cells", y="cell_type", palette="Blues_d", hue="cell_type", legend=False
+    )
+    for i, count in enumerate(sorted_df["n_cells"]):
+        ax.text(count + 1000, i, f"{count:,}", va='center', ha='left', fontsize=8)
+    plt.title("Number of Cells per Cell Type")
+    plt.xlabel("Cell Count")
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def draw_pearson(path, summary_df):
+    # === Plot d: Pearson Correlation per Cell Type ===
+    plt.figure(figsize=(10, 12))
+    sorted_df = summary_df.sort_values("Pearson", ascending=False)
+    ax = sns.barplot(
+        data=sorted_df,
+        x="Pearson", y="cell_type", palette="Blues_d", hue="cell_type", legend=False
     )
-    axs[i].set_xlim(20, 65)
-    axs[i].set_ylim(20, 65)
-    axs[i].set_xlabel("True Age")
-    axs[i].set_ylabel("Predicted Age")
-
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_FOLDER, "scatter_top9_celltypes.png"))
-plt.close()
+    ax.set_xlim(-0.2, 0.65)
+    for i, (pearson, mae) in enumerate(zip(sorted_df["Pearson"], sorted_df["MAE"])):
+        ax.text(pearson + 0.005, i, f"{pearson:.2f}", va='center', ha='left', fontsize=8, color="black")
+        ax.text(0.62, i, f"MAE = {mae:.2f}", va='center', ha='left', fontsize=8, color="gray")
+
+    plt.title("Pearson Correlation per Cell Type")
+    plt.xlabel("Pearson r")
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def draw_mae(path, summary_df):
+    # === Plot 2: MAE per Cell Type ===
+    plt.figure(figsize=(10, 12))
+    sorted_df = summary_df.sort_values("MAE", ascending=True)
+    ax = sns.barplot(
+        data=summary_df.sort_values("MAE", ascending=True),
+        x="MAE", y="cell_type", palette="Reds_r", hue="cell_type", legend=False
+    )
+    for i, mae in enumerate(sorted_df["MAE"]):
+        ax.text(mae + 0.05, i, f"{mae:.2f}", va='center', ha='left', fontsize=8)
+    plt.title("Mean Absolute Error (MAE) per Cell Type")
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def draw_top_scatter(path, top_n, sources, store_folder=STORE_FOLDER):
+    # === Plot e: Predicted vs. True Age for Top 9 cell types ===
+    fig, axs = plt.subplots(3, 3, figsize=(16, 14))
+    axs = axs.flatten()
+
+    for i, row in enumerate(top_n.itertuples()):
+        if sources[row.cell_type] is None:
+            df = read_predictions(store_folder, CV_DATASET, row.cell_type, columns=["true_age", "predicted_age"])
+        else:
+            df = pd.read_csv(sources[row.cell_type], usecols=["true_age", "predicted_age"])
+        density_scatter(axs[i], df["true_age"], df["predicted_age"])
+        axs[i].set_title(
+            f"{row.cell_type}\nMAE={row.MAE:.2f}, r={row.Pearson:.2f}, n={row.n_cells}"
+        )
+        axs[i].set_xlim(20, 65)
+        axs[i].set_ylim(20, 65)
+        axs[i].set_xlabel("True Age")
+        axs[i].set_ylabel("Predicted Age")
+
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+def figure_jobs(summary_df, predictions_folder=PREDICTIONS_FOLDER, output_folder=OUTPUT_FOLDER,
+                store_folder=STORE_FOLDER, source="csv"):
+    """
+    The AIDA figures as FigureJobs. Bar charts depend on the summary table; the scatter
+    panels on the summary rows of the nine best cell types and on their prediction files
+    (or store partitions, with source='parquet'), digested without being read.
+    """
+    if source not in SOURCES:
+        raise ValueError(f"Unknown prediction source: {source}")
+    code = code_version(["visualize", "figures"])
+    summary_digest = frame_digest(summary_df)
+
+    top_n = summary_df.sort_values("Pearson", ascending=False).head(9)
+    sources = {cell_type: None if source == "parquet" else os.path.join(predictions_folder, f"{cell_type}_predictions.csv")
+               for cell_type in top_n["cell_type"]}
+    predictions = {cell_type: file_digest(partition_path(store_folder, CV_DATASET, cell_type) if path is None else path)
+                   for cell_type, path in sources.items()}
+
+    return [
+        FigureJob(os.path.join(output_folder, "cell_counts.png"), draw_cell_counts,
+                  {"summary_df": summary_df}, {"summary": summary_digest, "code": code}),
+        FigureJob(os.path.join(output_folder, "pearson_per_cell_type.png"), draw_pearson,
+                  {"summary_df": summary_df}, {"summary": summary_digest, "code": code}),
+        FigureJob(os.path.join(output_folder, "mae_per_cell_type.png"), draw_mae,
+                  {"summary_df": summary_df}, {"summary": summary_digest, "code": code}),
+        FigureJob(os.path.join(output_folder, "scatter_top9_celltypes.png"), draw_top_scatter,
+                  {"top_n": top_n, "sources": sources, "store_folder": store_folder},
+                  {"top": frame_digest(top_n), "predictions": predictions, "code": code}),
+    ]
+
+def plot_summary(summary_df=None, summary_path=SUMMARY_PATH, predictions_folder=PREDICTIONS_FOLDER,
+                 output_folder=OUTPUT_FOLDER, store_folder=STORE_FOLDER, workers=1, force=False, source="csv"):
+    """
+    Draw the AIDA figures: cell counts, Pearson and MAE per cell type, and predicted vs.
+    true age for the nine best cell types. Figures whose inputs are unchanged are skipped.
+
+    Parameters:
+        summary_df (pd.DataFrame): Output of evaluate.summarize; read from summary_path when None.
+        summary_path (str): Path of the summary table.
+        predictions_folder (str): Folder with the held-out prediction CSVs.
+        output_folder (str): Folder to save the figures.
+        store_folder (str): Root of the Parquet prediction store.
+        workers (int): Number of figures rendered at once.
+        force (bool): Redraw figures whose inputs are unchanged.
+        source (str): 'csv' or 'parquet', the format the predictions were written in.
+    """
+    if summary_df is None:
+        summary_df = pd.read_csv(summary_path)
+    os.makedirs(output_folder, exist_ok=True)
+    return render_figures(figure_jobs(summary_df, predictions_folder, output_folder, store_folder, source),
+                          workers, force)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw the AIDA figures")
+    parser.add_argument("--summary_path", type=str, default=SUMMARY_PATH, help="Path of the summary table")
+    parser.add_argument("--predictions_folder", type=str, default=PREDICTIONS_FOLDER, help="Folder with the held-out prediction CSVs")
+    parser.add_argument("--output_folder", type=str, default=OUTPUT_FOLDER, help="Folder to save the figures")
+    parser.add_argument("--store_folder", type=str, default=STORE_FOLDER, help="Root of the Parquet prediction store")
+    parser.add_argument("--source", choices=SOURCES, default="csv", help="Read the predictions from the CSV files or the Parquet store")
+    parser.add_argument("--workers", type=int, default=4, help="Number of figures rendered at once")
+    parser.add_argument("--force", action="store_true", help="Redraw figures whose inputs are unchanged")
+
+    args = parser.parse_args()
+
+    plot_summary(None, args.summary_path, args.predictions_folder, args.output_folder, args.store_folder,
+                 args.workers, args.force, args.source)
@@ -2,12 +2,12 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
-
-sns.set(style="whitegrid")
+import argparse
+from figures import FigureJob, render_figures, frame_digest
+from manifest import code_version
 
 SUMMARY_DIR = "../results"
 SAVE_DIR = "../figures_external"
-os.makedirs(SAVE_DIR, exist_ok=True)
 
 datasets = {
     "Yoshida": {
@@ -46,40 +46,77 @@ datasets = {
     }
 }
 
-for name, meta in datasets.items():
-    path = os.path.join(SUMMARY_DIR, meta["file"])
-    df = pd.read_csv(path)
-    df = df.dropna(subset=[meta["metric"]])
-    df_sorted = df.sort_values(by=meta["metric"], ascending=False)
+def draw_dataset(path, df, name, meta):
+    """Correlation bar chart of one external dataset, from its summary table."""
+    with sns.axes_style("whitegrid"), sns.plotting_context("notebook"):
+        df = df.dropna(subset=[meta["metric"]])
+        df_sorted = df.sort_values(by=meta["metric"], ascending=False)
+
+        width = 10 if name == "Liu" else 8
+        plt.figure(figsize=(width, max(6, len(df_sorted) * 0.3)))
+        ax = sns.barplot(
+            y="cell_type",
+            x=meta["metric"],
+            hue="cell_type",
+            data=df_sorted,
+            palette="coolwarm" if "spearman" in meta["metric"] else "crest",
+            legend=False
+        )
+
+        ax.set_title(meta["title"], fontsize=14, loc="left")
+        ax.set_xlabel(meta["xlabel"], fontsize=12)
+        ax.set_ylabel("")
+
+        for i, (val, cell_type) in enumerate(zip(df_sorted[meta["metric"]], df_sorted["cell_type"])):
+            ax.text(val + 0.01 if val >= 0 else val - 0.01, i,
+                    f"{val:.2f}", va="center", ha="left" if val >= 0 else "right", fontsize=9)
+
+            if "mae" in meta:
+                mae_val = df_sorted.iloc[i][meta["mae"]]
+                ax.text(ax.get_xlim()[1] + 0.02, i, f"MAE = {mae_val:.1f}",
+                        va="center", ha="left", fontsize=9, color="black")
+
+        if name == "Liu":
+            ax.set_xlim(ax.get_xlim()[0], ax.get_xlim()[1] + 0.1)
+
+        plt.tight_layout()
+        plt.savefig(path, dpi=300, bbox_inches='tight')
+        plt.close()
 
-    width = 10 if name == "Liu" else 8
-    plt.figure(figsize=(width, max(6, len(df_sorted) * 0.3)))
-    ax = sns.barplot(
-        y="cell_type",
-        x=meta["metric"],
-        hue="cell_type",
-        data=df_sorted,
-        palette="coolwarm" if "spearman" in meta["metric"] else "crest",
-        legend=False
-    )
+def plot_external(summaries=None, summary_dir=SUMMARY_DIR, save_dir=SAVE_DIR, workers=1, force=False):
+    """
+    Draw one correlation bar chart per external dataset, in parallel, skipping datasets
+    whose summary is unchanged since their figure was drawn.
 
-    ax.set_title(meta["title"], fontsize=14, loc="left")
-    ax.set_xlabel(meta["xlabel"], fontsize=12)
-    ax.set_ylabel("")
+    Parameters:
+        summaries (dict): Optional summary DataFrames by dataset name, as returned by
+            evaluate_external.summarize_dataset; missing datasets are read from summary_dir.
+        summary_dir (str): Folder with the {dataset}_summary.csv files.
+        save_dir (str): Folder to save the figures.
+        workers (int): Number of figures rendered at once.
+        force (bool): Redraw figures whose summaries are unchanged.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    code = code_version(["visualize_external", "figures"])
 
-    for i, (val, cell_type) in enumerate(zip(df_sorted[meta["metric"]], df_sorted["cell_type"])):
-        ax.text(val + 0.01 if val >= 0 else val - 0.01, i,
-                f"{val:.2f}", va="center", ha="left" if val >= 0 else "right", fontsize=9)
+    jobs = []
+    for name, meta in datasets.items():
+        if summaries is not None and name in summaries:
+            df = summaries[name]
+        else:
+            df = pd.read_csv(os.path.join(summary_dir, meta["file"]))
+        jobs.append(FigureJob(os.path.join(save_dir, meta["filename"]), draw_dataset,
+                              {"df": df, "name": name, "meta": meta},
+                              {"summary": frame_digest(df), "meta": meta, "code": code}))
+    return render_figures(jobs, workers, force)
 
-        if "mae" in meta:
-            mae_val = df_sorted.iloc[i][meta["mae"]]
-            ax.text(ax.get_xlim()[1] + 0.02, i, f"MAE = {mae_val:.1f}",
-                    va="center", ha="left", fontsize=9, color="black")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw the external dataset figures")
+    parser.add_argument("--summary_dir", type=str, default=SUMMARY_DIR, help="Folder with the {dataset}_summary.csv files")
+    parser.add_argument("--save_dir", type=str, default=SAVE_DIR, help="Folder to save the figures")
+    parser.add_argument("--workers", type=int, default=4, help="Number of figures rendered at once")
+    parser.add_argument("--force", action="store_true", help="Redraw figures whose summaries are unchanged")
 
-    if name == "Liu":
-        ax.set_xlim(ax.get_xlim()[0], ax.get_xlim()[1] + 0.1)
+    args = parser.parse_args()
 
-    plt.tight_layout()
-    save_path = os.path.join(SAVE_DIR, meta["filename"])
-    plt.savefig(save_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    plot_external(None, args.summary_dir, args.save_dir, args.workers, args.force)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+# The pipeline modules are flat scripts in src/, imported by name as the scripts import each other.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from collections import namedtuple
+import pytest
+import anndata as ad
+from synthetic_data import make_dataset, make_clocks
+
+SyntheticData = namedtuple("SyntheticData", ["data_path", "model_folder", "imputation_folder", "var_names", "cell_types"])
+
+@pytest.fixture(scope="session")
+def synthetic(tmp_path_factory):
+    """A small synthetic AIDA-like dataset with fake clocks for every cell type, some of whose genes it lacks."""
+    root = tmp_path_factory.mktemp("synthetic")
+    data_path = str(root / "data" / "AIDA.h5ad")
+    var_names = make_dataset(data_path, n_cells=600, n_genes=300, density=0.1, n_cell_types=2, n_donors=12, seed=0)
+    cell_types = list(ad.read_h5ad(data_path, backed="r").obs["cell_type"].cat.categories)
+    model_folder, imputation_folder = str(root / "models"), str(root / "data_for_imputation")
+    make_clocks(var_names, cell_types, model_folder, imputation_folder, n_clock_genes=60, missing_fraction=0.2)
+    return SyntheticData(data_path, model_folder, imputation_folder, var_names, cell_types)
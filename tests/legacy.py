@@ -0,0 +1,111 @@
+"""
+Reference implementations from before the sparse rewrite, taken from the baseline
+scripts, kept so the tests can check that the current code gives the same results.
+"""
+import re
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import KFold
+
+def log_norm(X):
+    row_sums = np.array(X.sum(axis=1)).flatten()
+    row_sums[row_sums == 0] = 1e-12
+    X = X.multiply(1 / row_sums[:, None]) * 10000
+    return X.log1p()
+
+def apply_models(df, models, impute):
+    """The per-fold DataFrame loop of apply_model, averaged per cell_id."""
+    results = []
+    for i in range(len(models)):
+        model = models.iloc[i].dropna()
+        model_coeff = model.drop("intercept")
+        model_intercept = model["intercept"]
+
+        model_genes = model_coeff.index
+        available_genes = df.columns.intersection(model_genes)
+        missing_genes = model_genes.difference(df.columns)
+
+        input_data = df[available_genes].copy()
+
+        if not missing_genes.empty:
+            imputed_values = {}
+            for gene in missing_genes:
+                if gene in impute.columns:
+                    imputed_values[gene] = impute[gene].values[0]
+                else:
+                    imputed_values[gene] = 0.0
+
+            imputed_df = pd.DataFrame(
+                {gene: [value] * len(input_data) for gene, value in imputed_values.items()},
+                index=input_data.index
+            )
+
+            input_data = pd.concat([input_data, imputed_df], axis=1)
+
+        input_data = input_data[model_genes]
+
+        preds = input_data.dot(model_coeff.values) + model_intercept
+
+        results.append(pd.DataFrame({
+            "cell_id": df["cell_id"],
+            "predicted_age": preds,
+        }))
+
+    return pd.concat(results).groupby("cell_id").agg({"predicted_age": "mean"})
+
+def donor_splits(df, n_folds=5):
+    """Test cell_ids of every fold of train_and_predict_by_fold."""
+    donors = df["donor_id"].unique()
+    kf = KFold(n_splits=n_folds, shuffle=True, random_state=42)
+    for train_idx, test_idx in kf.split(donors):
+        yield df["cell_id"][df["donor_id"].isin(donors[test_idx])].to_numpy()
+
+def map_yoshida_age(dev_stage):
+    if pd.isnull(dev_stage):
+        return np.nan
+    val = str(dev_stage).lower().strip()
+    if "newborn" in val:
+        return "newborn human stage"
+    if "infant" in val:
+        return "infant stage"
+    if "child" in val and ("2-5" in val or "1-4" in val):
+        return "2-5 year-old child stage"
+    if "child" in val and ("6-12" in val or "5-14" in val or "juvenile" in val):
+        return "6-12 year-old child stage"
+    if "child" in val or "pediatric" in val:
+        return "6-12 year-old child stage"
+    if "adolescent" in val:
+        return "adolescent stage"
+    if "adult" in val:
+        return "human adult stage"
+    if "late adult" in val or "aged" in val or "elderly" in val:
+        return "human aged stage"
+    try:
+        num = float(val.split("-")[0])
+        if num < 65:
+            return "human adult stage"
+        else:
+            return "human aged stage"
+    except Exception:
+        return val
+
+def map_stephenson_age(stage):
+    if pd.isnull(stage):
+        return np.nan
+    s = str(stage).lower().strip()
+
+    if "decade stage" in s:
+        return s
+
+    m = re.match(r"(\d+)-year-old stage", s)
+    if m:
+        age = int(m.group(1))
+        decade = (age // 10) + 1
+        if decade > 10:
+            decade = 10
+        ordinals = {3: "third", 4: "fourth", 5: "fifth", 6: "sixth", 7: "seventh",
+                    8: "eighth", 9: "ninth", 10: "tenth"}
+        decade_str = ordinals.get(decade, f"{decade}th")
+        return f"{decade_str} decade stage"
+
+    return stage
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import legacy
+from age_parsing import parse_ages
+
+YOSHIDA = ["newborn human stage", "infant stage", "2-5 year-old child stage", "1-4 year-old child stage",
+           "6-12 year-old child stage", "juvenile stage", "pediatric stage", "adolescent stage",
+           "human adult stage", "human late adult stage", "human aged stage", "40-year-old human stage",
+           "70-year-old human stage", "unknown", None]
+STEPHENSON = ["third decade stage", "Fifth decade stage", "25-year-old stage", "38-year-old stage",
+              "64-year-old stage", "99-year-old stage", "104-year-old stage", "unknown", None]
+
+def as_objects(values):
+    return np.array([np.nan if pd.isnull(v) else v for v in values], dtype=object)
+
+def test_numeric_ages_match_legacy_split():
+    stages = pd.Categorical(["19-year-old human stage", "69-year-old human stage", "19-year-old human stage", "80"])
+    parsed = parse_ages("AIDA", stages)
+    expected = pd.Series(stages).astype(str).str.split("-", expand=True)[0].astype(int)
+    np.testing.assert_array_equal(parsed["age"], expected)
+    np.testing.assert_array_equal(parsed["age_code"], expected)
+
+def test_yoshida_matches_map_yoshida_age():
+    stages = YOSHIDA * 3
+    parsed = parse_ages("Yoshida_2022", pd.Categorical(stages))
+    expected = as_objects([legacy.map_yoshida_age(stage) for stage in stages])
+    pd.testing.assert_series_equal(parsed["age"].astype(object), pd.Series(expected, name="age"))
+
+def test_stephenson_matches_map_stephenson_age():
+    parsed = parse_ages("Stephenson", pd.Categorical(STEPHENSON))
+    expected = as_objects([legacy.map_stephenson_age(stage) for stage in STEPHENSON])
+    pd.testing.assert_series_equal(parsed["age"].astype(object), pd.Series(expected, name="age"))
+
+def test_stage_codes_follow_order():
+    parsed = parse_ages("Stephenson", ["64-year-old stage", "25-year-old stage", "unknown", None])
+    assert parsed["age_code"][1] < parsed["age_code"][0] < parsed["age_code"][2]
+    assert np.isnan(parsed["age_code"][3])
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from aggregation import DonorAggregator, factorize_donors, UNKNOWN_DONOR
+from imputation import donor_means, donor_sums
+
+def test_factorize_donors_groups_missing_ids():
+    codes, donors = factorize_donors(np.array(["a", np.nan, "b", None], dtype=object))
+    assert list(donors) == ["a", "b", UNKNOWN_DONOR]
+    assert list(codes) == [0, 2, 1, 2]
+
+def test_factorize_donors_reuses_existing_unknown():
+    codes, donors = factorize_donors(np.array([UNKNOWN_DONOR, "a", np.nan], dtype=object))
+    assert list(donors) == [UNKNOWN_DONOR, "a"]
+    assert list(codes) == [0, 1, 0]
+
+def test_aggregator_keeps_missing_donors_apart():
+    aggregator = DonorAggregator()
+    aggregator.update(np.array(["a", np.nan], dtype=object), [10.0, 50.0], ["30", "70"])
+    aggregator.update(np.array([np.nan, "a", "b"], dtype=object), [60.0, 20.0, 40.0], ["70", "30", "50"])
+    summary = aggregator.summary().set_index("donor_id")
+
+    assert summary.loc["a", "predicted_age"] == 15.0
+    assert summary.loc["a", "age"] == "30"
+    assert summary.loc[UNKNOWN_DONOR, "predicted_age"] == 55.0
+    assert summary.loc[UNKNOWN_DONOR, "n_cells"] == 2
+    assert summary.loc["b", "predicted_age"] == 40.0
+
+def test_aggregator_matches_groupby():
+    rng = np.random.default_rng(0)
+    donors = rng.choice(["a", "b", "c"], 200)
+    predictions = rng.normal(50, 10, 200)
+    aggregator = DonorAggregator()
+    for start in range(0, 200, 37):
+        aggregator.update(donors[start:start + 37], predictions[start:start + 37])
+    summary = aggregator.summary().set_index("donor_id")
+
+    expected = pd.Series(predictions).groupby(donors).agg(["mean", "std", "count"])
+    np.testing.assert_allclose(summary.loc[expected.index, "predicted_age"], expected["mean"])
+    np.testing.assert_allclose(summary.loc[expected.index, "predicted_age_sd"], expected["std"])
+    np.testing.assert_array_equal(summary.loc[expected.index, "n_cells"], expected["count"])
+
+def test_donor_means_with_missing_donors():
+    offsets = np.array([[1.0], [3.0], [5.0], [7.0]])
+    donors = np.array(["a", np.nan, "a", None], dtype=object)
+    np.testing.assert_allclose(donor_means(offsets, donors).ravel(), [3.0, 5.0, 3.0, 5.0])
+
+def test_donor_means_do_not_depend_on_chunks():
+    rng = np.random.default_rng(1)
+    offsets = rng.normal(size=(100, 3))
+    donors = rng.choice(["a", "b", "c", "d"], 100)
+    totals = {}
+    for start in range(0, 100, 30):
+        donor_sums(offsets[start:start + 30], donors[start:start + 30], totals)
+    chunked = np.vstack([donor_means(offsets[start:start + 30], donors[start:start + 30], totals)
+                         for start in range(0, 100, 30)])
+    np.testing.assert_allclose(chunked, donor_means(offsets, donors))
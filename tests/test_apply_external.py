@@ -0,0 +1,49 @@
+import os
+import anndata as ad
+import pandas as pd
+import pytest
+import apply_external_models as external
+from scheduler import WorkUnit
+
+@pytest.fixture
+def folders(synthetic, tmp_path, monkeypatch):
+    """Point apply_external_models at the synthetic dataset, as the 'AIDA' external dataset."""
+    monkeypatch.setattr(external, "DATA_FOLDER", os.path.dirname(synthetic.data_path))
+    monkeypatch.setattr(external, "MODEL_FOLDER", synthetic.model_folder)
+    monkeypatch.setattr(external, "IMPUTE_FOLDER", synthetic.imputation_folder)
+    monkeypatch.setattr(external, "COMPILED_FOLDER", str(tmp_path / "compiled"))
+    monkeypatch.setattr(external, "ALIGNMENT_FOLDER", str(tmp_path / "alignments"))
+    monkeypatch.setattr(external, "OUTPUT_FOLDER", str(tmp_path / "predictions"))
+    monkeypatch.setattr(external, "_open_datasets", {})
+    monkeypatch.setattr(external, "_clocks", {})
+    return tmp_path
+
+def predictions(folders, cell_type):
+    return pd.read_csv(folders / "predictions" / "AIDA" / f"{cell_type.replace(' ', '_')}.csv")
+
+def test_cache_hit_does_not_open_the_dataset(synthetic, folders, monkeypatch):
+    cell_type = synthetic.cell_types[0]
+    unit = WorkUnit("AIDA", cell_type, (cell_type,), 0.0)
+    cache_folder = str(folders / "cache")
+    external.process_unit(unit, cache_folder=cache_folder)
+    expected = predictions(folders, cell_type)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the dataset was opened on a cache hit")
+
+    monkeypatch.setattr(external, "_open_datasets", {})
+    monkeypatch.setattr(ad, "read_h5ad", fail)
+    external.process_unit(unit, cache_folder=cache_folder)
+    pd.testing.assert_frame_equal(predictions(folders, cell_type), expected)
+
+@pytest.mark.parametrize("options", [{"chunk_size": 50}, {"memory_budget_mb": 0.05}, {"chunk_size": 50, "gene_subset": True}])
+def test_streamed_predictions_match_unchunked(synthetic, folders, options):
+    cell_type = synthetic.cell_types[0]
+    unit = WorkUnit("AIDA", cell_type, (cell_type,), 0.0)
+    external.process_unit(unit)
+    expected = predictions(folders, cell_type)
+
+    external.process_unit(unit, **options)
+    result = predictions(folders, cell_type)
+    pd.testing.assert_frame_equal(result.drop(columns="predicted_age"), expected.drop(columns="predicted_age"))
+    pd.testing.assert_series_equal(result["predicted_age"], expected["predicted_age"], rtol=1e-5)
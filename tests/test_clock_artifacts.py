@@ -0,0 +1,64 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from scoring import stack_models
+from clock_artifacts import compile_clock, get_clock, artifact_path, source_paths
+
+def copy_clock(synthetic, tmp_path, clock):
+    """Copy the CSVs of a clock, so a test can change them."""
+    model_folder, imputation_folder = tmp_path / "models", tmp_path / "data_for_imputation"
+    model_folder.mkdir()
+    imputation_folder.mkdir()
+    for source, folder in zip(source_paths(clock, synthetic.model_folder, synthetic.imputation_folder),
+                              (model_folder, imputation_folder)):
+        shutil.copy(source, folder)
+    return str(model_folder), str(imputation_folder), str(tmp_path / "compiled")
+
+def assert_same_clock(loaded, expected):
+    assert list(loaded.genes) == list(expected.genes)
+    np.testing.assert_allclose(loaded.weights, expected.weights, rtol=1e-6)
+    np.testing.assert_allclose(loaded.intercepts, expected.intercepts)
+    np.testing.assert_allclose(loaded.impute, expected.impute, rtol=1e-6)
+
+def test_compiled_clock_matches_csvs(synthetic, tmp_path):
+    clock = synthetic.cell_types[0]
+    model_folder, imputation_folder, compiled_folder = copy_clock(synthetic, tmp_path, clock)
+    path = compile_clock(clock, model_folder, imputation_folder, compiled_folder)
+
+    assert os.listdir(compiled_folder) == [os.path.basename(path)]
+    expected = stack_models(*[pd.read_csv(p) for p in source_paths(clock, model_folder, imputation_folder)])
+    loaded = get_clock(clock, model_folder, imputation_folder, compiled_folder)
+    assert isinstance(loaded.weights, np.memmap)
+    assert_same_clock(loaded, expected)
+
+    # Recompiling replaces the artifact in place.
+    compile_clock(clock, model_folder, imputation_folder, compiled_folder)
+    assert os.listdir(compiled_folder) == [os.path.basename(path)]
+
+def test_incomplete_or_stale_artifact_is_ignored(synthetic, tmp_path):
+    clock = synthetic.cell_types[0]
+    model_folder, imputation_folder, compiled_folder = copy_clock(synthetic, tmp_path, clock)
+    compile_clock(clock, model_folder, imputation_folder, compiled_folder)
+
+    os.remove(os.path.join(artifact_path(compiled_folder, clock), "impute.npy"))
+    assert not isinstance(get_clock(clock, model_folder, imputation_folder, compiled_folder).weights, np.memmap)
+
+    compile_clock(clock, model_folder, imputation_folder, compiled_folder)
+    model_path, impute_path = source_paths(clock, model_folder, imputation_folder)
+    models = pd.read_csv(model_path)
+    models["intercept"] += 1.0
+    models.to_csv(model_path, index=False)
+
+    loaded = get_clock(clock, model_folder, imputation_folder, compiled_folder)
+    assert not isinstance(loaded.weights, np.memmap)
+    np.testing.assert_allclose(loaded.intercepts, models["intercept"])
+
+def test_clock_without_imputation_file_is_not_compiled(synthetic, tmp_path):
+    clock = synthetic.cell_types[0]
+    model_folder, imputation_folder, compiled_folder = copy_clock(synthetic, tmp_path, clock)
+    os.remove(source_paths(clock, model_folder, imputation_folder)[1])
+
+    assert compile_clock(clock, model_folder, imputation_folder, compiled_folder) is None
+    assert not os.path.exists(artifact_path(compiled_folder, clock))
+    assert get_clock(clock, model_folder, imputation_folder, compiled_folder) is None
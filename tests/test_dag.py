@@ -0,0 +1,56 @@
+import json
+import os
+import threading
+import pytest
+from dag import Stage, run_dag
+from config import load_config
+
+def test_stages_receive_upstream_results_in_order():
+    stages = [
+        Stage("total", lambda up: up["a"] + up["b"], ("a", "b")),
+        Stage("a", lambda up: 1),
+        Stage("b", lambda up: 2, ("a",)),
+    ]
+    results, failures = run_dag(stages, workers=3)
+    assert results == {"a": 1, "b": 2, "total": 3} and failures == {}
+
+def test_failures_skip_dependents_only():
+    def fail(up):
+        raise OSError("missing input")
+    stages = [Stage("broken", fail), Stage("after", lambda up: 1, ("broken",)),
+              Stage("independent", lambda up: 2)]
+    results, failures = run_dag(stages, workers=2)
+    assert results == {"independent": 2}
+    assert isinstance(failures["broken"], OSError) and set(failures) == {"broken", "after"}
+
+def test_shared_resources_never_run_together():
+    lock, active, overlaps = threading.Lock(), [], []
+    def stage(up):
+        with lock:
+            overlaps.append(len(active))
+            active.append(1)
+        threading.Event().wait(0.05)
+        with lock:
+            active.pop()
+    run_dag([Stage(name, stage, (), ("pool",)) for name in "abc"], workers=3)
+    assert overlaps == [0, 0, 0]
+
+@pytest.mark.parametrize("stages, workers", [
+    ([Stage("a", None, ("b",)), Stage("b", None, ("a",))], 1),
+    ([Stage("a", None, ("missing",))], 1),
+    ([Stage("a", None), Stage("a", None)], 1),
+    ([Stage("a", None)], 0),
+])
+def test_invalid_graphs_are_refused(stages, workers):
+    with pytest.raises(ValueError):
+        run_dag(stages, workers)
+
+def test_config_file_and_overrides_are_merged(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"paths": {"model_folder": "models"}, "train": {"alphas": [0.1, 1.0]}}))
+    config = load_config(str(path), {"workers": 4, "retries": None})
+
+    assert config["paths"]["model_folder"] == str(tmp_path / "models")
+    assert os.path.isabs(config["paths"]["aida_path"])
+    assert config["train"]["alphas"] == [0.1, 1.0] and config["train"]["l1_ratios"] == [0.5]
+    assert config["workers"] == 4 and config["retries"] == 1
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+import pytest
+from evaluate import summarize
+from metrics import grouped_metrics
+
+def test_summarize_reads_every_cell_type(tmp_path):
+    rng = np.random.default_rng(0)
+    folder = tmp_path / "predictions"
+    folder.mkdir()
+    frames = {}
+    for cell_type in ["naive B cell", "natural killer cell"]:
+        true_age = rng.integers(20, 80, 60).astype(float)
+        frames[cell_type] = pd.DataFrame({"cell_id": np.arange(60), "donor_id": rng.choice(list("abcdef"), 60),
+                                          "true_age": true_age, "predicted_age": true_age + rng.normal(0, 5, 60)})
+        frames[cell_type].to_csv(folder / f"{cell_type}_predictions.csv", index=False)
+
+    summary = summarize(str(folder), str(tmp_path / "results" / "summary.csv"), n_boot=20).set_index("cell_type")
+    assert sorted(summary.index) == sorted(frames)
+    for cell_type, df in frames.items():
+        expected = grouped_metrics(df["true_age"], df["predicted_age"], np.zeros(len(df))).iloc[0]
+        assert summary.loc[cell_type, "MAE"] == pytest.approx(expected["MAE"])
+        assert summary.loc[cell_type, "n_cells"] == 60
+    assert (tmp_path / "results" / "summary.csv").exists()
+
+def test_summarize_without_predictions_names_the_folder(tmp_path):
+    folder = tmp_path / "empty"
+    folder.mkdir()
+    with pytest.raises(FileNotFoundError, match=str(folder)):
+        summarize(str(folder), str(tmp_path / "summary.csv"), n_boot=0)
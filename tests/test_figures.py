@@ -0,0 +1,33 @@
+import os
+import json
+import pandas as pd
+from figures import FigureJob, render_figures, frame_digest, CACHE_FILE
+
+def draw_text(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+def make_jobs(folder, frames):
+    return [FigureJob(str(folder / f"{name}.txt"), draw_text, {"text": name}, {"frame": frame_digest(df)})
+            for name, df in frames.items()]
+
+def test_only_changed_figures_are_redrawn(tmp_path):
+    frames = {"a": pd.DataFrame({"x": [1, 2]}), "b": pd.DataFrame({"x": [3, 4]})}
+    assert len(render_figures(make_jobs(tmp_path, frames))) == 2
+    assert render_figures(make_jobs(tmp_path, frames)) == []
+
+    frames["b"] = pd.DataFrame({"x": [3, 5]})
+    assert render_figures(make_jobs(tmp_path, frames)) == [str(tmp_path / "b.txt")]
+
+    os.remove(tmp_path / "a.txt")
+    assert render_figures(make_jobs(tmp_path, frames)) == [str(tmp_path / "a.txt")]
+    assert len(render_figures(make_jobs(tmp_path, frames), force=True)) == 2
+    assert sorted(os.listdir(tmp_path)) == [CACHE_FILE, "a.txt", "b.txt"]
+
+def test_unreadable_cache_redraws_every_figure(tmp_path):
+    frames = {"a": pd.DataFrame({"x": [1, 2]})}
+    render_figures(make_jobs(tmp_path, frames))
+    (tmp_path / CACHE_FILE).write_text('{"a.txt": "trunc')
+
+    assert render_figures(make_jobs(tmp_path, frames)) == [str(tmp_path / "a.txt")]
+    assert set(json.loads((tmp_path / CACHE_FILE).read_text())) == {"a.txt"}
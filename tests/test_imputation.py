@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from preprocessing import load_celltype
+from scoring import stack_models, missing_offset, score_matrix
+from gene_alignment import build_alignment
+from imputation import STRATEGIES, reference_expression, impute_offsets, knn_offsets, donor_sums, sample_reference
+
+@pytest.fixture(scope="module")
+def setup(synthetic):
+    """A clock whose reference (training) data has every clock gene, scored on data that lacks some of them."""
+    cell_type = synthetic.cell_types[0]
+    reference = load_celltype(synthetic.data_path, cell_type, dtype=np.float32)
+    models = pd.read_csv(os.path.join(synthetic.model_folder, f"{cell_type}_models5.csv"))
+    impute = pd.read_csv(os.path.join(synthetic.imputation_folder, f"Impute_avg_{cell_type}.csv"))
+    clock = stack_models(models, impute)
+
+    present = clock.genes[clock.genes.isin(reference.var_names)]
+    dropped = present[:5]
+    keep = ~reference.var_names.isin(dropped)
+    X, var_names = reference.X[:, np.where(keep)[0]], reference.var_names[keep]
+    alignment = build_alignment(var_names, clock.genes)
+    expression = reference_expression(reference, clock.genes)
+    return clock, alignment, X, var_names, reference, expression
+
+def test_scalar_is_imputation_file_offset(setup):
+    clock, alignment, X, _, _, expression = setup
+    np.testing.assert_allclose(impute_offsets("scalar", X, clock, alignment), missing_offset(clock, alignment))
+    np.testing.assert_allclose(impute_offsets("scalar", X, clock, alignment, expression), missing_offset(clock, alignment))
+
+def test_celltype_mean_uses_reference_means(setup):
+    clock, alignment, X, _, _, expression = setup
+    values = expression[:, alignment.missing].astype(np.float64)
+    found = ~np.isnan(values).all(axis=0)
+    means = np.where(found, np.nanmean(np.where(found, values, 0.0), axis=0), clock.impute[alignment.missing])
+    offsets = impute_offsets("celltype_mean", X, clock, alignment, expression)
+    assert offsets.shape == (clock.weights.shape[1],)
+    np.testing.assert_allclose(offsets, means @ clock.weights[alignment.missing])
+
+def test_knn_with_one_neighbour_recovers_dropped_genes(setup):
+    clock, alignment, X, var_names, reference, expression = setup
+    offsets = knn_offsets(X, clock, alignment, expression, k=1)
+    assert offsets.shape == (X.shape[0], clock.weights.shape[1])
+
+    full = build_alignment(reference.var_names, clock.genes)
+    fold_preds, _ = score_matrix(X, var_names, clock, alignment, offsets)
+    expected, _ = score_matrix(reference.X, reference.var_names, clock, full)
+    duplicates = pd.DataFrame(np.round(expression[:, alignment.present], 4)).duplicated(keep=False).to_numpy()
+    np.testing.assert_allclose(fold_preds[~duplicates], expected[~duplicates], rtol=1e-4)
+
+def test_donor_mean_averages_knn_per_donor(setup):
+    clock, alignment, X, _, reference, expression = setup
+    donors = reference.obs["donor_id"].to_numpy()
+    knn = impute_offsets("knn", X, clock, alignment, expression)
+    offsets = impute_offsets("donor_mean", X, clock, alignment, expression, donors)
+    for donor in np.unique(donors):
+        rows = donors == donor
+        np.testing.assert_allclose(offsets[rows], np.broadcast_to(knn[rows].mean(axis=0), offsets[rows].shape))
+
+    totals = {}
+    for start in range(0, X.shape[0], 100):
+        donor_sums(knn[start:start + 100], donors[start:start + 100], totals)
+    chunk = slice(100, 200)
+    np.testing.assert_allclose(impute_offsets("donor_mean", X[chunk], clock, alignment, expression, donors[chunk],
+                                              donor_totals=totals), offsets[chunk])
+
+def test_strategies_need_reference(setup):
+    clock, alignment, X, *_ = setup
+    for strategy in STRATEGIES[1:]:
+        with pytest.raises(ValueError):
+            impute_offsets(strategy, X, clock, alignment)
+    with pytest.raises(ValueError):
+        impute_offsets("median", X, clock, alignment, setup[5])
+
+def test_sample_reference_reads_sampled_rows(synthetic):
+    cell_type = synthetic.cell_types[0]
+    full = load_celltype(synthetic.data_path, cell_type, dtype=np.float32)
+    sample = sample_reference(synthetic.data_path, cell_type, max_cells=50, seed=3)
+    rows = full.obs.index.get_indexer(sample.obs.index)
+    assert len(rows) == 50 and (rows >= 0).all()
+    np.testing.assert_allclose(sample.X.toarray(), full.X[rows].toarray())
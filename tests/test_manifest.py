@@ -0,0 +1,53 @@
+import os
+from manifest import RunManifest
+
+def write(path, text="x"):
+    with open(path, "w") as f:
+        f.write(text)
+
+def test_stale_until_recorded(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.json"))
+    output = str(tmp_path / "out.csv")
+    assert manifest.stale("train/a", {"data": "1"}, [output])
+
+    write(output)
+    manifest.record("train/a", {"data": "1"}, [output])
+    assert not manifest.stale("train/a", {"data": "1"}, [output])
+    assert manifest.stale("train/a", {"data": "2"}, [output])
+    assert manifest.stale("train/b", {"data": "1"}, [output])
+
+def test_stale_when_written_output_is_removed(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.json"))
+    output = str(tmp_path / "out.csv")
+    write(output)
+    manifest.record("train/a", {"data": "1"}, [output])
+    os.remove(output)
+    assert manifest.stale("train/a", {"data": "1"}, [output])
+
+def test_outputs_never_written_do_not_make_stale(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.json"))
+    written, skipped = str(tmp_path / "written.csv"), str(tmp_path / "skipped.csv")
+    write(written)
+    manifest.record("apply/a", {"data": "1"}, [written, skipped])
+    assert manifest.entries["apply/a"]["outputs"] == [written]
+    assert not manifest.stale("apply/a", {"data": "1"}, [written, skipped])
+
+    manifest.record("apply/empty", {"data": "1"}, [skipped])
+    assert not manifest.stale("apply/empty", {"data": "1"}, [skipped])
+
+def test_saved_manifest_reloads(tmp_path):
+    path = str(tmp_path / "nested" / "manifest.json")
+    manifest = RunManifest(path)
+    output = str(tmp_path / "out.csv")
+    write(output)
+    manifest.record("train/a", {"data": "1"}, [output])
+    manifest.record("summary", {"upstream": manifest.upstream_digest(["train/a"])})
+    manifest.save()
+
+    reloaded = RunManifest(path)
+    assert not reloaded.stale("train/a", {"data": "1"}, [output])
+    assert reloaded.keys("train/") == ["train/a"]
+    assert reloaded.upstream_digest(["train/a"]) == manifest.upstream_digest(["train/a"])
+
+    reloaded.record("train/a", {"data": "2"}, [output])
+    assert reloaded.upstream_digest(["train/a"]) != manifest.upstream_digest(["train/a"])
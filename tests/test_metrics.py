@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import pearsonr, rankdata
+from sklearn.metrics import r2_score
+from metrics import METRICS, grouped_metrics, bootstrap_group, bootstrap_ci
+
+def predictions(seed=0, n=400):
+    rng = np.random.default_rng(seed)
+    donors = rng.choice([f"donor{i}" for i in range(15)], n)
+    y_true = pd.Series(rng.integers(20, 80, 15).astype(float), index=[f"donor{i}" for i in range(15)])[donors].to_numpy()
+    y_pred = y_true + rng.normal(0, 8, n)
+    groups = rng.choice(["a", "b"], n)
+    return y_true, y_pred, groups, donors
+
+def test_bootstrap_replicates_match_resampled_donors():
+    y_true, y_pred, _, donors = predictions()
+    rank_true, rank_pred = rankdata(y_true), rankdata(y_pred)
+    replicates = bootstrap_group(y_true, y_pred, rank_true, rank_pred, donors, 20, np.random.default_rng(5))
+
+    labels = pd.unique(donors)
+    counts = np.random.default_rng(5).multinomial(len(labels), np.full(len(labels), 1 / len(labels)), size=20)
+    for replicate, draw in zip(replicates, counts):
+        rows = np.concatenate([np.repeat(np.where(donors == donor)[0], count) for donor, count in zip(labels, draw)])
+        expected = [np.abs(y_pred[rows] - y_true[rows]).mean(), pearsonr(y_true[rows], y_pred[rows])[0],
+                    pearsonr(rank_true[rows], rank_pred[rows])[0], r2_score(y_true[rows], y_pred[rows])]
+        np.testing.assert_allclose(replicate, expected, rtol=1e-9)
+
+def test_bootstrap_ci_brackets_and_is_seeded():
+    y_true, y_pred, groups, donors = predictions()
+    ci = bootstrap_ci(y_true, y_pred, groups, donors, n_boot=200, seed=1)
+    assert list(ci.index) == ["a", "b"]
+    assert list(ci.columns) == [f"{metric}_ci_{side}" for metric in METRICS for side in ["low", "high"]]
+
+    point = grouped_metrics(y_true, y_pred, groups)
+    for metric in METRICS:
+        assert (ci[f"{metric}_ci_low"] <= ci[f"{metric}_ci_high"]).all()
+        assert (ci[f"{metric}_ci_low"] < point[metric]).all() and (point[metric] < ci[f"{metric}_ci_high"]).all()
+
+    pd.testing.assert_frame_equal(ci, bootstrap_ci(y_true, y_pred, groups, donors, n_boot=200, seed=1))
+    assert not ci.equals(bootstrap_ci(y_true, y_pred, groups, donors, n_boot=200, seed=2))
+
+def test_bootstrap_ci_single_donor_is_the_point_estimate():
+    y_true, y_pred, groups, _ = predictions()
+    donors = np.where(groups == "a", "donor_a", "donor_b")
+    ci = bootstrap_ci(y_true, y_pred, groups, donors, n_boot=50)
+    point = grouped_metrics(y_true, y_pred, groups)
+    for metric in METRICS:
+        np.testing.assert_allclose(ci[f"{metric}_ci_low"], point[metric])
+        np.testing.assert_allclose(ci[f"{metric}_ci_high"], point[metric])
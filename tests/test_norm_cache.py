@@ -0,0 +1,31 @@
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import norm_cache
+from norm_cache import write_cache, read_cache
+
+def entry(scale=1.0):
+    X = sp.random(10, 5, density=0.5, format="csr", random_state=0, dtype=np.float32) * scale
+    return X, pd.Index(list("abcde")), pd.DataFrame({"age": np.arange(10)})
+
+def test_cache_round_trip(tmp_path):
+    X, var_names, obs = entry()
+    write_cache(str(tmp_path), "key", X, var_names, obs)
+    cached_X, cached_var_names, cached_obs = read_cache(str(tmp_path), "key")
+    np.testing.assert_array_equal(cached_X.toarray(), X.toarray())
+    assert cached_X.dtype == np.float32
+    assert list(cached_var_names) == list(var_names)
+    pd.testing.assert_frame_equal(cached_obs, obs)
+    assert read_cache(str(tmp_path), "other") is None
+
+def test_concurrent_writers_keep_the_first_entry(tmp_path, monkeypatch):
+    write_cache(str(tmp_path), "key", *entry())
+
+    # A second writer that checked for the entry before the first one renamed it.
+    monkeypatch.setattr(norm_cache.os.path, "exists", lambda path: False)
+    write_cache(str(tmp_path), "key", *entry(2.0))
+    monkeypatch.undo()
+
+    assert os.listdir(tmp_path) == ["key"]
+    np.testing.assert_array_equal(read_cache(str(tmp_path), "key")[0].toarray(), entry()[0].toarray())
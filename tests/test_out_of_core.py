@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from preprocessing import load_celltype
+from sharding import shard_h5ad
+from out_of_core import stratified_order, celltype_source, iter_training_chunks
+from train_model import train_matrix_by_fold, train_out_of_core
+
+@pytest.fixture(scope="module")
+def shard_dir(synthetic, tmp_path_factory):
+    shard_dir = str(tmp_path_factory.mktemp("shards"))
+    shard_h5ad(synthetic.data_path, shard_dir, chunk_size=100)
+    return shard_dir
+
+def test_stratified_order_keeps_donor_proportions():
+    donor_ids = np.repeat(np.array(["a", "b", "c"]), [300, 100, 20])
+    order = stratified_order(donor_ids, np.random.default_rng(0))
+    np.testing.assert_array_equal(np.sort(order), np.arange(len(donor_ids)))
+
+    for size in [21, 105, 210]:
+        counts = np.array([(donor_ids[order[:size]] == donor).sum() for donor in "abc"])
+        np.testing.assert_allclose(counts, size * np.array([300, 100, 20]) / 420, atol=2)
+
+@pytest.mark.parametrize("from_shards", [False, True])
+def test_training_chunks_cover_every_cell_once(synthetic, shard_dir, from_shards):
+    cell_type = synthetic.cell_types[0]
+    shards = shard_dir if from_shards else None
+    expected = load_celltype(synthetic.data_path, cell_type)
+    obs, source = celltype_source(synthetic.data_path, cell_type, shards)
+    np.testing.assert_array_equal(obs["cell_id"], expected.obs["cell_id"])
+
+    chunks = list(iter_training_chunks(source, obs["donor_id"].values, chunk_size=40))
+    positions = np.concatenate([positions for positions, _ in chunks])
+    assert len(chunks) > 1 and all(len(positions) <= 40 for positions, _ in chunks)
+    np.testing.assert_array_equal(np.sort(positions), np.arange(len(obs)))
+    for positions, X in chunks:
+        np.testing.assert_allclose(X.toarray(), expected.X[positions].toarray(), rtol=1e-12)
+
+def test_out_of_core_predictions_follow_coordinate_descent(synthetic):
+    cell_type = synthetic.cell_types[0]
+    data = load_celltype(synthetic.data_path, cell_type)
+    _, expected, _ = train_matrix_by_fold(data, n_folds=3, alphas=(1.0,))
+
+    models, preds, grid, gene_means = train_out_of_core(synthetic.data_path, cell_type, n_folds=3, alphas=(1.0,),
+                                                        epochs=10, chunk_size=128)
+    assert len(models) == 3 and list(grid["n_selected"]) == [3]
+    np.testing.assert_array_equal(preds["cell_id"], expected["cell_id"])
+    assert np.corrcoef(preds["predicted_age"], expected["predicted_age"])[0, 1] > 0.8
+    np.testing.assert_allclose(gene_means, np.asarray(data.X.mean(axis=0)).ravel(), rtol=1e-10)
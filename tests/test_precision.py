@@ -0,0 +1,31 @@
+import numpy as np
+import scipy.sparse as sp
+import anndata as ad
+import pytest
+from preprocessing import normalize_counts, load_celltype
+from precision import validate_precision, check_precision, dataset_targets
+
+def test_normalize_counts_dtype():
+    counts = sp.random(20, 30, density=0.3, format="csr", random_state=0, dtype=np.float64)
+    assert normalize_counts(counts).dtype == np.float32
+    assert normalize_counts(counts, dtype=np.float64).dtype == np.float64
+    assert normalize_counts(counts.astype(np.int64), dtype=np.float64).dtype == np.float64
+
+    original = counts.copy()
+    normalize_counts(counts, copy=False, dtype=np.float32)
+    np.testing.assert_array_equal(counts.toarray(), original.toarray())
+
+def test_training_loads_float64(synthetic):
+    assert load_celltype(synthetic.data_path, synthetic.cell_types[0]).X.dtype == np.float64
+    assert load_celltype(synthetic.data_path, synthetic.cell_types[0], dtype=np.float32).X.dtype == np.float32
+
+def test_float32_scoring_within_tolerance(synthetic):
+    adata = ad.read_h5ad(synthetic.data_path, backed="r")
+    report = validate_precision(adata, dataset_targets("AIDA", adata), synthetic.model_folder,
+                                synthetic.imputation_folder, sample_size=100)
+    assert sorted(report["cell_type"]) == sorted(synthetic.cell_types)
+    assert report["passed"].all() and (report["max_abs_error"] > 0).all()
+    check_precision(report)
+
+    with pytest.raises(ValueError, match="differ from float64"):
+        check_precision(report.assign(passed=False), tolerance=0.0)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from prediction_store import write_predictions, append_predictions, read_predictions, list_partitions, export_csv
+
+def make_predictions(cell_type, n=10, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "cell_id": [f"{cell_type}-{i}" for i in range(n)],
+        "donor_id": rng.choice(["D1", "D2", "D3"], n),
+        "age": rng.choice(["25", "60"], n),
+        "predicted_age": rng.normal(40, 10, n),
+    })
+
+def test_filters_select_partitions(tmp_path):
+    store = str(tmp_path / "store")
+    frames = {(cell_type, clock): make_predictions(cell_type, seed=i)
+              for i, (cell_type, clock) in enumerate([("CD4 T", "CD4 T"), ("CD4 T", "B cell"), ("B/plasma", "B cell")])}
+    for (cell_type, clock), df in frames.items():
+        write_predictions(df, None, store, "Yoshida", cell_type, clock, output_format="parquet")
+
+    assert list_partitions(store, "Yoshida") == sorted(frames)
+    for (cell_type, clock), df in frames.items():
+        result = read_predictions(store, "Yoshida", cell_type, clock).sort_values("cell_id", ignore_index=True)
+        assert (result["cell_type"] == cell_type).all() and (result["clock"] == clock).all()
+        pd.testing.assert_series_equal(result["cell_id"], df["cell_id"].sort_values(ignore_index=True))
+        expected = df.sort_values("cell_id", ignore_index=True)
+        np.testing.assert_allclose(result["predicted_age"], expected["predicted_age"], rtol=1e-6)
+        np.testing.assert_array_equal(result["donor_id"].astype(str), expected["donor_id"])
+        np.testing.assert_array_equal(result["age"], expected["age"].astype(int))
+
+    assert len(read_predictions(store, "Yoshida", clock="B cell")) == 20
+    assert list(read_predictions(store, "Yoshida", columns=["cell_id"]).columns) == ["cell_id"]
+
+def test_rewrite_replaces_appended_parts(tmp_path):
+    store = str(tmp_path / "store")
+    append_predictions(store, "AIDA", "CD4 T", "CD4 T", make_predictions("a"))
+    append_predictions(store, "AIDA", "CD4 T", "CD4 T", make_predictions("b"))
+    assert len(read_predictions(store, "AIDA")) == 20
+
+    csv_path = str(tmp_path / "CD4_T.csv")
+    write_predictions(make_predictions("c", n=5), csv_path, store, "AIDA", "CD4 T", "CD4 T", output_format="both")
+    assert set(read_predictions(store, "AIDA")["cell_id"]) == set(pd.read_csv(csv_path)["cell_id"])
+
+    export_csv(store, "AIDA", str(tmp_path / "export"))
+    exported = pd.read_csv(tmp_path / "export" / "CD4_T.csv")
+    pd.testing.assert_frame_equal(exported.drop(columns="predicted_age"), pd.read_csv(csv_path).drop(columns="predicted_age"))
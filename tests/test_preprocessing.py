@@ -0,0 +1,54 @@
+import numpy as np
+import scipy.sparse as sp
+import anndata as ad
+import pytest
+import legacy
+from preprocessing import normalize_counts, load_celltype, row_nnz, stored_row_bytes
+
+@pytest.fixture
+def counts():
+    X = sp.random(50, 40, density=0.2, format="csr", random_state=0, dtype=np.float64)
+    X.data = np.ceil(X.data * 10)
+    return sp.diags((np.arange(50) != 3).astype(np.float64)) @ X
+
+def test_normalize_counts_matches_legacy(counts):
+    expected = legacy.log_norm(counts).toarray()
+    np.testing.assert_allclose(normalize_counts(counts, dtype=np.float64).toarray(), expected, rtol=1e-12)
+
+def test_normalize_counts_copy_semantics(counts):
+    original = counts.copy()
+    result = normalize_counts(counts, dtype=np.float64)
+    assert result is not counts
+    np.testing.assert_array_equal(counts.toarray(), original.toarray())
+
+    in_place = normalize_counts(counts, copy=False, dtype=np.float64)
+    assert np.shares_memory(in_place.data, counts.data)
+    np.testing.assert_allclose(counts.toarray(), result.toarray())
+
+def test_load_celltype_matches_legacy_loader(synthetic):
+    cell_type = synthetic.cell_types[1]
+    data = load_celltype(synthetic.data_path, cell_type)
+
+    adata = ad.read_h5ad(synthetic.data_path)
+    sub = adata[adata.obs["cell_type"] == cell_type]
+    np.testing.assert_allclose(data.X.toarray(), legacy.log_norm(sp.csr_matrix(sub.X)).toarray(), rtol=1e-6)
+    np.testing.assert_array_equal(data.obs["age"], sub.obs["development_stage"].str.split("-", expand=True)[0].astype(int))
+    np.testing.assert_array_equal(data.obs["cell_id"], sub.obs_names)
+    np.testing.assert_array_equal(data.var_names, adata.var_names)
+
+@pytest.mark.parametrize("layout", ["csr", "csc", "dense"])
+def test_row_nnz_per_encoding(tmp_path, counts, layout):
+    X = {"csr": counts, "csc": counts.tocsc(), "dense": counts.toarray()}[layout]
+    path = str(tmp_path / f"{layout}.h5ad")
+    ad.AnnData(X).write_h5ad(path)
+    adata = ad.read_h5ad(path, backed="r")
+
+    nnz = row_nnz(adata)
+    assert nnz.shape == (counts.shape[0],)
+    if layout == "csr":
+        np.testing.assert_array_equal(nnz, np.diff(counts.indptr))
+    elif layout == "csc":
+        np.testing.assert_allclose(nnz, counts.nnz / counts.shape[0])
+    else:
+        np.testing.assert_array_equal(nnz, counts.shape[1])
+    assert stored_row_bytes(adata).shape == (counts.shape[0],)
@@ -0,0 +1,54 @@
+import os
+import tracemalloc
+import numpy as np
+import pytest
+from profiling import enable, disable, profile, read_metrics, summarize_metrics
+
+@pytest.fixture
+def metrics_path(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    enable(path, trace_memory=True)
+    yield path
+    disable()
+    tracemalloc.stop()
+
+def test_disabled_profile_writes_nothing(tmp_path):
+    disable()
+    with profile("load") as counters:
+        counters["cells"] = 10
+    assert counters == {"cells": 10}
+    assert os.listdir(tmp_path) == []
+
+def test_records_labels_counters_and_status(metrics_path):
+    with profile("load", dataset="Liu", cell_type="CD4 T") as counters:
+        counters["cells"] = 100
+    with pytest.raises(KeyError):
+        with profile("score", dataset="Liu"):
+            raise KeyError("gene")
+
+    records = read_metrics(metrics_path)
+    assert list(records["stage"]) == ["load", "score"]
+    assert list(records["status"]) == ["ok", "error"]
+    assert records.loc[0, "cell_type"] == "CD4 T" and records.loc[0, "cells"] == 100
+    assert records.loc[0, "cells_per_sec"] > 0
+
+def test_nested_blocks_keep_the_outer_peak(metrics_path):
+    with profile("outer"):
+        with profile("first"):
+            big = np.ones(4 * 1024 ** 2 // 8)
+            del big
+        with profile("second"):
+            small = np.ones(1024)
+            del small
+
+    peaks = read_metrics(metrics_path).set_index("stage")["alloc_peak_mb"]
+    assert peaks["first"] >= 4 and peaks["second"] < 1
+    assert peaks["outer"] >= peaks["first"]
+
+def test_summary_shares_are_per_stage(metrics_path):
+    for cell_type in ["a", "b"]:
+        with profile("celltype", cell_type=cell_type) as counters:
+            counters["cells"] = 10
+    summary = summarize_metrics(metrics_path, by=("stage", "cell_type"))
+    assert list(summary["calls"]) == [1, 1] and summary["share"].sum() == pytest.approx(1.0)
+    assert summarize_metrics(metrics_path)["cells"].tolist() == [20]
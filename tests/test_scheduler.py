@@ -0,0 +1,42 @@
+import os
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from scheduler import WorkUnit, run_units, check_failures, UnitsFailed
+
+def touch_or_fail(unit):
+    """Create the file named in unit.clocks; unit 'error' raises and unit 'dead' kills its worker."""
+    if unit.cell_type == "error":
+        raise ValueError("always fails")
+    if unit.cell_type == "dead":
+        os._exit(1)
+    open(unit.clocks[0], "a").close()
+
+def units_in(folder, names):
+    return [WorkUnit("test", name, (str(folder / name),), float(i)) for i, name in enumerate(names)]
+
+def test_sequential_retries_then_reports_failures(tmp_path):
+    calls = []
+    def flaky(unit):
+        calls.append(unit.cell_type)
+        if unit.cell_type == "flaky" and calls.count("flaky") == 1:
+            raise OSError("transient")
+        if unit.cell_type == "error":
+            raise ValueError("always fails")
+
+    units = units_in(tmp_path, ["ok", "flaky", "error"])
+    failures = run_units(flaky, units, retries=2)
+    assert calls == ["ok", "flaky", "flaky", "error", "error", "error"]
+    assert list(failures) == [units[2]] and isinstance(failures[units[2]], ValueError)
+
+    with pytest.raises(UnitsFailed, match="1 work units failed: test / error"):
+        check_failures(failures)
+    check_failures({})
+
+def test_pool_isolates_units_that_fail_or_kill_their_worker(tmp_path):
+    units = units_in(tmp_path, ["a", "error", "b", "dead", "c"])
+    failures = run_units(touch_or_fail, units, workers=2, retries=1)
+
+    assert set(failures) == {units[1], units[3]}
+    assert isinstance(failures[units[1]], ValueError)
+    assert isinstance(failures[units[3]], BrokenProcessPool)
+    assert sorted(os.listdir(tmp_path)) == ["a", "b", "c"]
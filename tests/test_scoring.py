@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import pandas as pd
+import legacy
+from preprocessing import load_celltype
+from scoring import stack_models, score_matrix, stack_clocks, score_clocks
+from gene_alignment import build_alignment
+
+def read_clock(synthetic, cell_type):
+    models = pd.read_csv(os.path.join(synthetic.model_folder, f"{cell_type}_models5.csv"))
+    impute = pd.read_csv(os.path.join(synthetic.imputation_folder, f"Impute_avg_{cell_type}.csv"), index_col=0)
+    return models, impute
+
+def test_score_matrix_matches_legacy_frames(synthetic):
+    for cell_type in synthetic.cell_types:
+        data = load_celltype(synthetic.data_path, cell_type)
+        models, impute = read_clock(synthetic, cell_type)
+        clock = stack_models(models, impute)
+        alignment = build_alignment(data.var_names, clock.genes)
+        assert len(alignment.missing) > 0
+
+        fold_preds, mean = score_matrix(data.X, data.var_names, clock, alignment)
+        assert fold_preds.shape == (data.X.shape[0], len(models))
+
+        expected = legacy.apply_models(data.to_frame(), models, impute)
+        np.testing.assert_allclose(mean, expected.loc[data.obs["cell_id"], "predicted_age"], rtol=1e-10)
+
+def test_score_clocks_matches_score_matrix(synthetic):
+    data = load_celltype(synthetic.data_path, synthetic.cell_types[0])
+    clocks = {cell_type: stack_models(*read_clock(synthetic, cell_type)) for cell_type in synthetic.cell_types}
+    alignments = {name: build_alignment(data.var_names, clock.genes) for name, clock in clocks.items()}
+    block = stack_clocks(clocks, alignments)
+
+    scores = score_clocks(data.X, block)
+    for name, clock in clocks.items():
+        fold_preds, mean = score_matrix(data.X, data.var_names, clock, alignments[name])
+        np.testing.assert_allclose(scores[name][0], fold_preds, rtol=1e-10)
+        np.testing.assert_allclose(scores[name][1], mean, rtol=1e-10)
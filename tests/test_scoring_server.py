@@ -0,0 +1,76 @@
+import asyncio
+import socket
+from urllib.parse import urlencode
+import numpy as np
+import pandas as pd
+import anndata as ad
+import pytest
+from preprocessing import normalize_counts
+from scoring import score_matrix
+from gene_alignment import build_alignment
+from scoring_server import ClockRegistry, serve, predict, encode_sample
+
+@pytest.fixture(scope="module")
+def registry(synthetic):
+    return ClockRegistry(synthetic.model_folder, synthetic.imputation_folder)
+
+@pytest.fixture(scope="module")
+def sample(synthetic):
+    adata = ad.read_h5ad(synthetic.data_path)
+    adata = adata[adata.obs["cell_type"] == synthetic.cell_types[0]][:20].to_memory()
+    obs = pd.DataFrame({"cell_id": adata.obs_names, "donor_id": adata.obs["donor_id"].astype(str).values})
+    return adata.X, adata.var_names, obs
+
+def send(socket_path, data):
+    """Send raw bytes over a new connection and return the status code of the response."""
+    with socket.socket(socket.AF_UNIX) as connection:
+        connection.connect(socket_path)
+        connection.sendall(data)
+        response = b""
+        while chunk := connection.recv(65536):
+            response += chunk
+    return int(response.split(b" ")[1])
+
+def with_server(registry, socket_path, client, **options):
+    """Run client(socket_path) in a thread against a server on socket_path and return its result."""
+    async def main():
+        server = asyncio.create_task(serve(registry, socket_path=socket_path, **options))
+        await asyncio.sleep(0.2)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, client, socket_path)
+        finally:
+            server.cancel()
+    return asyncio.run(main())
+
+def post(body, query="", content_type="application/x-npz", length=None):
+    return (f"POST /predict{query} HTTP/1.1\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body) if length is None else length}\r\nConnection: close\r\n\r\n").encode() + body
+
+def test_predictions_match_score_matrix(registry, sample, synthetic, tmp_path):
+    X, var_names, obs = sample
+    clock = synthetic.cell_types[0]
+    cells, donors = with_server(registry, str(tmp_path / "server.sock"),
+                                lambda path: predict(X, var_names, obs, clocks=[clock], socket_path=path))
+
+    _, expected = score_matrix(normalize_counts(X), var_names, registry.clocks[clock],
+                               build_alignment(var_names, registry.clocks[clock].genes))
+    np.testing.assert_array_equal(cells["cell_id"], obs["cell_id"])
+    np.testing.assert_allclose(cells["predicted_age"], expected, rtol=1e-6)
+    assert set(donors["donor_id"]) == set(obs["donor_id"])
+
+def test_bad_requests_are_refused(registry, sample, synthetic, tmp_path):
+    X, var_names, obs = sample
+    body = encode_sample(X, var_names, obs)
+    query = "?" + urlencode({"clocks": synthetic.cell_types[0]})
+
+    def client(path):
+        return [
+            send(path, post(body)),
+            send(path, post(b"not an archive")),
+            send(path, post(b"not an h5ad file", content_type="application/x-hdf5")),
+            send(path, post(body, query)),
+            # The body of an oversized request is never read, so only its headers are sent.
+            send(path, post(b"", query, length=len(body) * 3)),
+        ]
+    statuses = with_server(registry, str(tmp_path / "server.sock"), client, max_body_mb=len(body) * 2 / 1024 ** 2)
+    assert statuses == [400, 400, 400, 200, 413]
@@ -0,0 +1,49 @@
+import os
+import numpy as np
+import pandas as pd
+import anndata as ad
+import pytest
+from preprocessing import load_celltype
+from sharding import shard_h5ad, read_shard_index
+
+@pytest.fixture(scope="module")
+def colliding(synthetic, tmp_path_factory):
+    """The synthetic dataset with cell types whose names only differ in a space, and a few diseased cells."""
+    adata = ad.read_h5ad(synthetic.data_path)
+    adata.obs["cell_type"] = adata.obs["cell_type"].cat.rename_categories(["CD4 T", "CD4_T"])
+    disease = np.array(["normal"] * adata.n_obs, dtype=object)
+    disease[::7] = "COVID-19"
+    adata.obs["disease"] = pd.Categorical(disease)
+    path = str(tmp_path_factory.mktemp("colliding") / "AIDA.h5ad")
+    adata.write_h5ad(path)
+    return path
+
+def test_shard_round_trip_matches_load_celltype(colliding, tmp_path):
+    shard_dir = str(tmp_path / "shards")
+    index = shard_h5ad(colliding, shard_dir, chunk_size=100)
+    assert sorted(index["cell_types"]) == ["CD4 T", "CD4_T"]
+    assert len({entry["dir"] for entry in index["cell_types"].values()}) == 2
+
+    for cell_type in index["cell_types"]:
+        expected = load_celltype(colliding, cell_type)
+        data = load_celltype(colliding, cell_type, shard_dir=shard_dir)
+        np.testing.assert_allclose(data.X.toarray(), expected.X.toarray(), rtol=1e-12)
+        np.testing.assert_array_equal(data.var_names, expected.var_names)
+        for column in ["cell_id", "donor_id", "age"]:
+            np.testing.assert_array_equal(data.obs[column].astype(str), expected.obs[column].astype(str))
+
+def test_healthy_only_drops_diseased_cells(colliding, tmp_path):
+    index = shard_h5ad(colliding, str(tmp_path / "shards"), healthy_only=True)
+    obs = ad.read_h5ad(colliding, backed="r").obs
+    healthy = obs[obs["disease"] == "normal"]["cell_type"].value_counts()
+    assert {name: entry["n_cells"] for name, entry in index["cell_types"].items()} == healthy.to_dict()
+
+def test_resharding_removes_stale_parts(colliding, tmp_path):
+    shard_dir = str(tmp_path / "shards")
+    shard_h5ad(colliding, shard_dir, chunk_size=100)
+    index = shard_h5ad(colliding, shard_dir, chunk_size=10000)
+
+    for entry in index["cell_types"].values():
+        assert entry["n_parts"] == 1
+        assert sorted(os.listdir(os.path.join(shard_dir, entry["dir"]))) == ["part-00000.npz", "part-00000.obs.csv"]
+    assert read_shard_index(shard_dir) == index
@@ -0,0 +1,45 @@
+import numpy as np
+import scipy.sparse as sp
+from subsampling import take_per_donor, donor_cap, coreset, leverage_scores
+
+def test_take_per_donor_keeps_quotas_and_priority():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 4, 200)
+    priority = rng.random(200)
+    quota = np.array([0, 3, 10, 1000])
+
+    taken = take_per_donor(codes, priority, quota)
+    assert np.all(np.diff(taken) > 0)
+    counts = np.bincount(codes, minlength=4)
+    np.testing.assert_array_equal(np.bincount(codes[taken], minlength=4), np.minimum(quota, counts))
+    for code in range(4):
+        mine = codes == code
+        kept = np.isin(np.where(mine)[0], taken)
+        if kept.any() and not kept.all():
+            assert priority[mine][kept].min() > priority[mine][~kept].max()
+
+def test_donor_cap_and_coreset_are_stratified_by_donor():
+    donor_ids = np.repeat(np.array(["a", "b", "c"]), [50, 5, 1])
+    rows = np.arange(len(donor_ids))[::-1].copy()
+
+    capped = donor_cap(rows, donor_ids, max_cells=10)
+    assert sorted(np.unique(donor_ids[capped], return_counts=True)[1]) == [1, 5, 10]
+
+    leverage = np.random.default_rng(0).random(len(donor_ids))
+    sampled = coreset(rows, donor_ids, leverage, fraction=0.2)
+    assert dict(zip(*np.unique(donor_ids[sampled], return_counts=True))) == {"a": 10, "b": 1, "c": 1}
+
+def test_coreset_without_leverage_is_uniform():
+    donor_ids = np.repeat(np.array(["a", "b"]), 20)
+    rows = np.arange(len(donor_ids))
+    with np.errstate(all="raise"):
+        sampled = coreset(rows, donor_ids, np.zeros(len(donor_ids)), fraction=0.5)
+    assert len(sampled) == 20
+
+def test_leverage_scores_flag_outlying_cells():
+    rng = np.random.default_rng(0)
+    X = sp.csr_matrix(rng.poisson(1.0, size=(300, 40)).astype(float))
+    X[7] = X[7] * 50
+    leverage = leverage_scores(X, n_genes=40, rank=5)
+    assert leverage.shape == (300,) and np.all(leverage <= 1 + 1e-9)
+    assert np.argmax(leverage) == 7
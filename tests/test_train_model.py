@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pytest
+from sklearn.linear_model import ElasticNet
+import legacy
+from preprocessing import load_celltype
+from train_model import donor_folds, train_matrix_by_fold, compile_trained_clock
+from clock_artifacts import get_clock
+
+@pytest.fixture(scope="module")
+def data(synthetic):
+    return load_celltype(synthetic.data_path, synthetic.cell_types[0])
+
+def test_donor_folds_match_legacy_kfold(data):
+    cell_ids = data.obs["cell_id"].to_numpy()
+    expected = list(legacy.donor_splits(data.to_frame()))
+    folds = list(donor_folds(data.obs["donor_id"].values))
+
+    assert len(folds) == len(expected)
+    for (train_rows, test_rows), test_cells in zip(folds, expected):
+        np.testing.assert_array_equal(cell_ids[test_rows], test_cells)
+        assert len(np.intersect1d(train_rows, test_rows)) == 0
+        assert len(train_rows) + len(test_rows) == len(cell_ids)
+
+def test_single_point_grid_is_a_plain_fit(data):
+    models, preds, grid = train_matrix_by_fold(data, n_folds=3, alphas=(0.1,))
+    assert len(models) == 3 and len(preds) == data.X.shape[0]
+    assert grid["n_selected"].tolist() == [3] and np.isnan(grid["mean_mae"]).all()
+
+    y = data.obs["age"].to_numpy(dtype=float)
+    train_rows, test_rows = next(donor_folds(data.obs["donor_id"].values, 3))
+    model = ElasticNet(alpha=0.1, l1_ratio=0.5, max_iter=10000).fit(data.X[train_rows], y[train_rows])
+    np.testing.assert_allclose(models.drop(columns="intercept").iloc[0], model.coef_)
+
+@pytest.mark.parametrize("inner_folds", [None, 3])
+def test_selected_model_is_refitted_on_all_training_rows(data, inner_folds):
+    alphas = (1.0, 0.1)
+    models, preds, grid = train_matrix_by_fold(data, n_folds=3, alphas=alphas, inner_folds=inner_folds)
+    assert list(grid["alpha"]) == [1.0, 0.1]
+    assert grid["n_selected"].sum() == 3 and np.isfinite(grid["mean_mae"]).all()
+
+    y = data.obs["age"].to_numpy(dtype=float)
+    coefs = models.drop(columns="intercept").to_numpy()
+    for fold, (train_rows, test_rows) in enumerate(donor_folds(data.obs["donor_id"].values, 3)):
+        fits = [ElasticNet(alpha=alpha, l1_ratio=0.5, max_iter=10000).fit(data.X[train_rows], y[train_rows])
+                for alpha in alphas]
+        distances = [np.abs(fit.coef_ - coefs[fold]).max() for fit in fits]
+        assert min(distances) < 1e-2
+        fit = fits[int(np.argmin(distances))]
+        fold_preds = preds["predicted_age"].to_numpy()[np.isin(preds["cell_id"], data.obs["cell_id"].values[test_rows])]
+        np.testing.assert_allclose(fold_preds, fit.predict(data.X[test_rows]), atol=0.1)
+
+def test_trained_clock_without_imputation_file_matches_its_csvs(data, tmp_path):
+    models, preds, grid = train_matrix_by_fold(data, n_folds=3, alphas=(0.1,))
+    model_folder, imputation_folder, compiled_folder = (str(tmp_path / name) for name in ("models", "impute", "compiled"))
+    cell_type = "trained"
+    os.makedirs(model_folder)
+    models.to_csv(os.path.join(model_folder, f"{cell_type}_models5.csv"), index=False)
+
+    compile_trained_clock(models, data, cell_type, imputation_folder, compiled_folder, model_folder=model_folder)
+    compiled = get_clock(cell_type, model_folder, imputation_folder, compiled_folder)
+    from_csvs = get_clock(cell_type, model_folder, imputation_folder)
+    assert isinstance(compiled.impute, np.memmap)
+    np.testing.assert_allclose(compiled.impute, from_csvs.impute, rtol=1e-6)
+    columns = data.var_names.get_indexer(from_csvs.genes)
+    np.testing.assert_allclose(from_csvs.impute, np.asarray(data.X[:, columns].mean(axis=0)).ravel(), rtol=1e-6)